@@ -1,6 +1,70 @@
 import os
+import json
 import sqlite3
 import pandas as pd
+from collections import namedtuple
+
+# Pipeline metrics, in the order they are reported. Each stage reports its efficiency
+# followed by its true, false and total linkage counts
+METRICS = ["completeness", "findableObjects", "foundObjects", "missedObjects",
+           "findTrackletsEfficiency", "trueTracklets", "falseTracklets", "tracklets",
+           "collapseTrackletsEfficiency", "trueCollapsedTracklets", "falseCollapsedTracklets", "collapsedTracklets",
+           "purifyTrackletsEfficiency", "truePurifiedTracklets", "falsePurifiedTracklets", "purifiedTracklets",
+           "linkTrackletsEfficiency", "trueTracks", "falseTracks", "tracks"]
+
+_METRIC_LABELS = {"completeness": "Completeness:",
+                  "findableObjects": "Findable Objects:",
+                  "foundObjects": "Found Objects:",
+                  "missedObjects": "Missed Objects:",
+                  "findTrackletsEfficiency": "findTracklets Efficiency:",
+                  "trueTracklets": "True Tracklets:",
+                  "falseTracklets": "False Tracklets:",
+                  "tracklets": "Total Tracklets:",
+                  "collapseTrackletsEfficiency": "collapsedTracklets Efficiency:",
+                  "trueCollapsedTracklets": "True Collapsed Tracklets:",
+                  "falseCollapsedTracklets": "False Collapsed Tracklets:",
+                  "collapsedTracklets": "Total Collapsed Tracklets:",
+                  "purifyTrackletsEfficiency": "purifyTracklets Efficiency:",
+                  "truePurifiedTracklets": "True Purified Tracklets:",
+                  "falsePurifiedTracklets": "False Purified Tracklets:",
+                  "purifiedTracklets": "Total Purified Tracklets:",
+                  "linkTrackletsEfficiency": "linkTracklets Efficiency:",
+                  "trueTracks": "True Tracks:",
+                  "falseTracks": "False Tracks:",
+                  "tracks": "Total Tracks:"}
+
+
+class Metrics(namedtuple("Metrics", METRICS)):
+    """
+    Completeness and per-stage efficiencies and linkage counts of a run (see `calcMetrics`).
+    Printing the metrics renders the results summary, toJson and fromJson
+    convert them to and from JSON.
+    """
+    __slots__ = ()
+
+    def toDict(self):
+        return self._asdict()
+
+    def toJson(self, **kwargs):
+        return json.dumps(self._asdict(), **kwargs)
+
+    @classmethod
+    def fromJson(cls, string):
+        return cls(**json.loads(string))
+
+    def __str__(self):
+        lines = []
+        for i, metric in enumerate(METRICS):
+            # A blank line before every stage
+            if i > 0 and i % 4 == 0:
+                lines.append("")
+            value = getattr(self, metric)
+            # Floats at full precision, as in JSON
+            if isinstance(value, float):
+                value = repr(value)
+            lines.append("%-31s%s" % (_METRIC_LABELS[metric], value))
+        return "\n".join(lines)
+
 
 def findMissedObjects(con):
     missed_objects = pd.read_sql("""SELECT * FROM AllObjects
@@ -269,32 +333,56 @@ def calcCompleteness(con):
     return completeness
 
 
+def calcMetrics(con):
+    """
+    Compute every completeness and efficiency metric reported by `results` with a single
+    aggregate query over AllObjects.
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`
+        Connection to a database with an AllObjects table.
+
+    Returns
+    -------
+    `Metrics`
+        The run's metrics.
+    """
+    counts = con.execute("""SELECT COUNT(DISTINCT CASE WHEN findableAsTrack = 1 THEN objectId END),
+                                   COUNT(DISTINCT CASE WHEN numTrueTracks > 0 THEN objectId END),
+                                   COUNT(DISTINCT CASE WHEN numTrueTracks = 0 AND findableAsTrack = 1 THEN objectId END),
+                                   COALESCE(SUM(numTrueTracklets), 0),
+                                   COALESCE(SUM(numFalseTracklets), 0),
+                                   COALESCE(SUM(numTrueCollapsedTracklets), 0),
+                                   COALESCE(SUM(numFalseCollapsedTracklets), 0),
+                                   COALESCE(SUM(numTruePurifiedTracklets), 0),
+                                   COALESCE(SUM(numFalsePurifiedTracklets), 0),
+                                   COALESCE(SUM(numTrueTracks), 0),
+                                   COALESCE(SUM(numFalseTracks), 0)
+                            FROM AllObjects""").fetchone()
+    findable, found, missed = counts[:3]
+
+    metrics = {"completeness": found / float(_checkZero(findable)),
+               "findableObjects": findable,
+               "foundObjects": found,
+               "missedObjects": missed}
+    stages = [("findTrackletsEfficiency", "Tracklets"),
+              ("collapseTrackletsEfficiency", "CollapsedTracklets"),
+              ("purifyTrackletsEfficiency", "PurifiedTracklets"),
+              ("linkTrackletsEfficiency", "Tracks")]
+    for i, (efficiency, linkages) in enumerate(stages):
+        true, false = counts[3 + 2 * i:5 + 2 * i]
+        metrics["true" + linkages] = true
+        metrics["false" + linkages] = false
+        metrics[linkages[0].lower() + linkages[1:]] = true + false
+        metrics[efficiency] = true / float(_checkZero(true + false))
+    return Metrics(**metrics)
+
+
 def results(con):
-    print "Completeness:                  %s" % calcCompleteness(con)
-    print "Findable Objects:              %s" % countFindableObjects(con)
-    print "Found Objects:                 %s" % countFoundObjects(con)
-    print "Missed Objects:                %s" % countMissedObjects(con)
-    print ""
-    print "findTracklets Efficiency:      %s" % calcFindTrackletsEfficiency(con)
-    print "True Tracklets:                %s" % countTrueTracklets(con)
-    print "False Tracklets:               %s" % countFalseTracklets(con)
-    print "Total Tracklets:               %s" % countTracklets(con)
-    print ""
-    print "collapsedTracklets Efficiency: %s" % calcCollapseTrackletsEfficiency(con)
-    print "True Collapsed Tracklets:      %s" % countTrueCollapsedTracklets(con)
-    print "False Collapsed Tracklets:     %s" % countFalseCollapsedTracklets(con)
-    print "Total Collapsed Tracklets:     %s" % countCollapsedTracklets(con)
-    print ""
-    print "purifyTracklets Efficiency:    %s" % calcPurifyTrackletsEfficiency(con)
-    print "True Purified Tracklets:       %s" % countTruePurifiedTracklets(con)
-    print "False Purified Tracklets:      %s" % countFalsePurifiedTracklets(con)
-    print "Total Purified Tracklets:      %s" % countPurifiedTracklets(con)
-    print ""
-    print "linkTracklets Efficiency:      %s" % calcLinkTrackletsEfficiency(con)
-    print "True Tracks:                   %s" % countTrueTracks(con)
-    print "False Tracks:                  %s" % countFalseTracks(con)
-    print "Total Tracks:                  %s" % countTracks(con)
-    return
+    metrics = calcMetrics(con)
+    print(metrics)
+    return metrics
 
 
 def _checkZero(num):
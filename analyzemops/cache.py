@@ -0,0 +1,297 @@
+import os
+import shutil
+import hashlib
+import tempfile
+
+__all__ = ["hashFile", "callKey", "fetch", "store", "fetchFiles", "storeFiles", "evict"]
+
+# Default maximum total size of a stage output cache in bytes
+CACHE_SIZE_MAX = 100 * 1024**3
+
+def hashFile(fileName):
+    """
+    Returns the SHA-1 hex digest of a file's contents.
+
+    Parameters
+    ----------
+    fileName : str
+        Path to file.
+
+    Returns
+    -------
+    str
+        Hex digest of the file's contents.
+    """
+    sha = hashlib.sha1()
+    stream = open(fileName, "rb")
+    for chunk in iter(lambda: stream.read(2**20), b""):
+        sha.update(chunk)
+    stream.close()
+    return sha.hexdigest()
+
+def callKey(call, outFile):
+    """
+    Returns the cache key of a MOPS call. A call is either a list of command-line
+    arguments or a (function, arguments) tuple to be run in-process. Every argument
+    that is an existing file is replaced by the hash of its contents, the output file
+    by a placeholder, and everything else (the program and the parameters the stage
+    consumes) is kept as is. Two calls therefore share a key only if they run the
+    same program with the same parameters on the same input data, wherever their
+    files are.
+
+    Parameters
+    ----------
+    call : list or tuple
+        MOPS call.
+
+    outFile : str
+        Path to the call's output file.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the call.
+    """
+    if isinstance(call, tuple):
+        function, functionArgs = call
+        args = ["%s.%s" % (function.__module__, function.__name__)] + list(functionArgs)
+    else:
+        args = list(call)
+
+    sha = hashlib.sha1()
+    for arg in args:
+        if arg == outFile:
+            token = "<output>"
+        elif isinstance(arg, str) and os.path.isfile(arg):
+            token = "<file:%s>" % hashFile(arg)
+        else:
+            token = str(arg)
+        sha.update(token.encode("utf-8") + b"\0")
+    return sha.hexdigest()
+
+def fetch(cacheDir, key, outFiles):
+    """
+    Link the cached outputs of a call into place. Existing files at the output
+    paths are replaced. The entry's modification time is updated so that
+    recently used entries are evicted last.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Cache directory.
+
+    key : str
+        Cache key of the call (see `callKey`).
+
+    outFiles : list
+        Paths the call's outputs should be placed at, in the same order as
+        they were stored.
+
+    Returns
+    -------
+    bool
+        True if the call was in the cache, False otherwise.
+    """
+    entry = _entry(cacheDir, key)
+    if not os.path.isdir(entry):
+        return False
+
+    for i, outFile in enumerate(outFiles):
+        cached = os.path.join(entry, str(i))
+        if not os.path.isfile(cached):
+            continue
+        if os.path.lexists(outFile):
+            os.remove(outFile)
+        _link(cached, outFile)
+
+    os.utime(entry, None)
+    return True
+
+def store(cacheDir, key, outFiles):
+    """
+    Add the outputs of a call to the cache. Outputs are hard-linked into the cache
+    when possible (copied otherwise). If another process has already stored the same
+    call, the cache is left unchanged.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Cache directory.
+
+    key : str
+        Cache key of the call (see `callKey`).
+
+    outFiles : list
+        Paths to the call's outputs. Outputs that do not exist are skipped.
+
+    Returns
+    -------
+    None
+    """
+    # Outputs are stored by position since the same call may produce
+    # differently named outputs in another night or run
+    _storeEntry(cacheDir, key, outFiles, [str(i) for i in range(len(outFiles))])
+    return
+
+def fetchFiles(cacheDir, key, outDir):
+    """
+    Link the cached outputs of a call stored with `storeFiles` into outDir, under
+    the names they were stored with. Existing files with the same names are replaced.
+    The entry's modification time is updated so that recently used entries are
+    evicted last.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Cache directory.
+
+    key : str
+        Cache key of the call (see `callKey`).
+
+    outDir : str
+        Directory to place the call's outputs in.
+
+    Returns
+    -------
+    list or None
+        Paths to the call's outputs in outDir, None if the call was not in the cache.
+    """
+    entry = _entry(cacheDir, key)
+    if not os.path.isdir(entry):
+        return None
+
+    outFiles = []
+    for name in sorted(os.listdir(entry)):
+        outFile = os.path.join(outDir, name)
+        if os.path.lexists(outFile):
+            os.remove(outFile)
+        _link(os.path.join(entry, name), outFile)
+        outFiles.append(outFile)
+
+    os.utime(entry, None)
+    return outFiles
+
+def storeFiles(cacheDir, key, outFiles):
+    """
+    Add the outputs of a call to the cache under their file names, for calls whose
+    outputs are not known until they have run (see `fetchFiles`). Outputs are
+    hard-linked into the cache when possible (copied otherwise). If another process
+    has already stored the same call, the cache is left unchanged.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Cache directory.
+
+    key : str
+        Cache key of the call (see `callKey`).
+
+    outFiles : list
+        Paths to the call's outputs, no two with the same file name.
+
+    Returns
+    -------
+    None
+    """
+    _storeEntry(cacheDir, key, outFiles, [os.path.basename(outFile) for outFile in outFiles])
+    return
+
+def _storeEntry(cacheDir, key, outFiles, names):
+    """
+    Store outputs in a cache entry under the given names. Outputs that do not
+    exist are skipped.
+
+    """
+    entry = _entry(cacheDir, key)
+    if os.path.isdir(entry):
+        return
+
+    parent = os.path.dirname(entry)
+    if not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # Another process created it first
+            if not os.path.isdir(parent):
+                raise
+
+    # Build the entry elsewhere and move it into place so that an entry
+    # is either complete or absent
+    tmp = tempfile.mkdtemp(dir=parent, prefix=".tmp")
+    for outFile, name in zip(outFiles, names):
+        if os.path.isfile(outFile):
+            _link(outFile, os.path.join(tmp, name))
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp)
+    return
+
+def evict(cacheDir, sizeMax=CACHE_SIZE_MAX, verbose=False):
+    """
+    Remove the least recently used cache entries until the total size of the
+    cache is no more than sizeMax bytes. Outputs that are still hard-linked into
+    run directories only free their space once those are removed as well.
+
+    Parameters
+    ----------
+    cacheDir : str
+        Cache directory.
+
+    sizeMax : int, optional
+        Maximum total size of the cache in bytes. [Default = `CACHE_SIZE_MAX`]
+
+    verbose : bool, optional
+        Print progress statements? [Default = False]
+
+    Returns
+    -------
+    int
+        Number of entries removed.
+    """
+    if not os.path.isdir(cacheDir):
+        return 0
+
+    entries = []
+    for prefix in os.listdir(cacheDir):
+        prefixDir = os.path.join(cacheDir, prefix)
+        if not os.path.isdir(prefixDir):
+            continue
+        for key in os.listdir(prefixDir):
+            entry = os.path.join(prefixDir, key)
+            if key.startswith(".tmp") or not os.path.isdir(entry):
+                continue
+            size = sum([os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)])
+            entries.append((os.path.getmtime(entry), size, entry))
+
+    total = sum([size for mtime, size, entry in entries])
+    removed = 0
+    for mtime, size, entry in sorted(entries):
+        if total <= sizeMax:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        removed += 1
+
+    if verbose is True:
+        print("Evicted {} entries from {}, {:.2f} GB remain.".format(removed, cacheDir, total / 1024.**3))
+    return removed
+
+def _entry(cacheDir, key):
+    """
+    Returns the directory holding a cache entry.
+
+    """
+    return os.path.join(cacheDir, key[:2], key)
+
+def _link(source, destination):
+    """
+    Hard-link source to destination, copying if the two are on different
+    file systems.
+
+    """
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return
@@ -23,4 +23,6 @@ class Config(object):
     tracklet_members_table = "TrackletMembers"
     track_table = "AllTracks"
     track_members_table = "TrackMembers"
+    # Directory in which to look for detection stores, see analyzemops.detections
+    diasource_store_dir = None
     verbose = True
\ No newline at end of file
@@ -0,0 +1,225 @@
+import os
+import numpy as np
+import pandas as pd
+import multiprocessing
+
+from .config import Config
+
+__all__ = ["DIASOURCE_DTYPE", "DIASOURCE_SUFFIX", "diaSourceStore", "writeDiaSourceStore", "writeDiaSourceStores",
+           "readDiaSourceStore", "findDiaIds"]
+
+# Columns of a nightly diasource file
+DIASOURCE_COLUMNS = ["diaId", "visitId", "objectId", "ra", "dec", "mjd", "mag", "snr"]
+# Record layout of a detection store: the diasource columns followed by the row of the
+# detection in the diasource file (its index as used by collapseTracklets and friends)
+DIASOURCE_DTYPE = np.dtype([("diaId", "<i8"),
+                            ("visitId", "<i8"),
+                            ("objectId", "<i8"),
+                            ("ra", "<f8"),
+                            ("dec", "<f8"),
+                            ("mjd", "<f8"),
+                            ("mag", "<f8"),
+                            ("snr", "<f8"),
+                            ("row", "<i8")])
+DIASOURCE_SUFFIX = ".dias"
+DIASOURCE_STORE_SUFFIX = ".npy"
+
+def diaSourceStore(diasourceFile, storeDir=None):
+    """
+    Returns the path to the detection store of a nightly diasource file if it exists
+    and is at least as new as the diasource file, None otherwise.
+
+    Parameters
+    ----------
+    diasourceFile : str
+        Path to nightly diasource file.
+
+    storeDir : str, optional
+        Directory containing detection stores. If None, `Config.diasource_store_dir`
+        is used, and if that is None as well no store is looked for. [Default = None]
+
+    Returns
+    -------
+    str or None
+        Path to detection store.
+    """
+    if storeDir is None:
+        storeDir = Config.diasource_store_dir
+        if storeDir is None:
+            return None
+    storeFile = _storeFile(diasourceFile, storeDir)
+    if os.path.isfile(storeFile) and os.path.getmtime(storeFile) >= os.path.getmtime(diasourceFile):
+        return storeFile
+    return None
+
+def writeDiaSourceStore(diasourceFile, storeDir):
+    """
+    Convert a nightly diasource file into a detection store: a structured .npy array
+    of fixed-width records (see `DIASOURCE_DTYPE`) sorted by diaId, that can be memory-mapped
+    (see `readDiaSourceStore`) instead of parsing the text file again. Every record keeps the
+    row of its detection in the diasource file. The store is written to a temporary file
+    in storeDir and moved into place, so it is either complete or absent.
+
+    Parameters
+    ----------
+    diasourceFile : str
+        Path to nightly diasource file.
+
+    storeDir : str
+        Directory in which to write the detection store.
+
+    Returns
+    -------
+    str
+        Path to detection store.
+    """
+    storeFile = _storeFile(diasourceFile, storeDir)
+
+    if os.path.getsize(diasourceFile) == 0:
+        detections = np.zeros(0, dtype=DIASOURCE_DTYPE)
+    else:
+        diaSources = pd.read_csv(diasourceFile, sep=r"\s+", header=None, names=DIASOURCE_COLUMNS)
+        detections = np.zeros(len(diaSources), dtype=DIASOURCE_DTYPE)
+        for column in DIASOURCE_COLUMNS:
+            detections[column] = diaSources[column].values
+        detections["row"] = np.arange(len(detections))
+        detections = detections[np.argsort(detections["diaId"], kind="mergesort")]
+
+    tmpFile = "{}.{}.tmp".format(storeFile, os.getpid())
+    # np.save adds .npy to names without it
+    stream = open(tmpFile, "wb")
+    np.save(stream, detections)
+    stream.close()
+    os.rename(tmpFile, storeFile)
+    return storeFile
+
+def writeDiaSourceStores(diasources, storeDir,
+                         overwrite=False,
+                         enableMultiprocessing=True,
+                         processes=8,
+                         verbose=Config.verbose):
+    """
+    Convert many nightly diasource files into detection stores in storeDir
+    (see `writeDiaSourceStore`). Diasource files with an up to date store are skipped,
+    so this only has to be done once per set of detections.
+
+    Parameters
+    ----------
+    diasources : list
+        List of paths to nightly diasource files.
+
+    storeDir : str
+        Directory in which to write the detection stores, created if it does not exist.
+
+    overwrite : bool, optional
+        Rewrite stores that are up to date? [Default = False]
+
+    enableMultiprocessing : bool, optional
+        Convert files in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    list
+        List of paths to detection stores, in the same order as diasources.
+    """
+    if not os.path.isdir(storeDir):
+        os.makedirs(storeDir)
+
+    convert = [diasource for diasource in diasources
+               if overwrite is True or diaSourceStore(diasource, storeDir=storeDir) is None]
+    if verbose is True:
+        print("Converting {} of {} diasource files to detection stores...".format(len(convert), len(diasources)))
+
+    if enableMultiprocessing and len(convert) > 1:
+        if verbose is True:
+            print("Using %s CPUs in parallel." % (min(processes, len(convert))))
+        p = multiprocessing.Pool(processes=min(processes, len(convert)))
+        p.map(_writeDiaSourceStore, [(diasource, storeDir) for diasource in convert], chunksize=1)
+        p.close()
+        p.join()
+    else:
+        for diasource in convert:
+            writeDiaSourceStore(diasource, storeDir)
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return [_storeFile(diasource, storeDir) for diasource in diasources]
+
+def _writeDiaSourceStore(args):
+    """
+    Worker function for `writeDiaSourceStores`: args is a (diasourceFile, storeDir) tuple.
+
+    """
+    diasourceFile, storeDir = args
+    return writeDiaSourceStore(diasourceFile, storeDir)
+
+def _storeFile(diasourceFile, storeDir):
+    """
+    Path to the detection store of a nightly diasource file in storeDir.
+
+    """
+    return os.path.join(storeDir, os.path.basename(diasourceFile) + DIASOURCE_STORE_SUFFIX)
+
+def readDiaSourceStore(storeFile):
+    """
+    Memory-map a detection store. Columns are accessed by name (for example
+    detections["mjd"]) without reading the store into memory.
+
+    Parameters
+    ----------
+    storeFile : str
+        Path to detection store.
+
+    Returns
+    -------
+    `numpy.memmap`
+        Read-only structured array of detections sorted by diaId (see `DIASOURCE_DTYPE`).
+
+    Raises
+    ------
+    ValueError
+        If the file is not a detection store.
+    """
+    detections = np.load(storeFile, mmap_mode="r")
+    if detections.dtype != DIASOURCE_DTYPE:
+        raise ValueError("{} is not a detection store.".format(storeFile))
+    return detections
+
+def findDiaIds(detections, diaIds):
+    """
+    Find detections by diaId in a detection store with a binary search.
+
+    Parameters
+    ----------
+    detections : `numpy.ndarray`
+        Detection store (see `readDiaSourceStore`).
+
+    diaIds : `numpy.ndarray`
+        DiaIds to find.
+
+    Returns
+    -------
+    `numpy.ndarray`
+        Positions of the diaIds in the store, detections[positions] are the records
+        and detections["row"][positions] their rows in the diasource file.
+
+    Raises
+    ------
+    ValueError
+        If any of the diaIds are not in the store.
+    """
+    diaIds = np.asarray(diaIds)
+    positions = np.searchsorted(detections["diaId"], diaIds)
+    found = positions < len(detections)
+    found[found] = detections["diaId"][positions[found]] == diaIds[found]
+    if not np.all(found):
+        raise ValueError("{} diaIds not found in detection store.".format(np.sum(~found)))
+    return positions
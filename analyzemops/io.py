@@ -1,14 +1,66 @@
 import os
+import shutil
+import operator
 import numpy as np
 import pandas as pd
 import sqlite3 as sql
-import difflib
+import multiprocessing
+from contextlib import contextmanager
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
 
 from .config import Config 
+from .linkages import readLinkages
+from .linkages import readLinkTrackletsOut
+from .linkages import iterLinkages
+from .linkages import _parseLinkages
 
 __all__ = ["readDetectionsIntoDatabase", "readTrackletsIntoDatabase", "readTracksIntoDatabase",
-           "buildTrackletDatabase", "buildTrackDatabase", "attachDatabases",
-           "_findNewLinesAndDeletedIndices", "_makeNewLinkageDataFrames"]
+           "buildTrackletDatabase", "buildTrackDatabase", "attachDatabases", "bulkLoad",
+           "indexDatabase", "indexDatabases", "annotateTracklets",
+           "annotateTracks", "annotateManyTracks", "buildObjectsTable",
+           "exportParquet", "readParquet",
+           "_findNewLinesAndDeletedIndices", "_findNewLinkagesAndDeletedIndices",
+           "_makeNewLinkageDataFrames"]
+
+# Page size of newly built databases in bytes, larger pages make for fewer, longer reads
+# when scanning member tables
+DATABASE_PAGE_SIZE = 16384
+# Page cache used while bulk loading a database in bytes
+BULK_LOAD_CACHE_SIZE = 512 * 1024**2
+# Indexes built after loading, as (table, columns). Member tables are indexed both ways
+# round so that joins in either direction are answered from the index alone
+DATABASE_INDEXES = [("TrackletMembers", ("trackletId", "diaId")),
+                    ("TrackletMembers", ("diaId", "trackletId")),
+                    ("AllTracklets", ("createdBy",)),
+                    ("AllTracklets", ("deletedBy",)),
+                    ("AllTracklets", ("linkedObjectId",)),
+                    ("TrackMembers", ("trackId", "diaId")),
+                    ("TrackMembers", ("diaId", "trackId")),
+                    ("AllTracks", ("createdBy",)),
+                    ("AllTracks", ("deletedBy",)),
+                    ("AllTracks", ("linkedObjectId",)),
+                    ("AllTracks", ("windowId",)),
+                    ("DiaSources", ("objectId",))]
+# Number of rows per Parquet row group, the unit in which exported tables are read and skipped
+PARQUET_ROW_GROUP_SIZE = 131072
+# Operators accepted in readParquet filters
+_FILTER_OPERATORS = {"=": operator.eq,
+                     "==": operator.eq,
+                     "!=": operator.ne,
+                     "<": operator.lt,
+                     "<=": operator.le,
+                     ">": operator.gt,
+                     ">=": operator.ge,
+                     "in": lambda values, value: np.isin(values, list(value))}
 
 def readDetectionsIntoDatabase(detsFile, con,
                                detectionsTable=Config.detection_table,
@@ -21,8 +73,10 @@ def readDetectionsIntoDatabase(detsFile, con,
                                mapObjectIds=True,
                                verbose=Config.verbose):
     """
-    Reads a full detection file into a database and creates a database view representative 
-    of the input detections needed for MOPS to run. 
+    Reads a full detection file into a database and creates a table (DiaSources) of 
+    the input detections in the form needed for MOPS to run. The file is read in chunks:
+    every chunk is appended to the detections table as is, and to the DiaSources
+    table with its objectIds mapped as it is read.
 
     The input detection file columns should contain the columns needed for MOPS to run. The
     column mapping can be defined using the detsFileColumns keyword argument. The keys to this
@@ -31,7 +85,8 @@ def readDetectionsIntoDatabase(detsFile, con,
 
     If the input detection file objectIds are not integer values MOPS will not be able to run. To
     map these to MOPS-friendly integer values use the mapObjectIds keyword argument. This will create
-    a mapping table in the database. Additionally, if the input dataset has noise detections use the 
+    a mapping table in the database, objectIds are numbered from 1 in the order they are first 
+    seen. Additionally, if the input dataset has noise detections use the 
     specialIds dictionary (keys are the objectId in the detection file, values should be the desired 
     negative integers to map those objectIds to). 
 
@@ -82,113 +137,69 @@ def readDetectionsIntoDatabase(detsFile, con,
     None
 
     """
+    columns = ["diaId", "visitId", "objectId", "ra", "dec", "mjd", "mag", "snr"]
     if verbose is True:
-        print("Reading {} into {} table".format(detsFile, detectionsTable))
-    for chunk in pd.read_csv(detsFile, chunksize=chunksize, **readParams):
-        chunk.to_sql(detectionsTable, con, if_exists="append", index=False)
-    
+        print("Creating {} table using the following columns:".format(diaSourcesTable))
+        for column in columns:
+            print("\t{} : {}".format(column, detsFileColumns[column]))
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS {} (
+            diaId INTEGER PRIMARY KEY,
+            visitId INTEGER,
+            objectId INTEGER,
+            ra REAL,
+            dec REAL,
+            mjd REAL,
+            mag REAL,
+            snr REAL
+        );
+        """.format(diaSourcesTable))
+
     if mapObjectIds is True:
         if verbose is True:
             print("Creating {} table".format(mappingTable))
-        con.execute("""CREATE TABLE Mapping (objectId INTEGER PRIMARY KEY, {} VARCHAR)""".format(detsFileColumns["objectId"]))
-        
-        if verbose is True:
-            print("Mapping {} to MOPS-friendly integer objectIds".format(detsFileColumns["objectId"]))
+        con.execute("""CREATE TABLE {} (objectId INTEGER PRIMARY KEY, {} VARCHAR)""".format(mappingTable, detsFileColumns["objectId"]))
+
+        # Input objectId to MOPS-friendly integer objectId, new objectIds are numbered
+        # from 1 in the order they are first seen
+        objectIds = {}
+        nextObjectId = 1
         if specialIds is not None:
-            objects = pd.read_sql("""SELECT DISTINCT {} FROM {}
-                                     WHERE {} NOT IN ('{}')""".format(detsFileColumns["objectId"],
-                                                                      detectionsTable,
-                                                                      detsFileColumns["objectId"],
-                                                                      "', '".join(specialIds.keys())), con)
             if verbose is True:
-                print("Found {} unique objectIds".format(len(objects)))
                 print("Mapping the following specialIds to:")
-            for key in specialIds:
-                if verbose is True:
+                for key in specialIds:
                     print("\t{} : {}".format(key, specialIds[key]))
-            objects["objectId"] = objects.index + 1
-            objects = objects.append(pd.DataFrame(zip(specialIds.keys(), specialIds.values()),
-                                                  columns=[objects.columns[0], objects.columns[1]]))
-        else:
-            objects = pd.read_sql("""SELECT DISTINCT {} FROM {}""".format(detsFileColumns["objectId"],
-                                                                          detectionsTable), con) 
-            if verbose is True:
-                print("Found {} unique objectIds".format(len(objects)))                                                       
-            objects["objectId"] = objects.index + 1
+            objectIds.update(specialIds)
+            _insertRows(con, mappingTable, pd.DataFrame({"objectId": list(specialIds.values()),
+                                                         detsFileColumns["objectId"]: list(specialIds.keys())},
+                                                        columns=["objectId", detsFileColumns["objectId"]]))
 
-        if verbose is True:
-            print("Building {} table".format(mappingTable))
-        objects.sort_values("objectId", inplace=True)
-        objects.to_sql(mappingTable, con, index=False, if_exists="append")
+    if verbose is True:
+        print("Reading {} into {} and {} tables".format(detsFile, detectionsTable, diaSourcesTable))
+    with bulkLoad(con, verbose=verbose):
+        for chunk in pd.read_csv(detsFile, chunksize=chunksize, **readParams):
+            chunk.to_sql(detectionsTable, con, if_exists="append", index=False)
+
+            diaSources = pd.DataFrame(dict([(column, chunk[detsFileColumns[column]].values) for column in columns]),
+                                      columns=columns)
+            if mapObjectIds is True:
+                codes, uniques = pd.factorize(chunk[detsFileColumns["objectId"]])
+                new = [objectId for objectId in uniques if objectId not in objectIds]
+                if len(new) > 0:
+                    newIds = np.arange(nextObjectId, nextObjectId + len(new))
+                    objectIds.update(zip(new, newIds.tolist()))
+                    _insertRows(con, mappingTable, pd.DataFrame({"objectId": newIds, detsFileColumns["objectId"]: new},
+                                                                columns=["objectId", detsFileColumns["objectId"]]))
+                    nextObjectId += len(new)
+
+                # Detections without an objectId (code -1) are given a NULL objectId
+                mapped = np.array([objectIds[objectId] for objectId in uniques] + [np.nan])
+                diaSources["objectId"] = mapped[codes]
+            _insertRows(con, diaSourcesTable, diaSources)
 
-        if verbose is True:
-            print("Creating {} view using the following columns:".format(diaSourcesTable))
-            print("\tdiaId : {}".format(detsFileColumns["diaId"]))
-            print("\tvisitId : {}".format(detsFileColumns["visitId"]))
-            print("\tobjectId : {}".format(detsFileColumns["objectId"]))
-            print("\tra : {}".format(detsFileColumns["ra"]))
-            print("\tdec : {}".format(detsFileColumns["dec"]))
-            print("\tmjd : {}".format(detsFileColumns["mjd"]))
-            print("\tmag : {}".format(detsFileColumns["mag"]))
-            print("\tsnr : {}".format(detsFileColumns["snr"]))
-
-        con.execute("""CREATE VIEW {} AS
-                            SELECT d.{} AS diaId,
-                                   d.{} AS visitId,
-                                   m.objectId AS objectId,
-                                   d.{} AS ra,
-                                   d.{} AS dec,
-                                   d.{} AS mjd,
-                                   d.{} AS mag,
-                                   d.{} AS snr
-                            FROM {} AS d
-                            JOIN {} AS m ON 
-                                d.{} = m.{}
-                            ;""".format(diaSourcesTable,
-                                        detsFileColumns["diaId"],
-                                        detsFileColumns["visitId"],
-                                        detsFileColumns["ra"],
-                                        detsFileColumns["dec"],
-                                        detsFileColumns["mjd"],
-                                        detsFileColumns["mag"],
-                                        detsFileColumns["snr"],
-                                        detectionsTable,
-                                        mappingTable,
-                                        detsFileColumns["objectId"],
-                                        detsFileColumns["objectId"]))
-    else:
-        if verbose is True:
-            print("Creating {} view using the following columns:".format(diaSourcesTable))
-            print("\tdiaId : {}".format(detsFileColumns["diaId"]))
-            print("\tvisitId : {}".format(detsFileColumns["visitId"]))
-            print("\tobjectId : {}".format(detsFileColumns["objectId"]))
-            print("\tra : {}".format(detsFileColumns["ra"]))
-            print("\tdec : {}".format(detsFileColumns["dec"]))
-            print("\tmjd : {}".format(detsFileColumns["mjd"]))
-            print("\tmag : {}".format(detsFileColumns["mag"]))
-            print("\tsnr : {}".format(detsFileColumns["snr"]))
-
-        con.execute("""CREATE VIEW {} AS
-                            SELECT d.{} AS diaId,
-                                   d.{} AS visitId,
-                                   d.{} AS objectId,
-                                   d.{} AS ra,
-                                   d.{} AS dec,
-                                   d.{} AS mjd,
-                                   d.{} AS mag,
-                                   d.{} AS snr
-                            FROM {} AS d
-                            ;""".format(diaSourcesTable,
-                                        detsFileColumns["diaId"],
-                                        detsFileColumns["visitId"],
-                                        detsFileColumns["objectId"],
-                                        detsFileColumns["ra"],
-                                        detsFileColumns["dec"],
-                                        detsFileColumns["mjd"],
-                                        detsFileColumns["mag"],
-                                        detsFileColumns["snr"],
-                                        detectionsTable))
     if verbose is True:
+        if mapObjectIds is True:
+            print("Found {} unique objectIds".format(nextObjectId - 1))
         print("Done.")
     return 
 
@@ -197,9 +208,17 @@ def readTrackletsIntoDatabase(trackletFile, con,
                               purifiedTrackletFile=None,
                               finalTrackletFile=None,
                               trackletIdStart=1,
+                              chunkSize=None,
                               verbose=Config.verbose):
     """
     Read a nightly set of tracklet files into a tracklets database. 
+
+    Tracklets are followed from file to file by their members: a tracklet missing from the next
+    file was deleted by that stage, a tracklet only found in the next file was created by it (see
+    `_findNewLinkagesAndDeletedIndices`). If chunkSize is given the files are read and written in
+    blocks of that many bytes. Memory use is then set by chunkSize and the lineage kept for
+    every tracklet (hashed members, createdBy, deletedBy and line numbers: of order a hundred
+    bytes per tracklet) rather than by the size of the files.
     
     Parameters
     ----------
@@ -222,154 +241,111 @@ def readTrackletsIntoDatabase(trackletFile, con,
     trackletIdStart : int, optional
         TrackletId from which to start numbering new tracklets. [Default = 1]
 
+    chunkSize : int, optional
+        Number of bytes of each tracklet file to read at once. If None, files are read whole.
+        [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = `Config.verbose`]
 
     Returns
     -------
-    None
+    `pandas.DataFrame`
+        AllTracklets DataFrame.
 
+    `pandas.DataFrame`
+        TrackletMembers DataFrame, None if read in chunks.
     """
+    linkageFiles, stages = _trackletStages(trackletFile, collapsedTrackletFile, purifiedTrackletFile, finalTrackletFile)
     if verbose is True:
-        print("Reading {} into database...".format(trackletFile))
-    # Read in a tracklets file. With the current version of MOPS 10 million tracklets in a night is roughly
-    # a file of order a GB. This can be read in memory, if, in the unfortunate event that more tracklets are generated
-    # a night. We might need to swap to reading in chunks.
-    trackletMembers = pd.read_csv(trackletFile, header=None, names=["diaId"])
-    if len(trackletMembers) == 0:
-        if verbose is True:
-            print("{} has no tracklets. Skipping.".format(trackFile))
-        return        
-    # Create an array of integer trackletIds
-    trackletIds = np.arange(trackletIdStart, trackletIdStart + len(trackletMembers), dtype=int)
-    trackletId_max = trackletIds[-1]
-    # Read in the trackletFile where every row is a string of diaIds delimited by whitespace
-    # Split the string of diaIds into separate columns and then stack the columns so that every tracklet has 
-    # a row for every diaId
-    trackletMembers = pd.DataFrame(pd.DataFrame(trackletMembers["diaId"].str.split(" ").tolist(), index=trackletIds).stack(), columns=["diaId"])
-    trackletMembers.reset_index(1, drop=True, inplace=True)
-    trackletMembers["trackletId"] = trackletMembers.index
-    trackletMembers = trackletMembers[["trackletId", "diaId"]]
-    # Not all tracklets have the same number of detections, empty detections needs to be dropped
-    trackletMembers["diaId"].replace("", np.nan, inplace=True)
-    trackletMembers.dropna(inplace=True)
-    
-    allTracklets = pd.DataFrame(trackletMembers["trackletId"].unique(), columns=["trackletId"])
-    allTracklets["numMembers"] = trackletMembers["trackletId"].value_counts().sort_index().values
-    allTracklets["createdBy"] = np.ones(len(allTracklets), dtype=int) * 1
-    allTracklets["deletedBy"] = np.zeros(len(allTracklets), dtype=int)
-    allTracklets["_lineNum_1"] = np.arange(1, len(allTracklets) + 1, dtype=int)
-    allTracklets["_lineNum_2"] = np.nan
-    allTracklets["_lineNum_3"] = np.nan
-    allTracklets["_lineNum_4"] = np.nan
-    
-    allTracklets_temp = allTracklets
-    trackletMembers_temp = trackletMembers
-    prev_line_col = "_lineNum_1"
-    
-    if collapsedTrackletFile is not None:
-        if verbose is True:
-            print("Reading {} into database...".format(collapsedTrackletFile))
-        # collapseTracklets can both create and destroy tracklets by merging
-        created_by_collapse, created_by_collapse_inds, deleted_by_collapse_ind = _findNewLinesAndDeletedIndices(trackletFile, collapsedTrackletFile)
-        trackletFile = collapsedTrackletFile
-
-        # If collapseTracklets deleted any tracklets, set deletedBy to 2
-        if len(deleted_by_collapse_ind) > 0:
-            allTracklets.loc[allTracklets[prev_line_col].isin(deleted_by_collapse_ind), "deletedBy"] = 2
-        
-        # If collapseTracklets created any tracklets, create temporary allTracklets and trackletMember
-        # DataFrames for the new tracklets
-        if len(created_by_collapse) > 0:
-            trackletMembers_temp, allTracklets_temp = _makeNewLinkageDataFrames(created_by_collapse, linkageType="trackletId", createdBy=2, idStart=allTracklets["trackletId"].max() + 1)         
-            allTracklets_temp["_lineNum_2"] = created_by_collapse_inds
-        
-            # Combine the temporary DataFrames with the main ones
-            trackletMembers = pd.concat([trackletMembers, trackletMembers_temp], ignore_index=True)
-            allTracklets = pd.concat([allTracklets, allTracklets_temp], ignore_index=True)
-            trackletMembers.reset_index(inplace=True, drop=True)
-            allTracklets.reset_index(inplace=True, drop=True)
-        
-        # Fill in the line numbers for tracklets that weren't deleted or created by collapseTracklets
-        total_lines_collapsed = len(allTracklets[allTracklets["createdBy"] == 2]) + len(allTracklets[(allTracklets["createdBy"] == 1) & (allTracklets["deletedBy"] == 0)])
-        line_nums_collapsed = np.arange(1, total_lines_collapsed + 1)
-        line_nums_not_assigned = np.in1d(line_nums_collapsed, allTracklets[allTracklets["createdBy"] == 2]["_lineNum_2"].values, invert=True)
-        allTracklets.sort_values(prev_line_col, inplace=True)
-        allTracklets.loc[allTracklets[(allTracklets["createdBy"] == 1) & (allTracklets["deletedBy"] == 0)].index.values, "_lineNum_2"] = line_nums_collapsed[line_nums_not_assigned]          
-        
-        prev_line_col = "_lineNum_2"
-            
-    if purifiedTrackletFile is not None:
+        print("Following tracklets through {}...".format(", ".join(linkageFiles)))
+    lineage = _readLinkageLineage(linkageFiles, chunkSize=chunkSize)
+    return _writeTracklets(con, linkageFiles, stages, lineage, trackletIdStart=trackletIdStart, chunkSize=chunkSize, verbose=verbose)
+
+def _trackletStages(trackletFile, collapsedTrackletFile=None, purifiedTrackletFile=None, finalTrackletFile=None):
+    """
+    Returns the list of a night's tracklet files that exist and an array of the
+    stage that made each (findTracklets: 1, collapseTracklets: 2, purifyTracklets: 3,
+    removeSubsets: 4).
+
+    """
+    stages = [1]
+    linkageFiles = [trackletFile]
+    for stage, linkageFile in [(2, collapsedTrackletFile), (3, purifiedTrackletFile), (4, finalTrackletFile)]:
+        if linkageFile is not None:
+            stages.append(stage)
+            linkageFiles.append(linkageFile)
+    return linkageFiles, np.array(stages)
+
+def _readTrackletLineage(args):
+    """
+    Worker function for `readManyTrackletsIntoDatabase`: args is a (linkageFiles, chunkSize)
+    tuple, see `_readLinkageLineage`.
+
+    """
+    linkageFiles, chunkSize = args
+    return _readLinkageLineage(linkageFiles, chunkSize=chunkSize)
+
+def _writeTracklets(con, linkageFiles, stages, lineage, trackletIdStart=1, chunkSize=None, verbose=Config.verbose):
+    """
+    Write a night's tracklets into the database given their lineage (see `_readLinkageLineage`)
+    and commit. Tracklets are numbered from trackletIdStart in the order they were created.
+    Returns the AllTracklets and TrackletMembers DataFrames (None if read in chunks), or None
+    if there are no tracklets.
+
+    """
+    numMembers, created, deleted, lineNums, newLines = lineage
+    if len(numMembers) == 0:
         if verbose is True:
-            print("Reading {} into database...".format(purifiedTrackletFile))
-        # purifyTracklets can only delete tracklets by removing individual detections (this may change)
-        created_by_purify, created_by_purify_inds, deleted_by_purify_ind = _findNewLinesAndDeletedIndices(trackletFile, purifiedTrackletFile)
-        trackletFile = purifiedTrackletFile
-   
-        # If purifyTracklets deleted any tracklets, set deletedBy to 3
-        if len(deleted_by_purify_ind) > 0:
-            allTracklets.loc[allTracklets[prev_line_col].isin(deleted_by_purify_ind), "deletedBy"] = 3
-           
-        # If purifyTracklets created any new tracklets, create temporary allTracklets and trackletMember 
-        # DataFrames for the new tracklets
-        if len(created_by_purify) > 0:
-            trackletMembers_temp, allTracklets_temp = _makeNewLinkageDataFrames(created_by_purify, linkageType="trackletId", createdBy=3, idStart=allTracklets["trackletId"].max() + 1)
-            allTracklets_temp["_lineNum_3"] = created_by_purify_inds
-            
-            # Combine the temporary DataFrames with the main ones
-            trackletMembers = pd.concat([trackletMembers, trackletMembers_temp], ignore_index=True)
-            allTracklets = pd.concat([allTracklets, allTracklets_temp], ignore_index=True)
-            trackletMembers.reset_index(inplace=True, drop=True)
-            allTracklets.reset_index(inplace=True, drop=True)
-        
-        # Fill in the line numbers for tracklets that weren't deleted or created by purifyTracklets
-        total_lines_purified = (len(allTracklets[allTracklets["createdBy"] == 3])
-                                + len(allTracklets[((allTracklets["createdBy"] == 1) | (allTracklets["createdBy"] == 2))
-                                                   & (allTracklets["deletedBy"] == 0)]))
-        line_nums_purified = np.arange(1, total_lines_purified + 1)
-        line_nums_not_assigned = np.in1d(line_nums_purified, allTracklets[allTracklets["createdBy"] == 3]["_lineNum_3"].values, invert=True)
-        allTracklets.sort_values(prev_line_col, inplace=True)
-        allTracklets.loc[allTracklets[((allTracklets["createdBy"] == 2) | (allTracklets["createdBy"] == 1)) & (allTracklets["deletedBy"] == 0)].index.values, "_lineNum_3"] = line_nums_purified[line_nums_not_assigned]          
-        
-        prev_line_col = "_lineNum_3"
-        
-    if finalTrackletFile is not None:
+            print("{} has no tracklets. Skipping.".format(linkageFiles[0]))
+        return
+
+    # Write the members of every tracklet in the order tracklets were created
+    trackletMembers = []
+    trackletIdNext = trackletIdStart
+    blockLines = 1
+    for linkageFile, new in zip(linkageFiles, newLines):
         if verbose is True:
-            print("Reading {} into database...".format(finalTrackletFile))
-        # removeSubsets can only delete tracklets (this may change)
-        created_by_remove_subsets, created_by_remove_subsets_inds, deleted_by_remove_subsets_ind = _findNewLinesAndDeletedIndices(trackletFile, finalTrackletFile)
-        
-        # If removeSubsets deleted any tracklets, set deletedBy to 4
-        if len(deleted_by_remove_subsets_ind) > 0:
-            allTracklets.loc[allTracklets[prev_line_col].isin(deleted_by_remove_subsets_ind), "deletedBy"] = 4
-            
-        # If removeSubsets created any new tracklets, create temporary allTracklets and trackletMember 
-        # DataFrames for the new tracklets
-        if len(created_by_remove_subsets) > 0:    
-            trackletMembers_temp, allTracklets_temp = _makeNewLinkageDataFrames(created_by_remove_subsets, linkageType="trackletId", createdBy=4, idStart=allTracklets["trackletId"].max() + 1)
-            allTracklets_temp["_lineNum_4"] = created_by_remove_subsets_inds
-            
-            # Combine the temporary DataFrames with the main ones
-            trackletMembers = pd.concat([trackletMembers, trackletMembers_temp], ignore_index=True)
-            allTracklets = pd.concat([allTracklets, allTracklets_temp], ignore_index=True)
-            trackletMembers.reset_index(inplace=True, drop=True)
-            allTracklets.reset_index(inplace=True, drop=True)
-        
-        # Fill in the line numbers for tracklets that weren't deleted or created by removeSubsets
-        total_lines_remove_subsets = (len(allTracklets[allTracklets["createdBy"] == 4])
-                                + len(allTracklets[((allTracklets["createdBy"] == 1) | (allTracklets["createdBy"] == 2) | (allTracklets["createdBy"] == 3))
-                                                   & (allTracklets["deletedBy"] == 0)]))
-        line_nums_remove_subsets = np.arange(1, total_lines_remove_subsets + 1)
-        line_nums_not_assigned = np.in1d(line_nums_remove_subsets, allTracklets[allTracklets["createdBy"] == 4]["_lineNum_4"].values, invert=True)
-        allTracklets.sort_values(prev_line_col, inplace=True)
-        allTracklets.loc[allTracklets[((allTracklets["createdBy"] == 3) | (allTracklets["createdBy"] == 2) | (allTracklets["createdBy"] == 1)) & (allTracklets["deletedBy"] == 0)].index.values, "_lineNum_4"] = line_nums_remove_subsets[line_nums_not_assigned]
-        
-    # Arrange allTracklet columns
-    allTracklets = allTracklets[["trackletId", "numMembers", "createdBy", "deletedBy", "_lineNum_1", "_lineNum_2", "_lineNum_3", "_lineNum_4"]]
-    
-    # Store DataFrames in database
-    trackletMembers.to_sql("TrackletMembers", con, if_exists="append", index=False)
-    allTracklets.to_sql("AllTracklets", con, if_exists="append", index=False)
+            print("Reading {} into database...".format(linkageFile))
+        lineStart = 0
+        for members, offsets in iterLinkages(linkageFile, chunkSize=chunkSize):
+            lengths = np.diff(offsets)
+            select = new[lineStart:lineStart + len(lengths)]
+            lineStart += len(lengths)
+            blockLines = max(blockLines, len(lengths))
+            if not np.any(select):
+                continue
+            selectOffsets = np.zeros(np.sum(select) + 1, dtype=np.int64)
+            selectOffsets[1:] = np.cumsum(lengths[select])
+            blockMembers, _ = _makeLinkageDataFrames(members[np.repeat(select, lengths)], selectOffsets,
+                                                     linkageType="trackletId", idStart=trackletIdNext)
+            trackletIdNext += len(selectOffsets) - 1
+            _insertRows(con, "TrackletMembers", blockMembers)
+            if chunkSize is None:
+                trackletMembers.append(blockMembers)
+
+    allTracklets = pd.DataFrame({"trackletId": np.arange(trackletIdStart, trackletIdStart + len(numMembers), dtype=np.int64),
+                                 "numMembers": numMembers,
+                                 "createdBy": stages[created],
+                                 "deletedBy": np.where(deleted >= 0, stages[deleted], 0)},
+                                columns=["trackletId", "numMembers", "createdBy", "deletedBy"])
+    for stage in range(1, 5):
+        if stage in stages:
+            allTracklets["_lineNum_{}".format(stage)] = lineNums[:, np.flatnonzero(stages == stage)[0]]
+        else:
+            allTracklets["_lineNum_{}".format(stage)] = np.nan
+    if chunkSize is None:
+        _insertRows(con, "AllTracklets", allTracklets)
+    else:
+        # Inserting converts every row to Python objects, insert as many rows at once as a chunk has lines
+        for rowStart in range(0, len(allTracklets), blockLines):
+            _insertRows(con, "AllTracklets", allTracklets.iloc[rowStart:rowStart + blockLines])
+    con.commit()
+
+    if chunkSize is None:
+        trackletMembers = pd.concat(trackletMembers, ignore_index=True)
+    else:
+        trackletMembers = None
     if verbose is True:
         print("Done.")
         print("")
@@ -378,6 +354,7 @@ def readTrackletsIntoDatabase(trackletFile, con,
 def readTracksIntoDatabase(trackFile, trackOutFile, con,
                            finalTrackFile=None,
                            trackIdStart=1,
+                           windowId=None,
                            verbose=Config.verbose):
     """
     Read a nightly set of track files into a tracks database. 
@@ -397,6 +374,10 @@ def readTracksIntoDatabase(trackFile, trackOutFile, con,
     trackIdStart : int, optional
         TrackId from which to start numbering new tracks. [Default = 1]
 
+    windowId : int, optional
+        Window the tracks belong to, for databases holding many windows
+        (see `buildTrackDatabase`). [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = `Config.verbose`]
 
@@ -406,46 +387,42 @@ def readTracksIntoDatabase(trackFile, trackOutFile, con,
     """
     if verbose is True:
         print("Reading {} into database...".format(trackFile))
-    trackMembers = pd.read_csv(trackFile, header=None, names=["diaId"])
-    if len(trackMembers) == 0:
+    # Read in the trackFile as a flat array of diaIds and the offsets of each track into it
+    members, offsets = readLinkages(trackFile)
+    if offsets[-1] == 0:
         if verbose is True:
             print("{} has no tracks. Skipping.".format(trackFile))
         return
-    # Create an array of integer trackIds
-    trackIds = np.arange(trackIdStart, trackIdStart + len(trackMembers), dtype=int)
-    trackId_max = trackIds[-1]
-    # Read in the trackFile where every row is a string of diaIds delimited by whitespace
-    # Split the string of diaIds into separate columns and then stack the columns so that every track has 
-    # a row for every diaId
-    trackMembers = pd.DataFrame(pd.DataFrame(trackMembers["diaId"].str.split(" ").tolist(), index=trackIds).stack(), columns=["diaId"])
-    trackMembers.reset_index(1, drop=True, inplace=True)
-    trackMembers["trackId"] = trackMembers.index
-    trackMembers = trackMembers[["trackId", "diaId"]]
-    # Not all tracks have the same number of detections, empty detections needs to be dropped
-    trackMembers["diaId"].replace("", np.nan, inplace=True)
-    trackMembers.dropna(inplace=True)
-    
-    allTracks = pd.DataFrame(trackMembers["trackId"].unique(), columns=["trackId"])
-    allTracks["numMembers"] = trackMembers["trackId"].value_counts().sort_index().values
-    allTracks["createdBy"] = np.ones(len(allTracks), dtype=int) * 5
-    allTracks["deletedBy"] = np.zeros(len(allTracks), dtype=int)
+    trackMembers, allTracks = _makeLinkageDataFrames(members, offsets, linkageType="trackId", createdBy=5, idStart=trackIdStart)
     allTracks["_lineNum_5"] = np.arange(1, len(allTracks) + 1, dtype=int)
     allTracks["_lineNum_6"] = np.nan
     
-    # Read in chi-squared values from trackOutFile
-    chiSq = pd.read_csv(trackOutFile, sep=" ", skiprows=7, skipfooter=9, error_bad_lines=False, warn_bad_lines=False,  engine='python',
-                        names=["_temp", "chiSqDec", "chiSqRa", "fitRange"])
-    chiSq.drop(chiSq[chiSq["_temp"] != "chi_sq:"].index, inplace=True)
-    chiSq.reset_index(drop=True, inplace=True)
-    chiSq["trackId"] = allTracks["trackId"]
-    chiSq.drop(['_temp'], axis = 1, inplace = True)
-    allTracks = allTracks.merge(chiSq, on="trackId")
+    # Read in chi-squared values from trackOutFile, one per line of the trackFile
+    chiSq, summary = readLinkTrackletsOut(trackOutFile)
+    numTracks = len(offsets) - 1
+    if len(chiSq["chiSqDec"]) == 0:
+        if verbose is True:
+            print("{} has no chi-squared values.".format(trackOutFile))
+        for column in chiSq:
+            chiSq[column] = np.full(numTracks, np.nan)
+    elif len(chiSq["chiSqDec"]) != numTracks:
+        raise ValueError("{} has chi-squared values for {} tracks but {} has {} tracks.".format(trackOutFile,
+                                                                                              len(chiSq["chiSqDec"]),
+                                                                                              trackFile,
+                                                                                              numTracks))
+    if verbose is True:
+        for step, seconds in summary["timings"]:
+            print("linkTracklets {}: {:.2f} seconds.".format(step, seconds))
+    # Empty tracks are not in allTracks
+    nonEmpty = np.diff(offsets) > 0
+    for column in ["chiSqDec", "chiSqRa", "fitRange"]:
+        allTracks[column] = chiSq[column][nonEmpty]
       
     if finalTrackFile is not None:
         if verbose is True:
             print("Reading {} into database...".format(finalTrackFile))
         # removeSubsets can only delete tracks (this may change)
-        created_by_remove_subsets, created_by_remove_subsets_inds, deleted_by_remove_subsets_ind = _findNewLinesAndDeletedIndices(trackFile, finalTrackFile)
+        created_by_remove_subsets, created_by_remove_subsets_inds, deleted_by_remove_subsets_ind, matched_line_nums = _findNewLinkagesAndDeletedIndices(trackFile, finalTrackFile)
         
         # If removeSubsets deleted any tracks, set deletedBy to 4
         if len(deleted_by_remove_subsets_ind) > 0:
@@ -453,8 +430,8 @@ def readTracksIntoDatabase(trackFile, trackOutFile, con,
             
         # If removeSubsets created any new tracks, create temporary allTracks and trackMember 
         # DataFrames for the new tracks
-        if len(created_by_remove_subsets) > 0:    
-            trackMembers_temp, allTracks_temp = _makeNewLinkageDataFrames(created_by_remove_subsets, linkageType="trackId", createdBy=5, idStart=allTracks["trackId"].max() + 1)
+        if len(created_by_remove_subsets_inds) > 0:    
+            trackMembers_temp, allTracks_temp = _makeLinkageDataFrames(*created_by_remove_subsets, linkageType="trackId", createdBy=5, idStart=allTracks["trackId"].max() + 1)
             allTracks_temp["_lineNum_6"] = created_by_remove_subsets_inds
             
             # Combine the temporary DataFrames with the main ones
@@ -463,20 +440,23 @@ def readTracksIntoDatabase(trackFile, trackOutFile, con,
             trackMembers.reset_index(inplace=True, drop=True)
             allTracks.reset_index(inplace=True, drop=True)
         
-        # Fill in the line numbers for tracks that weren't deleted or created by removeSubsets
-        total_lines_remove_subsets = (len(allTracks[allTracks["createdBy"] == 6])
-                                + len(allTracks[((allTracks["createdBy"] == 5) & (allTracks["deletedBy"] == 0))]))
-        line_nums_remove_subsets = np.arange(1, total_lines_remove_subsets + 1)
-        line_nums_not_assigned = np.in1d(line_nums_remove_subsets, allTracks[allTracks["createdBy"] == 6]["_lineNum_6"].values, invert=True)
+        # Fill in the line numbers for tracks that weren't deleted or created by removeSubsets,
+        # from the line they were matched to in the final track file
+        kept = allTracks["_lineNum_5"].isin(matched_line_nums[:, 0]).values
+        line_nums_remove_subsets = pd.Series(matched_line_nums[:, 1], index=matched_line_nums[:, 0])
+        allTracks.loc[kept, "_lineNum_6"] = line_nums_remove_subsets.loc[allTracks.loc[kept, "_lineNum_5"].values].values
         allTracks.sort_values("_lineNum_5", inplace=True)
-        allTracks.loc[allTracks[(allTracks["createdBy"] == 5) & (allTracks["deletedBy"] == 0)].index.values, "_lineNum_6"] = line_nums_remove_subsets[line_nums_not_assigned]
 
     # Arrange allTrack columns
     allTracks = allTracks[["trackId", "numMembers", "createdBy", "deletedBy", "chiSqDec", "chiSqRa", "fitRange", "_lineNum_5", "_lineNum_6"]]
+    if windowId is not None:
+        allTracks.insert(1, "windowId", windowId)
+        trackMembers.insert(1, "windowId", windowId)
     
     # Store DataFrames in database
-    trackMembers.to_sql("TrackMembers", con, if_exists="append", index=False)
-    allTracks.to_sql("AllTracks", con, if_exists="append", index=False)
+    _insertRows(con, "TrackMembers", trackMembers)
+    _insertRows(con, "AllTracks", allTracks)
+    con.commit()
     if verbose is True:
         print("Done.")
         print("")
@@ -510,6 +490,7 @@ def buildTrackletDatabase(database, outDir,
     """
     database = os.path.join(os.path.abspath(outDir), "", database)
     con = sql.connect(database)
+    con.execute("PRAGMA page_size = {}".format(DATABASE_PAGE_SIZE))
     
     if verbose is True:
         print("Creating DiaSources table...")
@@ -594,10 +575,16 @@ def buildTrackletDatabase(database, outDir,
     return con, database
 
 def buildTrackDatabase(database, outDir,
+                       partitioned=False,
                        verbose=Config.verbose):
     """
     Build track database with AllTracks and TrackMembers table,
     and the Tracks and FinalTracks views.  
+
+    A partitioned database holds the tracks of many windows: AllTracks and TrackMembers
+    have a windowId column and a Windows table records each window's name, nights and
+    range of trackIds. Windows are loaded one after the other with consecutive trackIds,
+    so every window's rows are stored together and can be read with a range scan.
     
     Parameters
     ----------
@@ -607,6 +594,9 @@ def buildTrackDatabase(database, outDir,
     outDir : str
         Path to desired out directory for the database.
 
+    partitioned : bool, optional
+        Build a database for the tracks of many windows? [Default = False]
+
     verbose : bool, optional
         Print progress statements? [Default = `Config.verbose`]
         
@@ -620,12 +610,16 @@ def buildTrackDatabase(database, outDir,
     """
     database = os.path.join(os.path.abspath(outDir), "", database)
     con = sql.connect(database)
+    con.execute("PRAGMA page_size = {}".format(DATABASE_PAGE_SIZE))
+    windowColumn = ""
+    if partitioned is True:
+        windowColumn = "\n            windowId INTEGER,"
 
     if verbose is True:
         print("Creating AllTracks table...")
     con.execute("""
         CREATE TABLE AllTracks (
-            trackId INTEGER PRIMARY KEY,
+            trackId INTEGER PRIMARY KEY,{}
             linkedObjectId INTEGER,
             numLinkedObjects INTEGER,
             numMembers INTEGER,
@@ -642,15 +636,29 @@ def buildTrackDatabase(database, outDir,
             _lineNum_5 INTEGER,
             _lineNum_6 INTEGER
         );
-        """)
+        """.format(windowColumn))
     if verbose is True:
         print("Creating TrackMembers table...")
     con.execute("""
         CREATE TABLE TrackMembers (
-            trackId INTEGER,
+            trackId INTEGER,{}
             diaId INTEGER
         );
-        """)
+        """.format(windowColumn))
+
+    if partitioned is True:
+        if verbose is True:
+            print("Creating Windows table...")
+        con.execute("""
+            CREATE TABLE Windows (
+                windowId INTEGER PRIMARY KEY,
+                name TEXT,
+                windowStart REAL,
+                windowEnd REAL,
+                trackIdStart INTEGER,
+                trackIdEnd INTEGER
+            );
+            """)
 
     if verbose is True:
         print("Creating Tracks view...")
@@ -672,17 +680,89 @@ def buildTrackDatabase(database, outDir,
 
     return con, database
 
-def readManyTrackletsIntoDatabase(tracker, verbose=Config.verbose):
+@contextmanager
+def bulkLoad(con, cacheSize=BULK_LOAD_CACHE_SIZE, checkIntegrity=True, verbose=Config.verbose):
+    """
+    Context manager for loading large amounts of data into a database. While active, the
+    rollback journal is kept in memory, writes are not synced to disk and the page cache is
+    enlarged. On exit, any open transaction is committed, the database's integrity is checked
+    (if checkIntegrity is True) and the previous settings are restored. A database left by a crash during a bulk load
+    may be corrupt and should be rebuilt.
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection`
+        Database connection.
+
+    cacheSize : int, optional
+        Page cache size in bytes. [Default = `BULK_LOAD_CACHE_SIZE`]
+
+    checkIntegrity : bool, optional
+        Run SQLite's integrity check on exit? [Default = True]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Raises
+    ------
+    `sqlite3.DatabaseError`
+        If the database fails its integrity check.
+    """
+    # Pragmas can not change the journal mode in the middle of a transaction
+    con.commit()
+    pragmas = ["journal_mode", "synchronous", "cache_size", "temp_store"]
+    settings = dict([(pragma, con.execute("PRAGMA {}".format(pragma)).fetchone()[0]) for pragma in pragmas])
+    con.execute("PRAGMA journal_mode = MEMORY")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute("PRAGMA cache_size = {}".format(-int(cacheSize // 1024)))
+    con.execute("PRAGMA temp_store = MEMORY")
+
+    try:
+        yield con
+        con.commit()
+        if checkIntegrity is True:
+            if verbose is True:
+                print("Checking database integrity...")
+            problems = [row[0] for row in con.execute("PRAGMA integrity_check")]
+            if problems != ["ok"]:
+                raise sql.DatabaseError("Database failed integrity check: {}".format("; ".join(problems)))
+    except Exception:
+        con.rollback()
+        raise
+    finally:
+        for pragma in pragmas:
+            con.execute("PRAGMA {} = {}".format(pragma, settings[pragma]))
+
+def readManyTrackletsIntoDatabase(tracker,
+                                  chunkSize=None,
+                                  enableMultiprocessing=True,
+                                  processes=8,
+                                  verbose=Config.verbose):
     """
     Read many tracklet files into a single database. Adds the path to the newly created database
     to the trackletDatabase attribute of the given tracker. Saves the updated 
     tracker to the run directory. 
 
+    Nights are read and compared stage to stage (see `readTrackletsIntoDatabase`) in parallel,
+    while a single writer inserts them into the database in night order. TrackletIds are
+    numbered consecutively across nights, so the database is the same however many processes are used.
+
     Parameters
     ----------
     tracker : `analyzemops.tracker`
         A tracker populated with MOPS output files.
 
+    chunkSize : int, optional
+        Number of bytes of each tracklet file to read at once (see `readTrackletsIntoDatabase`).
+        If None, files are read whole. [Default = None]
+
+    enableMultiprocessing : bool, optional
+        Read nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors. 
+        [Default = 8]
+
     verbose : bool, optional
         Print progress statements? [Default = `Config.verbose`]
 
@@ -691,20 +771,14 @@ def readManyTrackletsIntoDatabase(tracker, verbose=Config.verbose):
     'analyzemops.tracker'
         The updated tracker with the trackletDatabase attribute populated.
     """
-    tracklet_con, tracklet_db = buildTrackletDatabase("tracklets.db", tracker.runDir)
+    tracklet_con, tracklet_db = buildTrackletDatabase("tracklets.db", tracker.runDir, verbose=verbose)
     tracker.trackletDatabase = tracklet_db
-    
+
+    nights = []
     for i, trackletFile in enumerate(tracker.tracklets):
-        max_tracklet_id = pd.read_sql("""SELECT MAX(trackletId) AS trackletId FROM AllTracklets""", tracklet_con)["trackletId"].values[0]
-        if max_tracklet_id is not None:
-            trackletIdStart = max_tracklet_id + 1
-        else:
-            trackletIdStart = 1
-        
         kwargs = {"collapsedTrackletFile": None, 
                   "purifiedTrackletFile": None, 
-                  "finalTrackletFile": None, 
-                  "trackletIdStart": trackletIdStart}
+                  "finalTrackletFile": None}
 
         if tracker.collapsedTrackletsById is not None:
             kwargs["collapsedTrackletFile"] = tracker.collapsedTrackletsById[i]
@@ -714,59 +788,1148 @@ def readManyTrackletsIntoDatabase(tracker, verbose=Config.verbose):
 
         if tracker.finalTrackletsById is not None:
             kwargs["finalTrackletFile"] = tracker.finalTrackletsById[i]
-            
-        readTrackletsIntoDatabase(trackletFile, tracklet_con, verbose=verbose, **kwargs)
-        tracker.toYaml(outDir=tracker.runDir)
-        
+
+        nights.append(_trackletStages(trackletFile, **kwargs))
+
+    args = [(linkageFiles, chunkSize) for linkageFiles, stages in nights]
+    if enableMultiprocessing and len(nights) > 1:
+        if verbose is True:
+            print("Using %s CPUs in parallel." % (min(processes, len(nights))))
+        p = multiprocessing.Pool(processes=min(processes, len(nights)))
+
+        def readLineages():
+            # Results come back in night order, later nights wait for earlier ones to be
+            # written. Nights are read a batch at a time since imap would otherwise read
+            # every night ahead of the writes and hold them all in memory
+            for start in range(0, len(args), processes):
+                for lineage in p.imap(_readTrackletLineage, args[start:start + processes], chunksize=1):
+                    yield lineage
+
+        lineages = readLineages()
+    else:
+        lineages = (_readTrackletLineage(arg) for arg in args)
+
+    trackletIdStart = 1
+    with bulkLoad(tracklet_con, verbose=verbose):
+        for (linkageFiles, stages), lineage in zip(nights, lineages):
+            if verbose is True:
+                print("Writing tracklets from {}...".format(", ".join(linkageFiles)))
+            _writeTracklets(tracklet_con, linkageFiles, stages, lineage,
+                            trackletIdStart=trackletIdStart,
+                            chunkSize=chunkSize,
+                            verbose=verbose)
+            trackletIdStart += len(lineage[0])
+
+    if enableMultiprocessing and len(nights) > 1:
+        p.close()
+        p.join()
+
+    tracker.toYaml(outDir=tracker.runDir)
     return tracker
 
-def readManyTracksIntoDatabases(tracker, verbose=Config.verbose):
+def readManyTracksIntoDatabases(tracker, partitioned=False, verbose=Config.verbose):
     """
     Read many track files into databases. Adds the paths to the newly created databases
     to the windowDatabases attribute of the given tracker. Saves the updated 
     tracker to the run directory. 
 
+    If partitioned, every window is instead read into a single partitioned database
+    (tracks.db, see `buildTrackDatabase`) whose path is added to the trackDatabase attribute.
+    TrackIds are numbered consecutively across windows either way.
+
     Parameters
     ----------
     tracker : `analyzemops.tracker`
         A tracker populated with MOPS output files.
 
+    partitioned : bool, optional
+        Read all windows into one partitioned database? [Default = False]
+
     verbose : bool, optional
         Print progress statements? [Default = `Config.verbose`]
 
     Returns
     -------
     'analyzemops.tracker'
-        The updated tracker with the windowDatabases attribute populated.
+        The updated tracker with the windowDatabases or trackDatabase attribute populated.
     """
-    tracker.windowDatabases = []
+    if partitioned is True:
+        tracker.windowDatabases = None
+        track_con, track_db = buildTrackDatabase("tracks.db", tracker.runDir, partitioned=True, verbose=verbose)
+        tracker.trackDatabase = track_db
+    else:
+        tracker.windowDatabases = []
+        tracker.trackDatabase = None
     trackIdStart = 1
     
     for i, (trackFile, trackOutFile) in enumerate(zip(tracker.tracks, tracker.trackOuts)):
-        track_con, track_db = buildTrackDatabase(trackFile.split("/")[-1].split(".")[0] + ".db", tracker.runDir)
-        tracker.windowDatabases.append(track_db)
+        windowName = trackFile.split("/")[-1].split(".")[0]
+        if partitioned is False:
+            track_con, track_db = buildTrackDatabase(windowName + ".db", tracker.runDir)
+            tracker.windowDatabases.append(track_db)
         
         kwargs = {"finalTrackFile": None, 
                   "trackIdStart": trackIdStart}
 
         if tracker.finalTracks is not None:
             kwargs["finalTrackFile"] = tracker.finalTracks[i]
+
+        if partitioned is True:
+            kwargs["windowId"] = i + 1
             
-        readTracksIntoDatabase(trackFile, trackOutFile, track_con, verbose=verbose, **kwargs)
+        with bulkLoad(track_con, verbose=verbose):
+            readTracksIntoDatabase(trackFile, trackOutFile, track_con, verbose=verbose, **kwargs)
         
         max_track_id = pd.read_sql("""SELECT MAX(trackId) AS trackId FROM AllTracks""", track_con)["trackId"].values[0]
-        if max_track_id is None:
-            max_track_id = max_track_id_old
-        max_track_id_old = max_track_id
+        if max_track_id is None or np.isnan(max_track_id):
+            max_track_id = trackIdStart - 1
+        max_track_id = int(max_track_id)
+
+        if partitioned is True:
+            # Windows are named night_{start}_through_{end}
+            nights = windowName.split("_")
+            track_con.execute("INSERT INTO Windows VALUES (?, ?, ?, ?, ?, ?)",
+                              (i + 1, windowName, float(nights[1]), float(nights[3]), trackIdStart, max_track_id))
+            track_con.commit()
+        else:
+            track_con.close()
         trackIdStart = max_track_id + 1
         
         tracker.toYaml(outDir=tracker.runDir) 
+
+    if partitioned is True:
+        track_con.close()
     return tracker
 
+def attachDatabases(con, databases, verbose=Config.verbose):
+    """
+    Attach window databases to a connection and combine their tracks into the temporary
+    AllTracks, TrackMembers, Tracks and FinalTracks views (UNION ALL over every window,
+    with a windowId column numbering the windows in the order given). The views last as
+    long as the connection, so for example the tracklet database can be queried together
+    with the tracks of every window.
+
+    SQLite limits the number of databases attached to a connection (10 by default),
+    for more windows read the tracks into a partitioned database instead
+    (see `readManyTracksIntoDatabases`).
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection` or similar
+        Database connection.
+
+    databases : list
+        Paths to window databases (see `buildTrackDatabase`).
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    con : `sqlite3.Connection`
+        Connection with the databases attached and views created.
+
+    Raises
+    ------
+    ValueError
+        If more databases are given than can be attached.
+    """
+    schemas = []
+    for i, database in enumerate(databases):
+        schema = "window{}".format(i + 1)
+        if verbose is True:
+            print("Attaching {} as {}...".format(database, schema))
+        try:
+            con.execute("ATTACH DATABASE ? AS {}".format(schema), (database,))
+        except sql.OperationalError as e:
+            for attached in schemas:
+                con.execute("DETACH DATABASE {}".format(attached))
+            raise ValueError("Could not attach {} of {} databases ({}). Use a partitioned track database instead.".format(i + 1, len(databases), e))
+        schemas.append(schema)
+
+    for table in ["AllTracks", "TrackMembers"]:
+        if verbose is True:
+            print("Creating {} view...".format(table))
+        con.execute("DROP VIEW IF EXISTS temp.{}".format(table))
+        con.execute("CREATE TEMP VIEW {} AS {}".format(table,
+                                                      " UNION ALL ".join(["SELECT {} AS windowId, * FROM {}.{}".format(i + 1, schema, table)
+                                                                          for i, schema in enumerate(schemas)])))
+
+    if verbose is True:
+        print("Creating Tracks view...")
+    con.execute("DROP VIEW IF EXISTS temp.Tracks")
+    con.execute("""
+        CREATE TEMP VIEW Tracks AS
+        SELECT * FROM AllTracks
+        WHERE createdBy = 5
+        """)
+
+    if verbose is True:
+        print("Creating FinalTracks view...")
+        print("")
+    con.execute("DROP VIEW IF EXISTS temp.FinalTracks")
+    con.execute("""
+        CREATE TEMP VIEW FinalTracks AS
+        SELECT * FROM AllTracks
+        WHERE deletedBy = 6
+        OR createdBy = 6
+        """)
+    return con
+
+def indexDatabase(database, indexes=DATABASE_INDEXES, verbose=Config.verbose):
+    """
+    Build indexes on a loaded database and gather the statistics SQLite's query
+    planner uses to choose between them (ANALYZE). Indexes on tables or columns the
+    database does not have are skipped, existing indexes are kept.
+
+    Parameters
+    ----------
+    database : str
+        Path to database.
+
+    indexes : list, optional
+        List of (table, columns) tuples to index. [Default = `DATABASE_INDEXES`]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    None
+    """
+    con = sql.connect(database)
+    tables = [row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    # Indexes are built from tables that passed their integrity check when loaded
+    with bulkLoad(con, checkIntegrity=False, verbose=False):
+        for table, columns in indexes:
+            if table not in tables:
+                continue
+            tableColumns = [row[1] for row in con.execute("PRAGMA table_info({})".format(table))]
+            if not set(columns).issubset(tableColumns):
+                continue
+            if verbose is True:
+                print("Indexing {}({}) in {}...".format(table, ", ".join(columns), database))
+            con.execute("CREATE INDEX IF NOT EXISTS {}_{} ON {} ({})".format(table, "_".join(columns), table, ", ".join(columns)))
+        con.execute("ANALYZE")
+    con.close()
+    return
+
+def indexDatabases(tracker, enableMultiprocessing=True, processes=8, verbose=Config.verbose):
+    """
+    Build indexes on the tracklet database, the track database and every window database
+    in the tracker (see `indexDatabase`). Databases are indexed in parallel.
+
+    Parameters
+    ----------
+    tracker : `analyzemops.tracker`
+        A tracker with populated trackletDatabase, trackDatabase and/or windowDatabases attributes.
+
+    enableMultiprocessing : bool, optional
+        Index databases in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors. 
+        [Default = 8]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    None
+    """
+    databases = []
+    # Trackers saved before trackletDatabase was tracked may not have it
+    if getattr(tracker, "trackletDatabase", None) is not None:
+        databases.append(tracker.trackletDatabase)
+    if getattr(tracker, "trackDatabase", None) is not None:
+        databases.append(tracker.trackDatabase)
+    if tracker.windowDatabases is not None:
+        databases += tracker.windowDatabases
+
+    args = [(database, verbose) for database in databases]
+    if enableMultiprocessing and len(databases) > 1:
+        if verbose is True:
+            print("Using %s CPUs in parallel." % (min(processes, len(databases))))
+        p = multiprocessing.Pool(processes=min(processes, len(databases)))
+        p.map(_indexDatabase, args, chunksize=1)
+        p.close()
+        p.join()
+    else:
+        for arg in args:
+            _indexDatabase(arg)
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return
+
+def _indexDatabase(args):
+    """
+    Worker function for `indexDatabases`: args is a (database, verbose) tuple.
+
+    """
+    database, verbose = args
+    indexDatabase(database, verbose=verbose)
+    return
+
+def annotateTracklets(con, verbose=Config.verbose):
+    """
+    Fill in the linkedObjectId, numLinkedObjects, velocity, rms and night columns of
+    every tracklet in AllTracklets from the detections in the DiaSources table (or view).
+    The tracklet members are joined against DiaSources as arrays and every column is
+    computed with group reductions over all tracklets at once (see `_linkageStatistics`).
+
+    A tracklet is linked to an object if all of its detections belong to that object
+    (linkedObjectId = -1 otherwise, or if the object is noise). Velocity (degrees per day)
+    is the angular distance between the first and last detection divided by the time between
+    them, rms (degrees) is the root mean square distance of the detections from a linear fit
+    of RA and Dec with time, and night is the integer MJD of the first detection.
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection` or similar
+        Database connection, database needs to have a populated AllTracklets, TrackletMembers
+        and DiaSources table.
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If a tracklet member is not in DiaSources.
+    """
+    if verbose is True:
+        print("Reading DiaSources...")
+    diaSources = _diaSourceArrays(_readDiaSources(con))
+    if verbose is True:
+        print("Reading TrackletMembers...")
+    trackletIds, members, offsets = _readLinkageMembers(con, "TrackletMembers", "trackletId")
+    if verbose is True:
+        print("Annotating {} tracklets...".format(len(trackletIds)))
+    statistics = _linkageStatistics(members, offsets, diaSources, order=1)
+
+    tracklets = pd.DataFrame({"trackletId": trackletIds,
+                              "linkedObjectId": statistics["linkedObjectId"],
+                              "numLinkedObjects": statistics["numLinkedObjects"],
+                              "velocity": statistics["velocity"],
+                              "rms": statistics["rms"],
+                              "night": np.floor(statistics["startTime"])},
+                             columns=["trackletId", "linkedObjectId", "numLinkedObjects", "velocity", "rms", "night"])
+    with bulkLoad(con, checkIntegrity=False, verbose=False):
+        _updateRows(con, "AllTracklets", "trackletId", tracklets)
+    if verbose is True:
+        print("Done.")
+        print("")
+    return
+
+def annotateTracks(con, diaSources=None, windowStart=None, windowId=None, verbose=Config.verbose):
+    """
+    Fill in the rms, windowStart, startTime, endTime, subsetOf, linkedObjectId and
+    numLinkedObjects columns of every track in a window's AllTracks table. Track members
+    are joined against the detections as arrays and every column is computed with group
+    reductions over all tracks at once (see `_linkageStatistics`).
+
+    A track is linked to an object if all of its detections belong to that object
+    (linkedObjectId = -1 otherwise, or if the object is noise). Start and end times are the
+    MJDs of the first and last detection, rms (degrees) is the root mean square distance of
+    the detections from a quadratic fit of RA and Dec with time, as linkTracklets fits tracks.
+    subsetOf is the trackId of the largest track in the window whose detections include
+    all of the track's detections and more (NULL if none, see `_findSubsets`).
+
+    Parameters
+    ----------
+    con : `sqlite3.Connection` or similar
+        Database connection, database needs to have a populated AllTracks and TrackMembers table.
+
+    diaSources : `pandas.DataFrame`, optional
+        Detections with diaId, objectId, ra, dec and mjd columns. If None, read from the
+        database's DiaSources table. [Default = None]
+
+    windowStart : float, optional
+        First night of the window. If None and windowId is given, read from the
+        Windows table. [Default = None]
+
+    windowId : int, optional
+        In a partitioned database (see `buildTrackDatabase`), the window whose tracks to annotate.
+        [Default = None]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If a track member is not in diaSources.
+    """
+    if diaSources is None:
+        diaSources = _readDiaSources(con)
+    diaSources = _diaSourceArrays(diaSources)
+    trackIdRange = None
+    if windowId is not None:
+        windowStart_, trackIdStart, trackIdEnd = con.execute("""SELECT windowStart, trackIdStart, trackIdEnd
+                                                                FROM Windows WHERE windowId = ?""", (windowId,)).fetchone()
+        if windowStart is None:
+            windowStart = windowStart_
+        trackIdRange = (trackIdStart, trackIdEnd)
+    trackIds, members, offsets = _readLinkageMembers(con, "TrackMembers", "trackId", linkageIdRange=trackIdRange)
+    if verbose is True:
+        print("Annotating {} tracks...".format(len(trackIds)))
+    statistics = _linkageStatistics(members, offsets, diaSources, order=2)
+    supersets = _findSubsets(members, offsets)
+
+    subsetOf = np.full(len(trackIds), np.nan)
+    subsetOf[supersets >= 0] = trackIds[supersets[supersets >= 0]]
+    tracks = pd.DataFrame({"trackId": trackIds,
+                           "linkedObjectId": statistics["linkedObjectId"],
+                           "numLinkedObjects": statistics["numLinkedObjects"],
+                           "rms": statistics["rms"],
+                           "windowStart": np.full(len(trackIds), np.nan if windowStart is None else float(windowStart)),
+                           "startTime": statistics["startTime"],
+                           "endTime": statistics["endTime"],
+                           "subsetOf": subsetOf},
+                          columns=["trackId", "linkedObjectId", "numLinkedObjects", "rms",
+                                   "windowStart", "startTime", "endTime", "subsetOf"])
+    with bulkLoad(con, checkIntegrity=False, verbose=False):
+        _updateRows(con, "AllTracks", "trackId", tracks)
+    if verbose is True:
+        print("Done.")
+        print("")
+    return
+
+def annotateManyTracks(tracker, diaSources=None, verbose=Config.verbose):
+    """
+    Annotate the tracks in every window database in the tracker, or every window in its
+    partitioned track database (see `annotateTracks`). Detections are read once for all windows.
+    The start of each window is taken from its name.
+
+    Parameters
+    ----------
+    tracker : `analyzemops.tracker`
+        A tracker with a populated windowDatabases or trackDatabase attribute.
+
+    diaSources : `pandas.DataFrame`, optional
+        Detections with diaId, objectId, ra, dec and mjd columns. If None, read from the
+        DiaSources table of the tracker's tracklet database. [Default = None]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    None
+    """
+    if diaSources is None:
+        con = sql.connect(tracker.trackletDatabase)
+        diaSources = _readDiaSources(con)
+        con.close()
+    diaSources = _diaSourceArrays(diaSources)
+
+    if getattr(tracker, "trackDatabase", None) is not None:
+        con = sql.connect(tracker.trackDatabase)
+        for windowId, name in con.execute("SELECT windowId, name FROM Windows ORDER BY windowId").fetchall():
+            if verbose is True:
+                print("Annotating tracks in {}...".format(name))
+            annotateTracks(con, diaSources=diaSources, windowId=windowId, verbose=False)
+        con.close()
+
+    for windowDatabase in tracker.windowDatabases or []:
+        if verbose is True:
+            print("Annotating tracks in {}...".format(windowDatabase))
+        # Windows are named night_{start}_through_{end}
+        windowStart = float(os.path.basename(windowDatabase).split("_")[1])
+        con = sql.connect(windowDatabase)
+        annotateTracks(con, diaSources=diaSources, windowStart=windowStart, verbose=False)
+        con.close()
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return
+
+def buildObjectsTable(tracker,
+                      windowSize=15,
+                      nightMin=3,
+                      detectionMin=6,
+                      objectsTable=Config.object_table,
+                      verbose=Config.verbose):
+    """
+    Build the objects table (AllObjects) in the tracker's tracklet database: for every objectId
+    in DiaSources, its number of detections, whether it could be found as a tracklet and as a
+    track, and the number of true and false tracklets and tracks it is part of at every stage.
+    Counts are made for all objects at once from arrays of the detections, tracklet members
+    and the members of the tracks in the track database or every window database. Any existing
+    objects table is replaced.
+
+    An object is findable as a tracklet if it has at least two detections on one night, and
+    findable as a track if, within windowSize nights of one such night, it has at least nightMin
+    such nights with at least detectionMin detections between them. A linkage is true for an
+    object if all of its detections belong to that object and false for every object with a
+    detection in it if they do not (so summing false counts over objects counts a false
+    linkage once per object in it). Tracklets count towards a stage if they are in that stage's
+    output (findTracklets, collapseTracklets, purifyTracklets and removeSubsets), tracks towards
+    linkTracklets or removeSubsets.
+
+    Parameters
+    ----------
+    tracker : `analyzemops.tracker`
+        A tracker with a populated tracklet database (with DiaSources) and optionally
+        a track database or window databases.
+
+    windowSize : int, optional
+        Number of nights in a linkTracklets window. [Default = 15]
+
+    nightMin : int, optional
+        Minimum number of nights linkTracklets requires in a track. [Default = 3]
+
+    detectionMin : int, optional
+        Minimum number of detections linkTracklets requires in a track. [Default = 6]
+
+    objectsTable : str, optional
+        Name of the objects table. [Default = `Config.object_table`]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    `pandas.DataFrame`
+        The objects table.
+    """
+    con = sql.connect(tracker.trackletDatabase)
+    if verbose is True:
+        print("Reading DiaSources...")
+    diaSources = _diaSourceArrays(_readDiaSources(con))
+    objectIds, objectIndex = np.unique(diaSources["objectId"], return_inverse=True)
+    numObjects = len(objectIds)
+
+    allObjects = pd.DataFrame({"objectId": objectIds,
+                               "numDetections": np.bincount(objectIndex, minlength=numObjects)},
+                              columns=["objectId", "numDetections"])
+    if verbose is True:
+        print("Finding findable objects...")
+    findableAsTracklet, findableAsTrack = _findableObjects(objectIndex, numObjects, diaSources["mjd"],
+                                                           windowSize=windowSize,
+                                                           nightMin=nightMin,
+                                                           detectionMin=detectionMin)
+    # Noise is never findable
+    allObjects["findableAsTracklet"] = (findableAsTracklet & (objectIds >= 0)).astype(int)
+    allObjects["findableAsTrack"] = (findableAsTrack & (objectIds >= 0)).astype(int)
+
+    if verbose is True:
+        print("Counting tracklets...")
+    trackletIds, members, offsets = _readLinkageMembers(con, "TrackletMembers", "trackletId")
+    lineNums = pd.read_sql("SELECT trackletId, _lineNum_1, _lineNum_2, _lineNum_3, _lineNum_4 FROM AllTracklets", con)
+    lineNums = lineNums.set_index("trackletId").reindex(trackletIds)
+    counts = _countLinkagesByObject(members, offsets, diaSources, objectIds,
+                                    [lineNums[column].notnull().values for column in lineNums.columns])
+    for stage, (true, false) in zip(["Tracklets", "CollapsedTracklets", "PurifiedTracklets", "FinalTracklets"], counts):
+        allObjects["numTrue{}".format(stage)] = true
+        allObjects["numFalse{}".format(stage)] = false
+
+    for stage in ["Tracks", "FinalTracks"]:
+        allObjects["numTrue{}".format(stage)] = 0
+        allObjects["numFalse{}".format(stage)] = 0
+    trackDatabases = tracker.windowDatabases or []
+    if getattr(tracker, "trackDatabase", None) is not None:
+        trackDatabases = [tracker.trackDatabase] + trackDatabases
+    for trackDatabase in trackDatabases:
+        if verbose is True:
+            print("Counting tracks in {}...".format(trackDatabase))
+        trackCon = sql.connect(trackDatabase)
+        trackIds, members, offsets = _readLinkageMembers(trackCon, "TrackMembers", "trackId")
+        lineNums = pd.read_sql("SELECT trackId, _lineNum_5, _lineNum_6 FROM AllTracks", trackCon)
+        lineNums = lineNums.set_index("trackId").reindex(trackIds)
+        trackCon.close()
+        counts = _countLinkagesByObject(members, offsets, diaSources, objectIds,
+                                        [lineNums[column].notnull().values for column in lineNums.columns])
+        for stage, (true, false) in zip(["Tracks", "FinalTracks"], counts):
+            allObjects["numTrue{}".format(stage)] += true
+            allObjects["numFalse{}".format(stage)] += false
+
+    if verbose is True:
+        print("Building {} table...".format(objectsTable))
+    con.execute("DROP TABLE IF EXISTS {}".format(objectsTable))
+    con.execute("CREATE TABLE {} (objectId INTEGER PRIMARY KEY, {})".format(objectsTable,
+                                                                           ", ".join(["{} INTEGER".format(column) for column in allObjects.columns[1:]])))
+    with bulkLoad(con, verbose=verbose):
+        _insertRows(con, objectsTable, allObjects)
+    con.close()
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return allObjects
+
+def exportParquet(tracker, outDir, verbose=Config.verbose):
+    """
+    Export the detections, tracklets and tracks of a run to Parquet files, so that they can be
+    loaded (see `readParquet`) without going through SQLite. Every table is written to its own
+    directory under outDir, partitioned by night (DiaSources, AllTracklets and TrackletMembers)
+    or by window (AllTracks and TrackMembers) into key=value subdirectories. Within a partition
+    rows are sorted by their ID and written in row groups of `PARQUET_ROW_GROUP_SIZE` rows, whose
+    column statistics let reads skip the row groups a filter excludes. Existing exports are replaced.
+
+    A tracklet's night is the integer MJD of its first detection (as in `annotateTracklets`,
+    the exported night column is filled in whether or not tracklets were annotated). Windows are numbered
+    as in the partitioned track database or, for window databases, in the tracker's order
+    (as in `attachDatabases`).
+
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    tracker : `analyzemops.tracker`
+        A tracker with a populated tracklet database (with DiaSources) and optionally
+        a track database or window databases.
+
+    outDir : str
+        Path to the directory to export to.
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    list
+        List of paths to the exported table directories.
+    """
+    _requirePyarrow("exportParquet")
+    exported = []
+
+    con = sql.connect(tracker.trackletDatabase)
+    if verbose is True:
+        print("Exporting DiaSources...")
+    diaSources = pd.read_sql("SELECT * FROM DiaSources", con)
+    exported.append(_writeParquetTable(diaSources, outDir, "DiaSources", "night",
+                                       np.floor(diaSources["mjd"].values).astype(np.int64), "diaId"))
+
+    if verbose is True:
+        print("Exporting AllTracklets and TrackletMembers...")
+    diaSources = _diaSourceArrays(diaSources)
+    allTracklets = pd.read_sql("SELECT * FROM AllTracklets", con)
+    trackletIds, members, offsets = _readLinkageMembers(con, "TrackletMembers", "trackletId")
+    con.close()
+    rows = np.searchsorted(diaSources["diaId"], members)
+    nights = np.floor(np.minimum.reduceat(diaSources["mjd"][np.minimum(rows, len(diaSources["mjd"]) - 1)], offsets[:-1])).astype(np.int64) \
+        if len(members) > 0 else np.array([], dtype=np.int64)
+    # Tracklets without members keep a NULL night
+    trackletNights = pd.Series(nights, index=trackletIds).reindex(allTracklets["trackletId"].values).values
+    allTracklets["night"] = trackletNights
+    exported.append(_writeParquetTable(allTracklets, outDir, "AllTracklets", "night", trackletNights, "trackletId"))
+    trackletMembers = pd.DataFrame({"trackletId": np.repeat(trackletIds, np.diff(offsets)), "diaId": members},
+                                   columns=["trackletId", "diaId"])
+    exported.append(_writeParquetTable(trackletMembers, outDir, "TrackletMembers", "night",
+                                       np.repeat(nights, np.diff(offsets)), "trackletId"))
+
+    if verbose is True:
+        print("Exporting AllTracks and TrackMembers...")
+    allTracks = []
+    trackMembers = []
+    if getattr(tracker, "trackDatabase", None) is not None:
+        con = sql.connect(tracker.trackDatabase)
+        allTracks.append(pd.read_sql("SELECT * FROM AllTracks", con))
+        trackMembers.append(pd.read_sql("SELECT * FROM TrackMembers", con))
+        con.close()
+    for windowId, windowDatabase in enumerate(tracker.windowDatabases or [], 1):
+        con = sql.connect(windowDatabase)
+        allTracks.append(pd.read_sql("SELECT {} AS windowId, * FROM AllTracks".format(windowId), con))
+        trackMembers.append(pd.read_sql("SELECT trackId, {} AS windowId, diaId FROM TrackMembers".format(windowId), con))
+        con.close()
+    if len(allTracks) > 0:
+        allTracks = pd.concat(allTracks, ignore_index=True)
+        trackMembers = pd.concat(trackMembers, ignore_index=True)
+        exported.append(_writeParquetTable(allTracks.drop("windowId", axis=1), outDir, "AllTracks", "windowId",
+                                           allTracks["windowId"].values, "trackId"))
+        exported.append(_writeParquetTable(trackMembers.drop("windowId", axis=1), outDir, "TrackMembers", "windowId",
+                                           trackMembers["windowId"].values, "trackId"))
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return exported
+
+def readParquet(tableDir, columns=None, filters=None):
+    """
+    Read a table exported by `exportParquet`. Only the requested columns are read, and
+    filters are applied while reading: partitions and row groups that can not hold a
+    matching row are skipped, the remaining rows are filtered as they are read.
+
+    Requires pyarrow.
+
+    Parameters
+    ----------
+    tableDir : str
+        Path to the exported table's directory (for example outDir/DiaSources).
+
+    columns : list, optional
+        Columns to read, including the partition column (night or windowId). If None,
+        read every column. [Default = None]
+
+    filters : list, optional
+        List of (column, operator, value) tuples that every row read must satisfy. Operators
+        are "=", "==", "!=", "<", "<=", ">", ">=" and "in" (value is then a list). [Default = None]
+
+    Returns
+    -------
+    `pandas.DataFrame`
+        The matching rows.
+
+    Raises
+    ------
+    ValueError
+        If an operator is not supported.
+    """
+    _requirePyarrow("readParquet")
+    filters = list(filters or [])
+    for column, op, value in filters:
+        if op not in _FILTER_OPERATORS:
+            raise ValueError("Filter operator {} is not supported.".format(op))
+
+    partitions = []
+    for partition in sorted(os.listdir(tableDir)):
+        if "=" not in partition:
+            continue
+        key, value = partition.split("=", 1)
+        value = None if value == "null" else int(value)
+        keyFilters = [(op, filterValue) for column, op, filterValue in filters if column == key]
+        # Rows with a missing key never match a filter on it
+        if value is None and len(keyFilters) > 0:
+            continue
+        if all([_FILTER_OPERATORS[op](value, filterValue) for op, filterValue in keyFilters]):
+            partitions.append((key, value, os.path.join(tableDir, partition, "part-0.parquet")))
+
+    frames = []
+    for key, value, path in partitions:
+        rowFilters = [f for f in filters if f[0] != key]
+        parquetFile = pq.ParquetFile(path)
+        names = [parquetFile.schema.column(i).name for i in range(len(parquetFile.schema))]
+        read = names if columns is None else [column for column in names if column in columns]
+        read = read + [f[0] for f in rowFilters if f[0] not in read]
+
+        for rowGroup in range(parquetFile.num_row_groups):
+            statistics = parquetFile.metadata.row_group(rowGroup)
+            statistics = dict([(statistics.column(i).path_in_schema, statistics.column(i).statistics)
+                               for i in range(statistics.num_columns)])
+            if not all([_rowGroupMayMatch(statistics.get(column), op, filterValue)
+                        for column, op, filterValue in rowFilters]):
+                continue
+            frame = parquetFile.read_row_group(rowGroup, columns=read).to_pandas()
+            if len(rowFilters) > 0:
+                keep = np.ones(len(frame), dtype=bool)
+                for column, op, filterValue in rowFilters:
+                    keep &= _FILTER_OPERATORS[op](frame[column].values, filterValue)
+                frame = frame[keep]
+            if (columns is None or key in columns) and key not in names:
+                frame[key] = value
+            frames.append(frame)
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=columns)
+    frame = pd.concat(frames, ignore_index=True)
+    if columns is not None:
+        frame = frame[[column for column in columns if column in frame.columns]]
+    return frame
+
+def _requirePyarrow(function):
+    """
+    Raise an ImportError if pyarrow is not installed.
+
+    """
+    if pq is None:
+        raise ImportError("{} requires pyarrow.".format(function))
+    return
+
+def _writeParquetTable(frame, outDir, table, key, keyValues, sortBy):
+    """
+    Write a DataFrame to outDir/table/key=value/part-0.parquet, one file per value of
+    keyValues (aligned with the rows of frame), sorted by the sortBy column. Rows with a
+    missing key are written to key=null. Returns the table's directory.
+
+    """
+    tableDir = os.path.join(outDir, table)
+    if os.path.isdir(tableDir):
+        shutil.rmtree(tableDir)
+    os.makedirs(tableDir)
+
+    keyValues = pd.Series(keyValues)
+    missing = keyValues.isnull().values
+    keys = np.where(missing, -1, keyValues.fillna(-1).values).astype(np.int64)
+    order = np.lexsort((frame[sortBy].values, keys, missing))
+    keys = keys[order]
+    missing = missing[order]
+    frame = frame.iloc[order]
+
+    starts = np.flatnonzero(np.concatenate(([True], (keys[1:] != keys[:-1]) | (missing[1:] != missing[:-1]))))
+    ends = np.append(starts[1:], len(keys))
+    for start, end in zip(starts, ends):
+        if start == end:
+            continue
+        partitionDir = os.path.join(tableDir, "{}={}".format(key, "null" if missing[start] else keys[start]))
+        os.makedirs(partitionDir)
+        pq.write_table(pa.Table.from_pandas(frame.iloc[start:end], preserve_index=False),
+                       os.path.join(partitionDir, "part-0.parquet"),
+                       row_group_size=PARQUET_ROW_GROUP_SIZE)
+    return tableDir
+
+def _rowGroupMayMatch(statistics, op, value):
+    """
+    Returns False if a row group's column statistics show that no row in it can
+    satisfy the filter, True otherwise.
+
+    """
+    if statistics is None or not statistics.has_min_max:
+        return True
+    low, high = statistics.min, statistics.max
+    if op in ("=", "=="):
+        return low <= value <= high
+    if op == "!=":
+        return not (low == high == value)
+    if op == "<":
+        return low < value
+    if op == "<=":
+        return low <= value
+    if op == ">":
+        return high > value
+    if op == ">=":
+        return high >= value
+    return any([low <= v <= high for v in value])
+
+def _findableObjects(objectIndex, numObjects, mjd, windowSize=15, nightMin=3, detectionMin=6):
+    """
+    Returns boolean arrays flagging the objects findable as tracklets and as tracks
+    (see `buildObjectsTable`) given the object index and MJD of every detection.
+
+    """
+    findableAsTracklet = np.zeros(numObjects, dtype=bool)
+    findableAsTrack = np.zeros(numObjects, dtype=bool)
+    if len(mjd) == 0:
+        return findableAsTracklet, findableAsTrack
+
+    # Count every object's detections per night, keyed so that the nights of an
+    # object are contiguous and in order
+    night = np.floor(mjd).astype(np.int64)
+    night -= night.min()
+    nights = night.max() + windowSize + 1
+    keys, detections = np.unique(objectIndex.astype(np.int64) * nights + night, return_counts=True)
+    trackletNights = detections >= 2
+    keys = keys[trackletNights]
+    detections = detections[trackletNights]
+    objects = keys // nights
+    findableAsTracklet[objects] = True
+
+    # For every tracklet night, count the tracklet nights and their detections in the window it starts
+    ends = np.searchsorted(keys, keys + windowSize, side="right")
+    starts = np.arange(len(keys))
+    cumulative = np.concatenate(([0], np.cumsum(detections)))
+    findable = (ends - starts >= nightMin) & (cumulative[ends] - cumulative[starts] >= detectionMin)
+    findableAsTrack[objects[findable]] = True
+    return findableAsTracklet, findableAsTrack
+
+def _countLinkagesByObject(members, offsets, diaSources, objectIds, stages):
+    """
+    Count the true and false linkages of every object (see `buildObjectsTable`) for every
+    stage, given a boolean array per stage flagging the linkages in its output. Returns a list
+    of (true, false) count arrays aligned with objectIds.
+
+    """
+    numObjects = len(objectIds)
+    lengths = np.diff(offsets)
+    group = np.repeat(np.arange(len(lengths)), lengths)
+    rows = np.searchsorted(diaSources["diaId"], members)
+    rows = np.minimum(rows, len(diaSources["diaId"]) - 1)
+    if len(members) > 0 and np.any(diaSources["diaId"][rows] != members):
+        raise ValueError("{} linkage members are not in DiaSources.".format(np.sum(diaSources["diaId"][rows] != members)))
+    objectIndex = np.searchsorted(objectIds, diaSources["objectId"][rows])
+
+    # Every distinct (linkage, object) pair
+    pairs = np.unique(group.astype(np.int64) * numObjects + objectIndex)
+    pairLinkage = pairs // numObjects
+    pairObject = pairs % numObjects
+    numLinkedObjects = np.bincount(pairLinkage, minlength=len(lengths))
+    true = (numLinkedObjects[pairLinkage] == 1) & (objectIds[pairObject] >= 0)
+
+    counts = []
+    for present in stages:
+        inStage = present[pairLinkage]
+        counts.append((np.bincount(pairObject[inStage & true], minlength=numObjects),
+                       np.bincount(pairObject[inStage & ~true], minlength=numObjects)))
+    return counts
+
+def _readDiaSources(con):
+    """
+    Read the diaId, objectId, ra, dec and mjd columns of DiaSources into a DataFrame.
+
+    """
+    return pd.read_sql("SELECT diaId, objectId, ra, dec, mjd FROM DiaSources", con)
+
+def _diaSourceArrays(diaSources):
+    """
+    Returns the diaId, objectId, ra, dec and mjd columns of a DataFrame (or dictionary)
+    of detections as a dictionary of arrays sorted by diaId.
+
+    """
+    columns = ["diaId", "objectId", "ra", "dec", "mjd"]
+    arrays = dict([(column, np.asarray(diaSources[column])) for column in columns])
+    if np.any(arrays["diaId"][1:] < arrays["diaId"][:-1]):
+        order = np.argsort(arrays["diaId"], kind="mergesort")
+        arrays = dict([(column, arrays[column][order]) for column in columns])
+    return arrays
+
+def _readLinkageMembers(con, table, linkageType, linkageIdRange=None):
+    """
+    Read a linkage members table into a CSR structure. Returns the linkage IDs, the
+    flat array of member diaIds and the offsets of each linkage into it. If linkageIdRange
+    is given as (first, last), only read the linkages with IDs in that range.
+
+    """
+    where = ""
+    if linkageIdRange is not None:
+        where = " WHERE {} BETWEEN {:d} AND {:d}".format(linkageType, *linkageIdRange)
+    linkageMembers = pd.read_sql("SELECT {0}, diaId FROM {1}{2} ORDER BY {0}".format(linkageType, table, where), con)
+    linkageIds = linkageMembers[linkageType].values.astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], linkageIds[1:] != linkageIds[:-1])))
+    offsets = np.append(starts, len(linkageIds)).astype(np.int64)
+    return linkageIds[starts], linkageMembers["diaId"].values.astype(np.int64), offsets
+
+def _linkageStatistics(members, offsets, diaSources, order=1):
+    """
+    Compute per-linkage statistics for a CSR linkage structure given DiaSources arrays
+    sorted by diaId (see `_readDiaSources`). Returns a dictionary of arrays with one
+    entry per linkage: numLinkedObjects, linkedObjectId, startTime, endTime, velocity
+    (degrees per day, first to last detection) and rms (degrees, about a polynomial fit of
+    the given order of RA and Dec with time).
+
+    """
+    lengths = np.diff(offsets)
+    numLinkages = len(lengths)
+    group = np.repeat(np.arange(numLinkages), lengths)
+    nonEmpty = lengths > 0
+
+    # Look up every member's row in DiaSources
+    rows = np.searchsorted(diaSources["diaId"], members)
+    found = rows < len(diaSources["diaId"])
+    found[found] = diaSources["diaId"][rows[found]] == members[found]
+    if not np.all(found):
+        raise ValueError("{} linkage members are not in DiaSources.".format(np.sum(~found)))
+
+    # Count the distinct objects in every linkage
+    objectId = diaSources["objectId"][rows]
+    byObject = _groupSort(group, objectId)
+    objectId = objectId[byObject]
+    newObject = np.ones(len(objectId), dtype=bool)
+    newObject[1:] = (group[1:] != group[:-1]) | (objectId[1:] != objectId[:-1])
+    numLinkedObjects = np.bincount(group, weights=newObject, minlength=numLinkages).astype(np.int64)
+    linkedObjectId = np.full(numLinkages, -1, dtype=np.int64)
+    linked = nonEmpty & (numLinkedObjects == 1)
+    linked[linked] = objectId[offsets[:-1][linked]] >= 0
+    linkedObjectId[linked] = objectId[offsets[:-1][linked]]
+
+    # Order the detections in every linkage by time
+    byTime = rows[_groupSort(group, diaSources["mjd"][rows])]
+    mjd = diaSources["mjd"][byTime]
+    ra = diaSources["ra"][byTime]
+    dec = diaSources["dec"][byTime]
+    first = offsets[:-1][nonEmpty]
+    last = offsets[1:][nonEmpty] - 1
+
+    startTime = np.full(numLinkages, np.nan)
+    endTime = np.full(numLinkages, np.nan)
+    startTime[nonEmpty] = mjd[first]
+    endTime[nonEmpty] = mjd[last]
+    velocity = np.full(numLinkages, np.nan)
+    moving = endTime[nonEmpty] > startTime[nonEmpty]
+    velocity[np.flatnonzero(nonEmpty)[moving]] = (_angularSeparation(ra[first], dec[first], ra[last], dec[last])[moving]
+                                                  / (endTime[nonEmpty] - startTime[nonEmpty])[moving])
+
+    # Fit RA and Dec with time about the mean time of every linkage. RA is unwrapped about the
+    # first detection and scaled by cos(Dec) so that residuals are angular distances
+    counts = np.maximum(lengths, 1).astype(float)
+    raFirst = np.zeros(numLinkages)
+    raFirst[nonEmpty] = ra[first]
+    dRa = (ra - raFirst[group] + 180.) % 360. - 180.
+    cosDec = np.cos(np.radians(np.bincount(group, weights=dec, minlength=numLinkages) / counts))
+    x = mjd - (np.bincount(group, weights=mjd, minlength=numLinkages) / counts)[group]
+    powers = x[:, np.newaxis] ** np.arange(2 * order + 1)
+    moments = np.column_stack([np.bincount(group, weights=powers[:, i], minlength=numLinkages) for i in range(2 * order + 1)])
+    indices = np.arange(order + 1)
+    inverse = _invertNormalEquations(moments[:, indices[:, np.newaxis] + indices[np.newaxis, :]])
+    squares = np.zeros(len(x))
+    for y in (dRa * cosDec[group], dec):
+        b = np.column_stack([np.bincount(group, weights=powers[:, i] * y, minlength=numLinkages) for i in range(order + 1)])
+        coefficients = np.einsum("nij,nj->ni", inverse, b)
+        squares += (y - np.sum(coefficients[group] * powers[:, :order + 1], axis=1))**2
+    rms = np.full(numLinkages, np.nan)
+    rms[nonEmpty] = np.sqrt(np.bincount(group, weights=squares, minlength=numLinkages)[nonEmpty] / lengths[nonEmpty])
+
+    return {"numLinkedObjects": numLinkedObjects,
+            "linkedObjectId": linkedObjectId,
+            "startTime": startTime,
+            "endTime": endTime,
+            "velocity": velocity,
+            "rms": rms}
+
+def _findSubsets(members, offsets):
+    """
+    For every linkage in a CSR structure, find the largest other linkage whose members
+    include all of its members and more (smallest index if several). Returns the index of
+    that linkage, -1 if there is none.
+
+    Rather than comparing all pairs of linkages, only linkages that share a linkage's least
+    common member are candidates. Each candidate is checked by looking up the
+    (candidate, member) pairs in a sorted array of hashed (linkage, member) keys.
+
+    """
+    lengths = np.diff(offsets)
+    numLinkages = len(lengths)
+    supersets = np.full(numLinkages, -1, dtype=np.int64)
+    if len(members) == 0:
+        return supersets
+    group = np.repeat(np.arange(numLinkages), lengths)
+    uniqueMembers, member = np.unique(members, return_inverse=True)
+    numMembers = len(uniqueMembers)
+
+    # Inverted index: the linkages every member belongs to
+    byMember = np.argsort(member, kind="mergesort")
+    postingCounts = np.bincount(member, minlength=numMembers)
+    postingOffsets = np.concatenate(([0], np.cumsum(postingCounts)))
+    postings = group[byMember]
+
+    # Candidates are the linkages that share each linkage's least common member
+    nonEmpty = np.flatnonzero(lengths > 0)
+    rarest = member[_groupSort(group, postingCounts[member])[offsets[:-1][nonEmpty]]]
+    subset = np.repeat(nonEmpty, postingCounts[rarest])
+    superset = postings[_ranges(postingOffsets[rarest], postingCounts[rarest])]
+    candidate = lengths[superset] > lengths[subset]
+    subset = subset[candidate]
+    superset = superset[candidate]
+    if len(subset) == 0:
+        return supersets
+
+    # Check that every member of the subset is a member of the superset
+    keys = np.unique(group.astype(np.int64) * numMembers + member)
+    pair = np.repeat(np.arange(len(subset)), lengths[subset])
+    lookups = superset[pair].astype(np.int64) * numMembers + member[_ranges(offsets[subset], lengths[subset])]
+    positions = np.minimum(np.searchsorted(keys, lookups), len(keys) - 1)
+    contained = np.bincount(pair, weights=(keys[positions] == lookups), minlength=len(subset))
+    isSuperset = contained == lengths[subset]
+    subset = subset[isSuperset]
+    superset = superset[isSuperset]
+
+    # Keep the largest superset of every subset
+    order = np.lexsort((superset, -lengths[superset], subset))
+    subset = subset[order]
+    superset = superset[order]
+    first = np.ones(len(subset), dtype=bool)
+    first[1:] = subset[1:] != subset[:-1]
+    supersets[subset[first]] = superset[first]
+    return supersets
+
+def _ranges(starts, counts):
+    """
+    Concatenation of np.arange(start, start + count) for every start and count.
+
+    """
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) > 0 else 0) - np.repeat(ends - counts, counts) + np.repeat(starts, counts)
+
+def _groupSort(group, values):
+    """
+    Returns the indices that sort values within each group, for a sorted array of groups.
+    Faster than a two key lexsort: values are replaced by their rank and combined with
+    the group into a single integer key.
+
+    """
+    rank = np.empty(len(values), dtype=np.int64)
+    rank[np.argsort(values)] = np.arange(len(values))
+    # Keys are unique so the sort need not be stable
+    return np.argsort(group.astype(np.int64) * len(values) + rank)
+
+def _invertNormalEquations(matrices):
+    """
+    Invert a stack of least-squares normal equation matrices. Matrices are inverted directly
+    unless singular (too few distinct times for the fit), which are pseudo-inverted to
+    give a least-norm fit.
+
+    """
+    # The determinant of a Gram matrix relative to the product of its diagonal is between
+    # zero (singular) and one, whatever the scale of the data
+    diagonal = np.prod(np.diagonal(matrices, axis1=1, axis2=2), axis=1)
+    regular = np.zeros(len(matrices), dtype=bool)
+    positive = diagonal > 0
+    regular[positive] = np.linalg.det(matrices[positive]) / diagonal[positive] > 1e-10
+    inverse = np.empty(matrices.shape)
+    if np.any(regular):
+        inverse[regular] = np.linalg.inv(matrices[regular])
+    if np.any(~regular):
+        inverse[~regular] = np.linalg.pinv(matrices[~regular])
+    return inverse
+
+def _angularSeparation(ra1, dec1, ra2, dec2):
+    """
+    Angular distance in degrees between two sets of positions in degrees (haversine formula).
+
+    """
+    ra1, dec1, ra2, dec2 = [np.radians(angle) for angle in (ra1, dec1, ra2, dec2)]
+    a = np.sin((dec2 - dec1) / 2.)**2 + np.cos(dec1) * np.cos(dec2) * np.sin((ra2 - ra1) / 2.)**2
+    return np.degrees(2. * np.arcsin(np.sqrt(np.clip(a, 0., 1.))))
+
+def _insertRows(con, table, frame):
+    """
+    Insert the rows of a DataFrame into an existing table with a single executemany
+    on the DataFrame's column arrays. Missing values (NaN) are inserted as NULL.
+    Does not commit.
+
+    """
+    con.executemany("INSERT INTO {} ({}) VALUES ({})".format(table,
+                                                             ", ".join(frame.columns),
+                                                             ", ".join(["?"] * len(frame.columns))),
+                    _sqlRows(frame))
+    return
+
+def _updateRows(con, table, key, frame):
+    """
+    Update the rows of an existing table whose key matches the DataFrame's key column
+    with the DataFrame's other columns, in a single executemany. Missing values (NaN) are set
+    to NULL. Does not commit.
+
+    """
+    columns = [column for column in frame.columns if column != key]
+    con.executemany("UPDATE {} SET {} WHERE {} = ?".format(table,
+                                                           ", ".join(["{} = ?".format(column) for column in columns]),
+                                                           key),
+                    _sqlRows(frame[columns + [key]]))
+    return
+
+def _sqlRows(frame):
+    """
+    Returns an iterator over the rows of a DataFrame as tuples of Python values
+    built from its column arrays, with NaN replaced by None.
+
+    """
+    columns = []
+    for column in frame.columns:
+        values = frame[column].values
+        if values.dtype.kind == "f" and np.any(np.isnan(values)):
+            values = values.astype(object)
+            values[pd.isnull(values)] = None
+        columns.append(values.tolist())
+    return zip(*columns)
+
 def _findNewLinesAndDeletedIndices(file1, file2):
     """
     Find new lines and the indices of deleted lines between two files. Compares file one and 
     two, and return the new lines and their indices in file two and the indices of lines deleted in file one. 
+    See `_findNewLinkagesAndDeletedIndices`.
 
     Parameters
     ----------
@@ -787,42 +1950,188 @@ def _findNewLinesAndDeletedIndices(file1, file2):
     `numpy.ndarray`
         Indices (line numbers) of lines deleted in file 1.
     """
-    file1In = open(file1, "r")
-    file2In = open(file2, "r")
-    
-    # Here we use unified_diff. Unfortunately, at this stage ndiff would be more informative with
-    #  regards to index tracking however it is dreadfully slow with big files due to a series 
-    #  of internal nested for loops. 
-    udiff = list(difflib.unified_diff(file1In.readlines(), file2In.readlines(), n=0))
-    
-    new_lines = []
-    new_line_nums = []
-    deleted_lines = []
-    deleted_line_nums = []
+    (members, offsets), new_line_nums, deleted_line_nums, _ = _findNewLinkagesAndDeletedIndices(file1, file2)
+    tokens = members.astype(str)
+    new_lines = [" ".join(tokens[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+    return new_lines, new_line_nums, deleted_line_nums
+
+def _findNewLinkagesAndDeletedIndices(file1, file2):
+    """
+    Find new linkages and the indices of deleted linkages between two linkage files. A linkage
+    is identified by its set of members regardless of their order, so a linkage is deleted if file two
+    has no linkage with the same members and new if file one has none. Repeated linkages are matched
+    one to one. Runs in linear time: both files are read into CSR arrays and every linkage is
+    reduced to its length and an order independent 128-bit hash of its members (see `_hashLinkages`).
 
+    Parameters
+    ----------
+    file1 : str
+        Path to file one.
+
+    file2 : str
+        Path to file two.
     
-    for line in udiff[2:]:
-        line_elements = line.split()
-        if line_elements[0] == '@@':
-            file1_index = int(line_elements[1].split(",")[0][1:])
-            file2_index = int(line_elements[2].split(",")[0][1:])
-        else:
-            if line_elements[0][0] == "+":
-                # This line only exists in file two. 
-                # Lets add this line to a list of newly 
-                #  created lines. 
-                new_lines.append(line[1:-2])
-                new_line_nums.append(file2_index)
-                file2_index += 1
-            elif line_elements[0][0] == "-":
-                # This line only exists in file one.
-                # Lets append the index to our list of deleted
-                #  line numbers.
-                deleted_lines.append(line)
-                deleted_line_nums.append(file1_index)
-                file1_index += 1
-            
-    return new_lines, np.array(new_line_nums), np.array(deleted_line_nums)
+    Returns
+    -------
+    tuple
+        The new linkages in file 2 as a CSR (members, offsets) tuple.
+
+    `numpy.ndarray`
+        Indices (line numbers) of new linkages in file 2.
+
+    `numpy.ndarray`
+        Indices (line numbers) of linkages deleted in file 1.
+
+    `numpy.ndarray`
+        Line numbers in file 1 (first column) and file 2 (second column) of every
+        linkage found in both, in file 2 order.
+    """
+    members1, offsets1 = readLinkages(file1)
+    members2, offsets2 = readLinkages(file2)
+    matches1, matches2 = _matchLinkages(_hashLinkages(members1, offsets1), _hashLinkages(members2, offsets2))
+    deleted = np.ones(len(offsets1) - 1, dtype=bool)
+    deleted[matches1] = False
+    new = np.ones(len(offsets2) - 1, dtype=bool)
+    new[matches2] = False
+
+    new_line_nums = np.flatnonzero(new) + 1
+    deleted_line_nums = np.flatnonzero(deleted) + 1
+    matched_line_nums = np.column_stack([matches1, matches2]) + 1
+
+    # Gather the members of new linkages into their own CSR structure
+    lengths = np.diff(offsets2)[new]
+    new_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    new_offsets[1:] = np.cumsum(lengths)
+    new_members = members2[np.repeat(new, np.diff(offsets2))]
+    return (new_members, new_offsets), new_line_nums, deleted_line_nums, matched_line_nums
+
+def _readLinkageLineage(linkageFiles, chunkSize=None):
+    """
+    Follow linkages through a sequence of linkage files, each made by running a stage on the
+    previous one. A linkage is created by the first file it appears in and deleted by the first
+    file it is missing from. Every file is read in blocks of chunkSize bytes (see `analyzemops.linkages.iterLinkages`),
+    only the hashed members of each linkage are kept. Empty lines are not linkages.
+
+    Returns, with one entry per linkage (those in the first file followed by those created by each
+    later file, in line order): the number of members, the index of the file that created it, the
+    index of the file that deleted it (-1 if none) and an array of its line number in every
+    file (NaN if it is not in that file). Also returns, for every file, a boolean array flagging
+    the lines that are new linkages.
+
+    """
+    keys = []
+    for linkageFile in linkageFiles:
+        fileKeys = [np.empty((0, 3), dtype=np.int64)]
+        for members, offsets in iterLinkages(linkageFile, chunkSize=chunkSize):
+            fileKeys.append(_hashLinkages(members, offsets))
+        keys.append(np.concatenate(fileKeys))
+
+    # Row (linkage index) of every line in the current file, -1 for empty lines
+    new = keys[0][:, 0] > 0
+    rows = np.where(new, np.cumsum(new) - 1, -1)
+    newLines = [new]
+    numMembers = [keys[0][new, 0]]
+    created = [np.zeros(np.sum(new), dtype=int)]
+    deletedRows = []
+    presentRows = [rows]
+    numRows = np.sum(new)
+
+    for i in range(1, len(linkageFiles)):
+        matches1, matches2 = _matchLinkages(keys[i - 1], keys[i])
+        kept = np.zeros(len(keys[i - 1]), dtype=bool)
+        kept[matches1] = True
+        deletedRows.append((i, rows[~kept][rows[~kept] >= 0]))
+
+        # Unchanged linkages keep their row wherever they moved to in this file
+        old = np.zeros(len(keys[i]), dtype=bool)
+        old[matches2] = True
+        new = ~old & (keys[i][:, 0] > 0)
+        rows = np.full(len(keys[i]), -1, dtype=np.int64)
+        rows[matches2] = presentRows[-1][matches1]
+        rows[new] = numRows + np.arange(np.sum(new))
+        numRows += np.sum(new)
+
+        newLines.append(new)
+        numMembers.append(keys[i][new, 0])
+        created.append(np.full(np.sum(new), i, dtype=int))
+        presentRows.append(rows)
+        keys[i - 1] = None
+
+    deleted = np.full(numRows, -1, dtype=int)
+    for i, deletedRow in deletedRows:
+        deleted[deletedRow] = i
+    lineNums = np.full((numRows, len(linkageFiles)), np.nan)
+    for i, rows in enumerate(presentRows):
+        lines = np.flatnonzero(rows >= 0)
+        lineNums[rows[lines], i] = lines + 1
+    return np.concatenate(numMembers), np.concatenate(created), deleted, lineNums, newLines
+
+def _hashLinkages(members, offsets):
+    """
+    Returns an array with one row per linkage: the number of members and two independent
+    order-independent hashes of the members (a sum and an exclusive or of mixed member values).
+
+    """
+    x = np.asarray(members, dtype=np.int64).view(np.uint64)
+    h1 = _mix(x)
+    h2 = _mix(x ^ np.uint64(0x5851F42D4C957F2D))
+    # Reduce per linkage with cumulative sums and exclusive ors, unsigned arithmetic wraps
+    sums = np.zeros(len(x) + 1, dtype=np.uint64)
+    sums[1:] = np.cumsum(h1, dtype=np.uint64)
+    xors = np.zeros(len(x) + 1, dtype=np.uint64)
+    if len(x) > 0:
+        xors[1:] = np.bitwise_xor.accumulate(h2)
+
+    keys = np.empty((len(offsets) - 1, 3), dtype=np.int64)
+    keys[:, 0] = np.diff(offsets)
+    keys[:, 1] = (sums[offsets[1:]] - sums[offsets[:-1]]).view(np.int64)
+    keys[:, 2] = (xors[offsets[1:]] ^ xors[offsets[:-1]]).view(np.int64)
+    return keys
+
+def _matchLinkages(keys1, keys2):
+    """
+    Match two sets of linkage keys (see `_hashLinkages`) one to one. Returns the indices
+    of the matched linkages in the first set and the indices of the linkages they match
+    in the second set, in the order of the second set. The nth repeat of a key in one set
+    matches the nth repeat in the other, if there is one.
+
+    """
+    keys = np.concatenate([keys1, keys2])
+    source = np.concatenate([np.zeros(len(keys1), dtype=np.int8), np.ones(len(keys2), dtype=np.int8)])
+    # Sort so that equal keys are adjacent, those from the first set first, each in line order
+    order = np.lexsort((source, keys[:, 2], keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    source = source[order]
+    positions = np.arange(len(keys))
+
+    newGroup = np.ones(len(keys), dtype=bool)
+    newGroup[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    group = np.cumsum(newGroup) - 1
+    newRun = newGroup.copy()
+    newRun[1:] |= source[1:] != source[:-1]
+    rank = positions - np.maximum.accumulate(np.where(newRun, positions, 0))
+
+    counts1 = np.bincount(group, weights=(source == 0)).astype(np.int64)
+    counts2 = np.bincount(group, weights=(source == 1)).astype(np.int64)
+    # Within a group the first set's keys are followed by the second set's, the
+    # nth of the second set is paired with the nth of the first
+    groupStart = positions[newGroup]
+    matched = (source == 1) & (rank < counts1[group])
+    partners = groupStart[group[matched]] + rank[matched]
+    matches1 = order[partners]
+    matches2 = order[matched] - len(keys1)
+    inOrder = np.argsort(matches2, kind="mergesort")
+    return matches1[inOrder], matches2[inOrder]
+
+def _mix(x):
+    """
+    SplitMix64 finalizer applied elementwise to an unsigned 64-bit array.
+
+    """
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
 
 def _makeNewLinkageDataFrames(newLines, linkageType="trackletId", createdBy=1, idStart=1):
     """
@@ -854,26 +2163,56 @@ def _makeNewLinkageDataFrames(newLines, linkageType="trackletId", createdBy=1, i
         AllLinkages DataFrame: Column of linkage IDs with one row per linkage, with columns of createdBy and 
         numMembers.
     """
-    # Assign linkage ids 
-    ids = np.arange(idStart, idStart + len(newLines), dtype=int)
-    # Create a dataframe with new linkages
-    # Read in the trackletFile where every row is a string of diaIds delimited by whitespace
-    # Split the string of diaIds into separate columns and then stack the columns so that every tracklet has 
-    # a row for every diaId
-    linkageMembers = pd.DataFrame(newLines, columns=["diaId"])
-    # Split string of diaIds and stack them 
-    linkageMembers = pd.DataFrame(pd.DataFrame(linkageMembers["diaId"].str.split(" ").tolist(), index=ids).stack(), columns=["diaId"])
-    # Reset the index to account for stacking
-    linkageMembers.reset_index(1, drop=True, inplace=True)
-    linkageMembers[linkageType] = linkageMembers.index
-    linkageMembers = linkageMembers[[linkageType, "diaId"]]
-    linkageMembers["diaId"].replace("", np.nan, inplace=True)
-    linkageMembers.dropna(inplace=True)
+    # Parse the new lines as if they were a linkage file
+    data = "".join([line + "\n" for line in newLines]).encode("utf-8")
+    members, offsets = _parseLinkages(data, "new linkages")
+    return _makeLinkageDataFrames(members, offsets, linkageType=linkageType, createdBy=createdBy, idStart=idStart)
+
+def _makeLinkageDataFrames(members, offsets, linkageType="trackletId", createdBy=1, idStart=1):
+    """
+    Create linkage members and all linkages dataframes from a CSR linkage structure
+    (see `analyzemops.linkages.readLinkages`). Empty linkages are dropped.
     
-    allLinkages = pd.DataFrame(linkageMembers[linkageType].unique(), columns=[linkageType])
-    allLinkages["numMembers"] = linkageMembers[linkageType].value_counts().sort_index().values
-    allLinkages["createdBy"] = np.ones(len(allLinkages), dtype=int)*createdBy
-    allLinkages["deletedBy"] = np.zeros(len(allLinkages), dtype=int)
+    Parameters
+    ----------
+    members : `numpy.ndarray`
+        Flat array of linkage members (diaIds).
+
+    offsets : `numpy.ndarray`
+        Offsets into the members array, one more than the number of linkages.
+
+    linkageType : str, optional
+        One of trackletId or trackId. [Default = 'trackletId']
+
+    createdBy : int, optional
+        See `_makeNewLinkageDataFrames`. [Default = 1]
+
+    idStart : int, optional
+        Linkage ID number from which to start assigning new linkage IDs.
+        [Default = 1]
+        
+    Returns
+    -------
+    `pandas.DataFrame`
+        LinkageMembers DataFrame: Column of linkage IDs with one row per member detection ID.
+    
+    `pandas.DataFrame`
+        AllLinkages DataFrame: Column of linkage IDs with one row per linkage, with columns of createdBy and 
+        numMembers.
+    """
+    numMembers = np.diff(offsets)
+    numMembers = numMembers[numMembers > 0]
+    # Assign linkage ids and repeat each once per member
+    ids = np.arange(idStart, idStart + len(numMembers), dtype=np.int64)
+    linkageMembers = pd.DataFrame({linkageType: np.repeat(ids, numMembers),
+                                   "diaId": np.asarray(members, dtype=np.int64)},
+                                  columns=[linkageType, "diaId"])
+
+    allLinkages = pd.DataFrame({linkageType: ids,
+                                "numMembers": numMembers,
+                                "createdBy": np.ones(len(ids), dtype=int) * createdBy,
+                                "deletedBy": np.zeros(len(ids), dtype=int)},
+                               columns=[linkageType, "numMembers", "createdBy", "deletedBy"])
     
     return linkageMembers, allLinkages
 
@@ -0,0 +1,460 @@
+import os
+import re
+import numpy as np
+import pandas as pd
+from collections import OrderedDict, deque
+from multiprocessing.pool import ThreadPool
+
+from .config import Config
+from .detections import diaSourceStore, readDiaSourceStore
+
+__all__ = ["readLinkages", "iterLinkages", "writeLinkages", "readLinkTrackletsOut", "readDiaIds",
+           "idsToIndices", "indicesToIds", "makeLinkTrackletsInputByNight"]
+
+# Number of nights of diaIds to keep in memory per process
+DIA_ID_CACHE_SIZE = 4
+
+_diaIdCache = OrderedDict()
+
+# Lines of interest in linkTracklets' output
+_TIMING_LINE = re.compile(r"^\s*(.+?) (?:took|after) ([-+.\deE]+) seconds\.")
+_TRACKS_FOUND_LINE = re.compile(r"so far, we have found (\d+) tracks\.")
+_IMAGE_PAIRS_LINE = re.compile(r"^Found (\d+) valid start/end image pairs\.")
+
+def readLinkages(linkageFile):
+    """
+    Read a linkage file (tracklets or tracks) where every line is a whitespace delimited
+    list of detection IDs or indices into a compressed sparse row (CSR) structure.
+    The members of linkage i are members[offsets[i]:offsets[i + 1]].
+
+    Parameters
+    ----------
+    linkageFile : str
+        Path to linkage file.
+
+    Returns
+    -------
+    `numpy.ndarray`
+        Flat array of linkage members (int64).
+
+    `numpy.ndarray`
+        Offsets into the members array, one more than the number of linkages (int64).
+    """
+    return _parseLinkages(open(linkageFile, "rb").read(), linkageFile)
+
+def _parseLinkages(data, source):
+    """
+    Parse the contents of a linkage file (bytes) into a CSR structure. See `readLinkages`.
+    Source names the data in error messages.
+
+    """
+    if len(data) == 0:
+        return np.array([], dtype=np.int64), np.zeros(1, dtype=np.int64)
+    if not data.endswith(b"\n"):
+        data += b"\n"
+
+    # A token starts wherever a non-whitespace character follows whitespace (or the
+    # start of the file), every newline ends a linkage
+    buf = np.frombuffer(data, dtype=np.uint8)
+    isSpace = (buf == ord(" ")) | (buf == ord("\n")) | (buf == ord("\t")) | (buf == ord("\r"))
+    tokenStarts = np.flatnonzero(~isSpace & np.concatenate(([True], isSpace[:-1])))
+    lineEnds = np.flatnonzero(buf == ord("\n"))
+    offsets = np.zeros(len(lineEnds) + 1, dtype=np.int64)
+    offsets[1:] = np.searchsorted(tokenStarts, lineEnds)
+
+    members = np.fromstring(data, dtype=np.int64, sep=" ")
+    if len(members) != offsets[-1]:
+        raise ValueError("{} contains {} members but {} could be parsed as integers.".format(source,
+                                                                                            offsets[-1],
+                                                                                            len(members)))
+    return members, offsets
+
+def iterLinkages(linkageFile, chunkSize=None):
+    """
+    Read a linkage file in blocks of whole lines, yielding each block as a CSR
+    structure (see `readLinkages`).
+
+    Parameters
+    ----------
+    linkageFile : str
+        Path to linkage file.
+
+    chunkSize : int, optional
+        Number of bytes to read per block. Lines are never split, so a block runs
+        on to the end of its last line. If None, the whole file is read as one block.
+        [Default = None]
+
+    Yields
+    ------
+    `numpy.ndarray`
+        Flat array of linkage members in the block (int64).
+
+    `numpy.ndarray`
+        Offsets into the members array, one more than the number of linkages in the block (int64).
+    """
+    if chunkSize is None:
+        yield readLinkages(linkageFile)
+        return
+
+    stream = open(linkageFile, "rb")
+    remainder = b""
+    for data in iter(lambda: stream.read(chunkSize), b""):
+        data = remainder + data
+        end = data.rfind(b"\n") + 1
+        remainder = data[end:]
+        if end > 0:
+            yield _parseLinkages(data[:end], linkageFile)
+    stream.close()
+    if len(remainder) > 0:
+        yield _parseLinkages(remainder, linkageFile)
+
+def writeLinkages(linkageFile, members, offsets):
+    """
+    Write a CSR linkage structure to file in the format used by MOPS: one linkage
+    per line, every member followed by a single space.
+
+    Parameters
+    ----------
+    linkageFile : str
+        Path to output linkage file.
+
+    members : `numpy.ndarray`
+        Flat array of linkage members.
+
+    offsets : `numpy.ndarray`
+        Offsets into the members array, one more than the number of linkages.
+
+    Returns
+    -------
+    None
+    """
+    tokens = np.asarray(members).astype(str).astype(object) + " "
+    lengths = np.diff(offsets)
+    # Terminate the last member of every linkage with a newline
+    ends = offsets[1:][lengths > 0] - 1
+    tokens[ends] = tokens[ends] + "\n"
+    # Empty linkages still need their (empty) line
+    empty = offsets[:-1][lengths == 0]
+    if len(empty) > 0:
+        tokens = np.insert(tokens, empty, "\n")
+
+    outFile = open(linkageFile, "w")
+    outFile.write("".join(tokens.tolist()))
+    outFile.close()
+    return
+
+def readLinkTrackletsOut(trackOutFile):
+    """
+    Read the output of linkTracklets in a single pass: the chi-squared values and fit range
+    of every track (its "chi_sq:" lines, in track file order) and the program's own timing
+    and summary lines.
+
+    Parameters
+    ----------
+    trackOutFile : str
+        Path to linkTracklets output file.
+
+    Returns
+    -------
+    dict
+        Arrays (float64) of chiSqDec, chiSqRa and fitRange, one value per track. Empty if
+        linkTracklets did not report them.
+
+    dict
+        Summary of the run: "timings", a list of (step, seconds) tuples for every
+        "... took x seconds." and "Completed after x seconds." line in order, "tracksFound",
+        the number of tracks found and "imagePairs", the number of start/end image pairs
+        (None if not reported).
+
+    Raises
+    ------
+    ValueError
+        If a "chi_sq:" line can not be parsed.
+    """
+    chiSq = []
+    summary = {"timings": [], "tracksFound": None, "imagePairs": None}
+    stream = open(trackOutFile, "r")
+    for lineNum, line in enumerate(stream, 1):
+        if line.startswith("chi_sq:"):
+            try:
+                chiSq.append([float(value) for value in line.split()[1:4]])
+            except ValueError:
+                chiSq.append([])
+            if len(chiSq[-1]) != 3:
+                raise ValueError("Could not parse chi_sq line {} of {}: {}".format(lineNum, trackOutFile, line.strip()))
+            continue
+
+        match = _TIMING_LINE.match(line)
+        if match is not None:
+            summary["timings"].append((match.group(1), float(match.group(2))))
+            continue
+        match = _TRACKS_FOUND_LINE.search(line)
+        if match is not None:
+            summary["tracksFound"] = int(match.group(1))
+            continue
+        match = _IMAGE_PAIRS_LINE.match(line)
+        if match is not None:
+            summary["imagePairs"] = int(match.group(1))
+    stream.close()
+
+    chiSq = np.array(chiSq, dtype=np.float64).reshape(-1, 3)
+    return dict([(column, chiSq[:, i]) for i, column in enumerate(["chiSqDec", "chiSqRa", "fitRange"])]), summary
+
+def readDiaIds(diasourceFile):
+    """
+    Read the diaIds from a nightly diasource file. Returns the diaIds in file order
+    (so that the row index of a detection is its position in the array) as well as the
+    sort order of the diaIds for fast lookups. Results are cached per process, so converting
+    several tracklet files for the same night only reads the diasource file once. If the
+    diasource file has an up to date detection store in `Config.diasource_store_dir`
+    (see `analyzemops.detections`), the diaIds are taken from the store instead of
+    parsing the file.
+
+    Parameters
+    ----------
+    diasourceFile : str
+        Path to nightly diasource file.
+
+    Returns
+    -------
+    `numpy.ndarray`
+        DiaIds in file order (int64).
+
+    `numpy.ndarray`
+        Indices that sort the diaIds.
+    """
+    key = (os.path.abspath(diasourceFile), os.path.getmtime(diasourceFile))
+    if key in _diaIdCache:
+        return _diaIdCache[key]
+
+    storeFile = diaSourceStore(diasourceFile)
+    if storeFile is not None:
+        # The store is sorted by diaId and records every detection's row
+        detections = readDiaSourceStore(storeFile)
+        order = np.array(detections["row"])
+        diaIds = np.empty(len(order), dtype=np.int64)
+        diaIds[order] = detections["diaId"]
+    elif os.path.getsize(diasourceFile) == 0:
+        diaIds = np.array([], dtype=np.int64)
+        order = np.array([], dtype=np.int64)
+    else:
+        diaIds = pd.read_csv(diasourceFile, sep=r"\s+", header=None, usecols=[0], dtype=np.int64)[0].values
+        order = np.argsort(diaIds, kind="mergesort")
+
+    _diaIdCache[key] = (diaIds, order)
+    while len(_diaIdCache) > DIA_ID_CACHE_SIZE:
+        _diaIdCache.popitem(last=False)
+    return diaIds, order
+
+def idsToIndices(trackletFile, diasourceFile, outFile):
+    """
+    Convert a tracklet file where tracklets are listed by diaId to one where
+    tracklets are listed by the row index of each detection in the diasource file.
+    This format is required by collapseTracklets, purifyTracklets and removeSubsets.
+    Equivalent to MOPS's idsToIndices.py.
+
+    Parameters
+    ----------
+    trackletFile : str
+        Path to tracklet file (by diaId).
+
+    diasourceFile : str
+        Path to nightly diasource file.
+
+    outFile : str
+        Path to output tracklet file (by index).
+
+    Returns
+    -------
+    None
+    """
+    members, offsets = readLinkages(trackletFile)
+    writeLinkages(outFile, _mapIdsToIndices(members, diasourceFile, trackletFile), offsets)
+    return
+
+def indicesToIds(trackletFile, diasourceFile, outFile):
+    """
+    Convert a tracklet file where tracklets are listed by the row index of each
+    detection in the diasource file back to one where tracklets are listed by diaId.
+    Equivalent to MOPS's indicesToIds.py.
+
+    Parameters
+    ----------
+    trackletFile : str
+        Path to tracklet file (by index).
+
+    diasourceFile : str
+        Path to nightly diasource file.
+
+    outFile : str
+        Path to output tracklet file (by diaId).
+
+    Returns
+    -------
+    None
+    """
+    diaIds, order = readDiaIds(diasourceFile)
+    members, offsets = readLinkages(trackletFile)
+
+    if len(members) > 0 and (members.min() < 0 or members.max() >= len(diaIds)):
+        raise ValueError("{} contains indices outside of {}.".format(trackletFile, diasourceFile))
+
+    writeLinkages(outFile, diaIds[members], offsets)
+    return
+
+def makeLinkTrackletsInputByNight(diasources, tracklets, outDir,
+                                  windowSize=15,
+                                  nightMin=3,
+                                  processes=8,
+                                  verbose=Config.verbose):
+    """
+    Combine nightly diasources and tracklets (by diaId) into the sliding windows of
+    detections (.dets) and tracklets by index (.ids) required by linkTracklets. Equivalent
+    to MOPS's makeLinkTrackletsInput_byNight.py.
+
+    A window starts on every night and contains every night within windowSize nights
+    of the first. Each night's detections and tracklets are read once and kept in a
+    rolling buffer: moving to the next window drops the oldest night and appends the newest.
+    Windows with fewer than nightMin nights can not produce any tracks and are skipped.
+    Windows are written in parallel, at most processes windows are queued at once so that
+    only the nights of those windows are kept in memory.
+
+    Parameters
+    ----------
+    diasources : list
+        List of paths to nightly diasource files. File names should start with the night.
+
+    tracklets : list
+        List of paths to nightly tracklet files (by diaId), in the same order as diasources.
+
+    outDir : str
+        Dets and ids file output directory.
+
+    windowSize : int, optional
+        Number of nights in a window in which to combine nightly diasources
+        and tracklets into. [Default = 15]
+
+    nightMin : int, optional
+        Minimum number of nights linkTracklets requires in a track. [Default = 3]
+
+    processes : int, optional
+        Number of windows to write at once. [Default = 8]
+
+    verbose : bool, optional
+        Print progress statements? [Default = `Config.verbose`]
+
+    Returns
+    -------
+    list
+        List of per window diasource files.
+
+    list
+        List of per window tracklets.
+    """
+    nights = [int(os.path.basename(diasource).split(".")[0]) for diasource in diasources]
+    nights, diasources, tracklets = zip(*sorted(zip(nights, diasources, tracklets)))
+
+    blocks = deque()
+    nextNight = 0
+    dets = []
+    ids = []
+    pending = deque()
+
+    pool = ThreadPool(processes=processes)
+    for night in nights:
+        # Drop nights that precede this window and add the nights that
+        # have come into it
+        while len(blocks) > 0 and blocks[0][0] < night:
+            blocks.popleft()
+        while nextNight < len(nights) and nights[nextNight] <= night + windowSize:
+            blocks.append(_readNightBlock(nights[nextNight], diasources[nextNight], tracklets[nextNight]))
+            nextNight += 1
+
+        if len(blocks) < nightMin:
+            if verbose is True:
+                print("No track could start on night {}, window only has {} nights. Skipping.".format(night, len(blocks)))
+            continue
+
+        window = list(blocks)
+        windowName = os.path.join(outDir, "night_{}_through_{}".format(night, window[-1][0]))
+        if verbose is True:
+            print("Writing {} ({} nights)...".format(windowName, len(window)))
+        pending.append(pool.apply_async(_writeWindow, (windowName, night, window)))
+        dets.append(windowName + ".dets")
+        ids.append(windowName + ".ids")
+
+        # Wait for the oldest window once too many are queued, every queued
+        # window holds on to its nights. Also raises any errors encountered while writing
+        while len(pending) > processes:
+            pending.popleft().get()
+
+    pool.close()
+    pool.join()
+    # Raise any errors encountered while writing
+    for result in pending:
+        result.get()
+
+    if verbose is True:
+        print("Done.")
+        print("")
+    return dets, ids
+
+def _mapIdsToIndices(members, diasourceFile, linkageFile):
+    """
+    Map an array of diaIds to their row indices in a nightly diasource file.
+
+    """
+    diaIds, order = readDiaIds(diasourceFile)
+
+    sortedIds = diaIds[order]
+    positions = np.searchsorted(sortedIds, members)
+    found = positions < len(sortedIds)
+    found[found] = sortedIds[positions[found]] == members[found]
+    if not np.all(found):
+        raise ValueError("{} contains {} diaIds not found in {}.".format(linkageFile,
+                                                                        np.sum(~found),
+                                                                        diasourceFile))
+    return order[positions]
+
+def _readNightBlock(night, diasourceFile, trackletFile):
+    """
+    Read a night's detections (as raw lines) and tracklets (by index) for use in
+    linkTracklets windows.
+
+    """
+    detections = open(diasourceFile, "rb").read()
+    if len(detections) > 0 and not detections.endswith(b"\n"):
+        detections += b"\n"
+    numDetections = detections.count(b"\n")
+
+    members, offsets = readLinkages(trackletFile)
+    members = _mapIdsToIndices(members, diasourceFile, trackletFile)
+    return night, detections, numDetections, members, offsets
+
+def _writeWindow(windowName, night, window):
+    """
+    Write a single linkTracklets window: the concatenated detections, the tracklets
+    re-indexed into the concatenated detections and the time before which tracks
+    must start.
+
+    """
+    detsOut = open(windowName + ".dets", "wb")
+    for block in window:
+        detsOut.write(block[1])
+    detsOut.close()
+
+    members = []
+    offsets = [np.zeros(1, dtype=np.int64)]
+    detectionOffset = 0
+    memberOffset = 0
+    for blockNight, detections, numDetections, blockMembers, blockOffsets in window:
+        members.append(blockMembers + detectionOffset)
+        offsets.append(blockOffsets[1:] + memberOffset)
+        detectionOffset += numDetections
+        memberOffset += blockOffsets[-1]
+    writeLinkages(windowName + ".ids", np.concatenate(members), np.concatenate(offsets))
+
+    dateOut = open(windowName + ".date.start_t_range", "w")
+    dateOut.write(str(float(night + 1)))
+    dateOut.close()
+    return
@@ -0,0 +1,112 @@
+import os
+import glob
+import difflib
+import numpy as np
+
+from ..io import buildTrackletDatabase
+from ..io import readTrackletsIntoDatabase
+from ..io import _findNewLinkagesAndDeletedIndices
+from ..io import _hashLinkages
+from ..io import _matchLinkages
+
+CONTROL_RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../unittest/controlRun/full")
+
+
+def _difflibNewAndDeletedLineNums(file1, file2):
+    # Line numbers of new and deleted lines as found by the difflib based
+    # implementation _findNewLinkagesAndDeletedIndices replaced
+    udiff = list(difflib.unified_diff(open(file1).readlines(), open(file2).readlines(), n=0))
+    newLineNums = []
+    deletedLineNums = []
+    for line in udiff[2:]:
+        lineElements = line.split()
+        if lineElements[0] == "@@":
+            file1Index = int(lineElements[1].split(",")[0][1:])
+            file2Index = int(lineElements[2].split(",")[0][1:])
+        elif lineElements[0][0] == "+":
+            newLineNums.append(file2Index)
+            file2Index += 1
+        elif lineElements[0][0] == "-":
+            deletedLineNums.append(file1Index)
+            file1Index += 1
+    return np.array(newLineNums, dtype=int), np.array(deletedLineNums, dtype=int)
+
+
+def _writeLines(fileName, lines):
+    stream = open(fileName, "w")
+    stream.write("".join([line + "\n" for line in lines]))
+    stream.close()
+    return fileName
+
+
+def test_findNewLinkagesAndDeletedIndicesMatchesDifflib():
+    # Every stage pair of the control run gives the same new and deleted lines as difflib
+    pairs = []
+    for collapsed in sorted(glob.glob(os.path.join(CONTROL_RUN, "trackletsCollapsed", "*.collapsed.byDiaIds"))):
+        night = os.path.basename(collapsed).split(".")[0]
+        purified = os.path.join(CONTROL_RUN, "trackletsPurified", night + ".tracklets.purified.byDiaIds")
+        final = os.path.join(CONTROL_RUN, "trackletsFinal", night + ".tracklets.final.byDiaIds")
+        pairs.append((os.path.join(CONTROL_RUN, "tracklets", night + ".tracklets"), collapsed))
+        pairs.append((collapsed, purified))
+        pairs.append((purified, final))
+    assert len(pairs) > 0
+
+    for file1, file2 in pairs:
+        newLines, newLineNums, deletedLineNums, matchedLineNums = _findNewLinkagesAndDeletedIndices(file1, file2)
+        expectedNewLineNums, expectedDeletedLineNums = _difflibNewAndDeletedLineNums(file1, file2)
+        np.testing.assert_array_equal(newLineNums, expectedNewLineNums)
+        np.testing.assert_array_equal(deletedLineNums, expectedDeletedLineNums)
+
+        # Lines difflib considers unchanged are matched to each other in order
+        numLines1 = len(open(file1).readlines())
+        numLines2 = len(open(file2).readlines())
+        unchanged1 = np.setdiff1d(np.arange(1, numLines1 + 1), expectedDeletedLineNums)
+        unchanged2 = np.setdiff1d(np.arange(1, numLines2 + 1), expectedNewLineNums)
+        np.testing.assert_array_equal(matchedLineNums, np.column_stack([unchanged1, unchanged2]))
+
+
+def test_findNewLinkagesAndDeletedIndicesReordered(tmpdir):
+    # Reordered linkages, and linkages with their members reordered, are unchanged
+    # and matched to the line they moved to
+    lines = ["1 2", "3 4", "5 6", "7 8 9"]
+    file1 = _writeLines(str(tmpdir.join("file1")), lines)
+    file2 = _writeLines(str(tmpdir.join("file2")), ["9 8 7", "5 6", "10 11", "1 2"])
+
+    (newMembers, newOffsets), newLineNums, deletedLineNums, matchedLineNums = _findNewLinkagesAndDeletedIndices(file1, file2)
+    np.testing.assert_array_equal(newMembers, [10, 11])
+    np.testing.assert_array_equal(newOffsets, [0, 2])
+    np.testing.assert_array_equal(newLineNums, [3])
+    np.testing.assert_array_equal(deletedLineNums, [2])
+    np.testing.assert_array_equal(matchedLineNums, [[4, 1], [3, 2], [1, 4]])
+
+
+def test_matchLinkagesRepeats():
+    # The nth repeat of a linkage in one set is matched to the nth repeat in the other
+    members = np.array([1, 2, 3, 4, 1, 2, 1, 2], dtype=np.int64)
+    keys1 = _hashLinkages(members, np.array([0, 2, 4, 6, 8]))
+    keys2 = _hashLinkages(np.array([3, 4, 2, 1], dtype=np.int64), np.array([0, 2, 4]))
+    matches1, matches2 = _matchLinkages(keys1, keys2)
+    np.testing.assert_array_equal(matches1, [1, 0])
+    np.testing.assert_array_equal(matches2, [0, 1])
+
+
+def test_readTrackletsIntoDatabaseReordered(tmpdir):
+    # Line numbers follow tracklets that a later stage moved to a different line
+    trackletFile = _writeLines(str(tmpdir.join("59580.tracklets")), ["1 2", "3 4", "5 6"])
+    collapsedFile = _writeLines(str(tmpdir.join("59580.tracklets.collapsed")), ["5 6", "3 4", "1 2"])
+    finalFile = _writeLines(str(tmpdir.join("59580.tracklets.final")), ["4 3", "1 2"])
+    con, database = buildTrackletDatabase("tracklets.db", str(tmpdir), verbose=False)
+
+    for chunkSize in [None, 4]:
+        allTracklets, trackletMembers = readTrackletsIntoDatabase(trackletFile, con,
+                                                                  collapsedTrackletFile=collapsedFile,
+                                                                  finalTrackletFile=finalFile,
+                                                                  trackletIdStart=1 if chunkSize is None else 4,
+                                                                  chunkSize=chunkSize,
+                                                                  verbose=False)
+        np.testing.assert_array_equal(allTracklets["_lineNum_1"].values, [1, 2, 3])
+        np.testing.assert_array_equal(allTracklets["_lineNum_2"].values, [3, 2, 1])
+        np.testing.assert_array_equal(allTracklets["_lineNum_4"].values, [2, 1, np.nan])
+        np.testing.assert_array_equal(allTracklets["createdBy"].values, [1, 1, 1])
+        np.testing.assert_array_equal(allTracklets["deletedBy"].values, [0, 0, 4])
+    con.close()
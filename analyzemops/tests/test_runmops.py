@@ -0,0 +1,154 @@
+import os
+import glob
+import time
+import pytest
+
+import runmops
+
+CONTROL_RUN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../unittest/controlRun/full")
+DIASOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../unittest/testData/full/nightly")
+
+
+def _fakeRunWindow(trackOut, call, cacheDir=None):
+    # Stands in for linkTracklets, recording when each window ran
+    start = time.time()
+    time.sleep(0.2)
+    end = time.time()
+    stream = open(os.path.join(os.path.dirname(trackOut), "windows.log"), "a")
+    stream.write("%s %r %r\n" % (os.path.basename(trackOut), start, end))
+    stream.close()
+    usage = {"name": os.path.basename(trackOut),
+             "returncode": 0,
+             "cached": False,
+             "wallTime": end - start,
+             "userTime": 0.0,
+             "systemTime": 0.0,
+             "maxRSS": 0,
+             "inputSize": 0,
+             "outputSize": 0,
+             "checksum": None}
+    return trackOut, 0, usage
+
+
+def test_runLinkTrackletsMemoryAdmission(tmpdir, monkeypatch):
+    # Windows only run together while the sum of their predicted memory fits in
+    # the budget, a window predicted to need more than the budget runs alone
+    dets = sorted(glob.glob(os.path.join(CONTROL_RUN, "trackletsByNight", "*.dets")))[:8]
+    ids = sorted(glob.glob(os.path.join(CONTROL_RUN, "trackletsByNight", "*.ids")))[:8]
+    memory = [3, 2, 2, 4, 1, 3, 12, 2]
+    memoryBudget = 6
+    monkeypatch.setattr(runmops, "_runWindow", _fakeRunWindow)
+    monkeypatch.setattr(runmops, "_estimateWindowMemory", lambda counts, history: list(memory))
+
+    outDir = os.path.join(str(tmpdir), "")
+    runmops.runLinkTracklets(dets, ids, outDir,
+                             enableMultiprocessing=True,
+                             processes=4,
+                             memoryBudget=memoryBudget,
+                             verbose=False)
+
+    predicted = dict((os.path.basename(det).split(".")[0] + runmops.TRACK_SUFFIX, m) for det, m in zip(dets, memory))
+    runs = []
+    for line in open(os.path.join(outDir, "windows.log")):
+        window, start, end = line.split()
+        runs.append((window, float(start), float(end)))
+    assert sorted([window for window, start, end in runs]) == sorted(predicted.keys())
+
+    maxRunning = 0
+    for window, start, end in runs:
+        running = [other for other, otherStart, otherEnd in runs if otherStart <= start < otherEnd]
+        assert sum([predicted[other] for other in running]) <= memoryBudget or len(running) == 1
+        maxRunning = max(maxRunning, len(running))
+    assert maxRunning > 1
+
+
+def _fakeRunTask(args):
+    # Stands in for every nightly call, writing a different output each time it runs
+    name, call, logName = args[:3]
+    _fakeRunTask.ran.append(name)
+    stream = open(logName, "w")
+    stream.write("%s %s\n" % (str(name), len(_fakeRunTask.ran)))
+    stream.close()
+    usage = {"name": os.path.basename(logName),
+             "returncode": 0,
+             "cached": False,
+             "wallTime": 0.0,
+             "userTime": 0.0,
+             "systemTime": 0.0,
+             "maxRSS": None,
+             "inputSize": 0,
+             "outputSize": os.path.getsize(logName),
+             "checksum": runmops._checksum(logName)}
+    return name, 0, usage
+
+
+def test_runTrackletsByNightRerunsDownstreamStages(tmpdir, monkeypatch):
+    # A stage whose output no longer matches its record runs again, and so does
+    # every later stage of the same night even though their outputs are intact
+    runDir = os.path.join(str(tmpdir), "")
+    tracker = runmops.Tracker(runDir)
+    tracker.diasources = [os.path.join(runDir, "59580.dias"), os.path.join(runDir, "59581.dias")]
+    tracker.trackletsDir = tracker.collapsedTrackletsDir = os.path.join(runDir, "tracklets", "")
+    tracker.purifiedTrackletsDir = tracker.finalTrackletsDir = os.path.join(runDir, "tracklets", "")
+    os.mkdir(tracker.trackletsDir)
+    monkeypatch.setattr(runmops, "_runTask", _fakeRunTask)
+
+    _fakeRunTask.ran = []
+    runmops.runTrackletsByNight(runmops.Parameters(), tracker, enableMultiprocessing=False, verbose=False)
+    assert len(_fakeRunTask.ran) == 2 * len(runmops.NIGHTLY_STAGES)
+
+    open(os.path.join(tracker.collapsedTrackletsDir, "59580" + runmops.COLLAPSED_TRACKLET_SUFFIX), "w").close()
+    _fakeRunTask.ran = []
+    runmops.runTrackletsByNight(runmops.Parameters(), tracker, enableMultiprocessing=False, verbose=False)
+    assert sorted(_fakeRunTask.ran) == sorted([("59580", stage) for stage in ["collapseTracklets", "collapsedIndicesToIds",
+                                                                              "purifyTracklets", "purifiedIndicesToIds",
+                                                                              "removeSubsets", "indicesToIds"]])
+    assert tracker.ranCollapseTracklets is True and tracker.ranIndicesToIds is True
+
+    _fakeRunTask.ran = []
+    runmops.runTrackletsByNight(runmops.Parameters(), tracker, enableMultiprocessing=False, verbose=False)
+    assert _fakeRunTask.ran == []
+
+
+def test_runGraphUnknownDependency():
+    tasks = {"a": (["true"], "a", []),
+             "b": (["true"], "b", ["a", "c"])}
+    with pytest.raises(ValueError):
+        runmops._runGraph(tasks, enableMultiprocessing=False, verbose=False)
+
+
+def _fakeRunMops(parameters, tracker, **kwargs):
+    # Stands in for a whole run, recording when each variant ran and with what share
+    start = time.time()
+    time.sleep(0.5)
+    end = time.time()
+    stream = open(os.path.join(os.path.dirname(os.path.dirname(tracker.runDir)), "variants.log"), "a")
+    stream.write("%s %r %r %s\n" % (parameters.raAccelMax, start, end, kwargs["processes"]))
+    stream.close()
+    if parameters.raAccelMax == 0.5:
+        raise ValueError("Variant failed.")
+    return parameters, tracker
+
+
+def test_runSweepRunsVariantsInParallel(tmpdir, monkeypatch):
+    # Variants differing only in their track stages run at once once the
+    # shared tracklet stages have run, splitting the processors between them
+    sweepDir = os.path.join(str(tmpdir), "sweep", "")
+    monkeypatch.setattr(runmops, "runMops", _fakeRunMops)
+    parametersList = runmops.parameterGrid({"raAccelMax": [0.01, 0.02, 0.03]})
+    results = runmops.runSweep(parametersList, DIASOURCES, sweepDir,
+                               processes=4, memoryBudget=1e9, verbose=False)
+    assert [parameters.raAccelMax for parameters, tracker in results] == [0.01, 0.02, 0.03]
+
+    runs = [line.split() for line in open(os.path.join(sweepDir, "variants.log"))]
+    assert [(value, processes) for value, start, end, processes in runs[:1]] == [("0.01", "4")]
+    assert sorted([(value, processes) for value, start, end, processes in runs[1:]]) == [("0.02", "2"), ("0.03", "2")]
+    (value2, start2, end2, processes2), (value3, start3, end3, processes3) = runs[1:]
+    assert float(runs[0][2]) <= min(float(start2), float(start3))
+    assert float(start2) < float(end3) and float(start3) < float(end2)
+
+    # A variant failing in its own process fails the sweep
+    parametersList = runmops.parameterGrid({"raAccelMax": [0.01, 0.02, 0.5]})
+    with pytest.raises(RuntimeError):
+        runmops.runSweep(parametersList, DIASOURCES, os.path.join(str(tmpdir), "failed", ""),
+                         processes=4, memoryBudget=1e9, verbose=False)
@@ -3,6 +3,9 @@ import yaml
 
 __all__ = ["Tracker"]
 
+# Suffix of nightly diasource files
+DIASOURCE_SUFFIX = ".dias"
+
 
 class Tracker(object):
 
@@ -49,10 +52,15 @@ class Tracker(object):
         self._ranMakeLinkTrackletsInputByNight = False
         self._ranLinkTracklets = False
         self._ranRemoveSubsetTracks = False
+        self._nightlyStatus = {}
+        self._metrics = {}
+        self._windowStatus = {}
 
         self._analysisStarted = False
         self._mainDatabase = None
+        self._trackletDatabase = None
         self._windowDatabases = None
+        self._trackDatabase = None
         self._objectsFile = None
         self._analyzedTracklets = None
         self._analyzedTracks = None
@@ -62,6 +70,12 @@ class Tracker(object):
         self._trackResults = None
         self._analysisFinished = False
 
+    def __setstate__(self, state):
+        # Trackers saved by earlier versions lack attributes added since,
+        # start from the defaults and restore what was saved
+        self.__init__(state.get("_runDir"))
+        self.__dict__.update(state)
+
     def __repr__(self):
         representation = ("------- MOPS Tracker --------\n" +
                           "Current run status:\n\n" +
@@ -405,6 +419,30 @@ class Tracker(object):
     def ranRemoveSubsetTracks(self, value):
         self._ranRemoveSubsetTracks = value
 
+    @property
+    def nightlyStatus(self):
+        return self._nightlyStatus
+
+    @nightlyStatus.setter
+    def nightlyStatus(self, value):
+        self._nightlyStatus = value
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, value):
+        self._metrics = value
+
+    @property
+    def windowStatus(self):
+        return self._windowStatus
+
+    @windowStatus.setter
+    def windowStatus(self, value):
+        self._windowStatus = value
+
     @property
     def analysisStarted(self):
         return self._analysisStarted
@@ -421,6 +459,14 @@ class Tracker(object):
     def mainDatabase(self, value):
         self._mainDatabase = value
 
+    @property
+    def trackletDatabase(self):
+        return self._trackletDatabase
+
+    @trackletDatabase.setter
+    def trackletDatabase(self, value):
+        self._trackletDatabase = value
+
     @property
     def windowDatabases(self):
         return self._windowDatabases
@@ -429,6 +475,14 @@ class Tracker(object):
     def windowDatabases(self, value):
         self._windowDatabases = value
 
+    @property
+    def trackDatabase(self):
+        return self._trackDatabase
+
+    @trackDatabase.setter
+    def trackDatabase(self, value):
+        self._trackDatabase = value
+
     @property
     def objectsFile(self):
         return self._objectsFile
@@ -494,7 +548,9 @@ class Tracker(object):
         self._analysisFinished = value  
 
     def getDetections(self, diasourcesDir):
-        diasourceList = sorted(os.listdir(diasourcesDir))
+        # Only nightly diasource files, the directory may hold other files
+        diasourceList = sorted([diasource for diasource in os.listdir(diasourcesDir)
+                                if diasource.endswith(DIASOURCE_SUFFIX)])
         diasources = []
 
         for diasource in diasourceList:
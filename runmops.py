@@ -15,15 +15,30 @@ Contact moeyensj@uw.edu with questions and / or concerns.
 """
 
 import os
+import sys
+import resource
 import subprocess
 import glob
 import argparse
 import yaml
 import shutil
 import multiprocessing
-
+import traceback
+import time
+import copy
+import itertools
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+
+from analyzemops.config import Config
 from analyzemops.parameters import Parameters
 from analyzemops.tracker import Tracker
+from analyzemops.linkages import idsToIndices, indicesToIds, makeLinkTrackletsInputByNight
+from analyzemops.detections import writeDiaSourceStores
+from analyzemops import cache
 
 # File suffixes
 DIASOURCE_SUFFIX = ".dias"
@@ -43,12 +58,67 @@ FINAL_TRACKLETS_DIR = "trackletsFinal/"
 TRACKLETS_BY_NIGHT_DIR = "trackletsByNight/"
 TRACKS_DIR = "tracks/"
 FINAL_TRACKS_DIR = "tracksFinal/"
+DIASOURCE_STORES_DIR = "diasourceStores/"
+
+# Parameters consumed by each group of stages, in pipeline order. Variants of
+# a sweep that agree on the parameters of the first n groups share those stages
+SWEEP_STAGES = [("tracklets", ["vMax", "vMin", "raTol", "decTol", "angTol", "vTol", "method",
+                               "useRMSfilt", "trackletRMSmax", "rmSubsetTracklets",
+                               "keepOnlyLongestTracklets"]),
+                ("tracks", ["windowSize", "detErrThresh", "decAccelMax", "raAccelMax", "nightMin",
+                            "detectMin", "bufferSize", "latestFirstEnd", "earliestLastEnd",
+                            "leafNodeSizeMax", "trackRMSmax", "trackAdditionThresh", "defaultAstromErr",
+                            "trackChiSqMin", "skyCenterRA", "skyCenterDec", "obsLat", "obsLon"]),
+                ("finalTracks", ["rmSubsetTracks", "keepOnlyLongestTracks"])]
+
+# Description of the variants of a sweep, kept in the sweep directory
+SWEEP_FILE = "sweep.yaml"
+
+# Minimum number of seconds between saves of the tracker while nightly stages run
+TRACKER_SAVE_INTERVAL = 30
+
+# Resource usage of every call made by runMops, kept in the run directory
+METRICS_FILE = "metrics.yaml"
+
+# Wall time, peak memory and size of previous linkTracklets runs per window,
+# kept in the tracks directory
+WINDOW_HISTORY_FILE = "windowHistory.yaml"
+
+# Peak memory model for linkTracklets used until enough windows have been run
+# to calibrate it: bytes of overhead, per detection and per tracklet
+LINKTRACKLETS_MEMORY_BASE = 64 * 1024**2
+LINKTRACKLETS_MEMORY_PER_DETECTION = 4 * 1024
+LINKTRACKLETS_MEMORY_PER_TRACKLET = 8 * 1024
+# Safety margin applied to predicted peak memory
+LINKTRACKLETS_MEMORY_HEADROOM = 1.25
 
 VERBOSE = True
 
+# Nightly stages and the tracker attributes recording whether they have run for
+# every night
+NIGHTLY_STAGES = {"findTracklets": "ranFindTracklets",
+                  "idsToIndices": "ranIdsToIndices",
+                  "collapseTracklets": "ranCollapseTracklets",
+                  "collapsedIndicesToIds": "ranCollapseTracklets",
+                  "purifyTracklets": "ranPurifyTracklets",
+                  "purifiedIndicesToIds": "ranPurifyTracklets",
+                  "removeSubsets": "ranRemoveSubsetTracklets",
+                  "indicesToIds": "ranIndicesToIds"}
+
+# Nightly stages and the tracker attributes listing their output files
+NIGHTLY_STAGE_OUTPUTS = {"findTracklets": "tracklets",
+                         "idsToIndices": "trackletsByIndex",
+                         "collapseTracklets": "collapsedTracklets",
+                         "collapsedIndicesToIds": "collapsedTrackletsById",
+                         "purifyTracklets": "purifiedTracklets",
+                         "purifiedIndicesToIds": "purifiedTrackletsById",
+                         "removeSubsets": "finalTracklets",
+                         "indicesToIds": "finalTrackletsById"}
+
 __all__ = ["directoryBuilder", "runFindTracklets", "runIdsToIndices",
            "runCollapseTracklets", "runPurifyTracklets", "runRemoveSubsets",
-           "runIndicesToIds", "runMakeLinkTrackletsInputByNight", "runLinkTracklets"]
+           "runIndicesToIds", "runMakeLinkTrackletsInputByNight", "runLinkTracklets",
+           "runTrackletsByNight", "parameterGrid", "runSweep"]
 
 defaults = Parameters()
 
@@ -153,6 +223,10 @@ def directoryBuilder(runDir,
 def runFindTracklets(diasources, outDir,
                      vmax=defaults.vMax,
                      vmin=defaults.vMin,
+                     enableMultiprocessing=True,
+                     processes=8,
+                     metrics=None,
+                     cacheDir=None,
                      verbose=VERBOSE):
     """
     Runs findTracklets.
@@ -175,6 +249,23 @@ def runFindTracklets(diasources, outDir,
         Minimum velocity tracklets can have in degrees per day.
         [Default = `analyzemops.parameters.vMin`]
 
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -185,21 +276,27 @@ def runFindTracklets(diasources, outDir,
     """
     function = "findTracklets"
     tracklets = []
-
-    outfile, errfile = _log(function, outDir)
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for diasource in diasources:
-        trackletsOut = _out(outDir, diasource, TRACKLET_SUFFIX)
-
-        call = [function, "-i", diasource, "-o",
-                trackletsOut, "-v", str(vmax), "-m", str(vmin)]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        call, trackletsOut = _findTrackletsCall(diasource, outDir,
+                                                vmax=vmax,
+                                                vmin=vmin)
+        calls.append((call, trackletsOut))
 
         tracklets.append(trackletsOut)
 
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
+
     if verbose:
         _status(function, False)
 
@@ -207,6 +304,11 @@ def runFindTracklets(diasources, outDir,
 
 
 def runIdsToIndices(tracklets, diasources, outDir,
+                    backend="script",
+                    enableMultiprocessing=True,
+                    processes=8,
+                    metrics=None,
+                    cacheDir=None,
                     verbose=VERBOSE):
     """
     Runs idsToIndices.py.
@@ -225,6 +327,28 @@ def runIdsToIndices(tracklets, diasources, outDir,
     outDir : str
         Tracklet by index output directory.
 
+    backend : {"script", "native"}, optional
+        If script, run MOPS's idsToIndices.py script in a new python process for every night.
+        If native, convert in-process with `analyzemops.linkages.idsToIndices`, reading
+        each night's diaIds once. [Default = "script"]
+
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -235,21 +359,25 @@ def runIdsToIndices(tracklets, diasources, outDir,
     """
     function = "idsToIndices.py"
     byIndex = []
-
-    outfile, errfile = _log(function, outDir)
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for tracklet, diasource in zip(tracklets, diasources):
-        byIndexOut = _out(outDir, diasource, TRACKLET_BY_INDEX_SUFFIX)
-
-        script = str(os.getenv("MOPS_DIR")) + "/bin/idsToIndices.py"
-        call = ["python", script, tracklet, diasource, byIndexOut]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        call, byIndexOut = _idsToIndicesCall(tracklet, diasource, outDir, backend=backend)
+        calls.append((call, byIndexOut))
 
         byIndex.append(byIndexOut)
 
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
+
     if verbose:
         _status(function, False)
 
@@ -264,6 +392,10 @@ def runCollapseTracklets(trackletsByIndex, diasources, outDir,
                          method=defaults.method,
                          useRMSfilt=defaults.useRMSfilt,
                          trackletRMSmax=defaults.trackletRMSmax,
+                         enableMultiprocessing=True,
+                         processes=8,
+                         metrics=None,
+                         cacheDir=None,
                          verbose=VERBOSE):
     """
     Runs collapseTracklets.
@@ -316,6 +448,23 @@ def runCollapseTracklets(trackletsByIndex, diasources, outDir,
         RMS <= maxRMSm * average magnitude + maxRMSb. Defaults are 0. and .001.
         [Default = `analyzemops.parameters.trackletRMSmax`]
 
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -326,24 +475,32 @@ def runCollapseTracklets(trackletsByIndex, diasources, outDir,
     """
     function = "collapseTracklets"
     collapsedTracklets = []
-
-    outfile, errfile = _log(function, outDir)
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for tracklet, diasource in zip(trackletsByIndex, diasources):
-        collapsedTracklet = _out(outDir, diasource, COLLAPSED_TRACKLET_SUFFIX)
-
-        call = ["collapseTracklets", diasource, tracklet, str(raTol),
-                str(decTol), str(angTol), str(vTol), collapsedTracklet,
-                "--method", method,
-                "--useRMSFilt", str(useRMSfilt),
-                "--maxRMS", str(trackletRMSmax)]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        call, collapsedTracklet = _collapseTrackletsCall(tracklet, diasource, outDir,
+                                                         raTol=raTol,
+                                                         decTol=decTol,
+                                                         angTol=angTol,
+                                                         vTol=vTol,
+                                                         method=method,
+                                                         useRMSfilt=useRMSfilt,
+                                                         trackletRMSmax=trackletRMSmax)
+        calls.append((call, collapsedTracklet))
 
         collapsedTracklets.append(collapsedTracklet)
 
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
+
     if verbose:
         _status(function, False)
 
@@ -352,6 +509,10 @@ def runCollapseTracklets(trackletsByIndex, diasources, outDir,
 
 def runPurifyTracklets(collapsedTracklets, diasources, outDir,
                        trackletRMSmax=defaults.trackletRMSmax,
+                       enableMultiprocessing=True,
+                       processes=8,
+                       metrics=None,
+                       cacheDir=None,
                        verbose=VERBOSE):
     """
     Runs purifyTracklets.
@@ -371,6 +532,23 @@ def runPurifyTracklets(collapsedTracklets, diasources, outDir,
         Maximum tracklet RMS.  
         [Default = `analyzemops.parameters.trackletRMSmax`]
 
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
 
@@ -381,24 +559,26 @@ def runPurifyTracklets(collapsedTracklets, diasources, outDir,
     """
     function = "purifyTracklets"
     purifiedTracklets = []
-
-    outfile, errfile = _log(function, outDir)
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for tracklet, diasource in zip(collapsedTracklets, diasources):
-        purifiedTracklet = _out(outDir, diasource, PURIFIED_TRACKLET_SUFFIX)
-
-        call = ["purifyTracklets",
-                "--detsFile", diasource,
-                "--pairsFile", tracklet,
-                "--maxRMS", str(trackletRMSmax),
-                "--outFile", purifiedTracklet]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        call, purifiedTracklet = _purifyTrackletsCall(tracklet, diasource, outDir,
+                                                      trackletRMSmax=trackletRMSmax)
+        calls.append((call, purifiedTracklet))
 
         purifiedTracklets.append(purifiedTracklet)
 
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
+
     if verbose:
         _status(function, False)
 
@@ -409,6 +589,12 @@ def runRemoveSubsets(purifiedTracklets, diasources, outDir,
                      rmSubsets=defaults.rmSubsetTracklets,
                      keepOnlyLongest=defaults.keepOnlyLongestTracklets,
                      suffix=FINAL_TRACKLET_SUFFIX,
+                     enableMultiprocessing=True,
+                     processes=8,
+                     metrics=None,
+                     cacheDir=None,
+                     status=None,
+                     onComplete=None,
                      verbose=VERBOSE):
     """
     Runs removeSubsets.
@@ -438,6 +624,32 @@ def runRemoveSubsets(purifiedTracklets, diasources, outDir,
         Suffix to append to input file names when saving output files. 
         [Default = ".final"]
 
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
+    status : dict, optional
+        Completion records of previous calls keyed on output file name. Calls whose
+        output matches its record (same size and checksum) are not run again, and
+        a record is added for every call that completes. [Default = None]
+
+    onComplete : function, optional
+        If given, called with the resource usage of every call as it completes,
+        for example to save progress. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -448,23 +660,42 @@ def runRemoveSubsets(purifiedTracklets, diasources, outDir,
     """
     function = "removeSubsets"
     finalTracklets = []
-
-    outfile, errfile = _log(function, outDir)
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for tracklet, diasource in zip(purifiedTracklets, diasources):
-        finalTracklet = _out(outDir, tracklet, suffix)
+        call, finalTracklet = _removeSubsetsCall(tracklet, outDir,
+                                                 rmSubsets=rmSubsets,
+                                                 keepOnlyLongest=keepOnlyLongest,
+                                                 suffix=suffix)
+        finalTracklets.append(finalTracklet)
 
-        call = ["removeSubsets",
-                "--inFile", tracklet,
-                "--outFile", finalTracklet,
-                "--removeSubsets", str(rmSubsets),
-                "--keepOnlyLongest", str(keepOnlyLongest)]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        # Calls completed by a previous run do not need to be repeated
+        if status is not None and _validOutput(finalTracklet, status.get(os.path.basename(finalTracklet))):
+            continue
+        calls.append((call, finalTracklet))
+
+    if status is not None:
+        def _recordCompletion(usage):
+            if usage["returncode"] == 0:
+                status[usage["name"]] = _outputRecord(usage)
+                if onComplete is not None:
+                    onComplete(usage)
+        if verbose:
+            print("%s of %s calls have already completed." % (len(finalTracklets) - len(calls), len(finalTracklets)))
+    else:
+        _recordCompletion = onComplete
 
-        finalTracklets.append(finalTracklet)
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      onComplete=_recordCompletion,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
 
     if verbose:
         _status(function, False)
@@ -473,6 +704,11 @@ def runRemoveSubsets(purifiedTracklets, diasources, outDir,
 
 
 def runIndicesToIds(finalTracklets, diasources, outDir, suffix,
+                    backend="script",
+                    enableMultiprocessing=True,
+                    processes=8,
+                    metrics=None,
+                    cacheDir=None,
                     verbose=VERBOSE):
     """
     Runs indicesToIds.py.
@@ -493,6 +729,28 @@ def runIndicesToIds(finalTracklets, diasources, outDir, suffix,
     suffix : str
         Suffix to append to input files names when saving outputs. 
 
+    backend : {"script", "native"}, optional
+        If script, run MOPS's indicesToIds.py script in a new python process for every night.
+        If native, convert in-process with `analyzemops.linkages.indicesToIds`, reading
+        each night's diaIds once. [Default = "script"]
+
+    enableMultiprocessing : bool, optional
+        Run nights in parallel? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -503,22 +761,25 @@ def runIndicesToIds(finalTracklets, diasources, outDir, suffix,
     """
     function = "indicesToIds.py"
     byId = []
-
-    outfile = open(outDir + "/indicesToIds.out", "w")
-    errfile = open(outDir + "/indicesToIds.err", "w")
+    calls = []
 
     if verbose:
         _status(function, True)
 
     for tracklet, diasource in zip(finalTracklets, diasources):
-        byIdOut = _out(outDir, diasource, suffix + TRACKLET_BY_ID_SUFFIX)
-
-        script = str(os.getenv("MOPS_DIR")) + "/bin/indicesToIds.py"
-        call = ["python", script, tracklet, diasource, byIdOut]
-        subprocess.call(call, stdout=outfile, stderr=errfile)
+        call, byIdOut = _indicesToIdsCall(tracklet, diasource, outDir, suffix, backend=backend)
+        calls.append((call, byIdOut))
 
         byId.append(byIdOut)
 
+    usage = _runCalls(calls,
+                      enableMultiprocessing=enableMultiprocessing,
+                      processes=processes,
+                      cacheDir=cacheDir,
+                      verbose=verbose)
+    if metrics is not None:
+        metrics.extend(usage)
+
     if verbose:
         _status(function, False)
 
@@ -530,6 +791,12 @@ def runMakeLinkTrackletsInputByNight(diasourcesDir, trackletsDir, outDir,
                                      trackletSuffix=(FINAL_TRACKLET_SUFFIX +
                                                      TRACKLET_BY_ID_SUFFIX),
                                      windowSize=defaults.windowSize,
+                                     nightMin=defaults.nightMin,
+                                     backend="script",
+                                     enableMultiprocessing=True,
+                                     processes=8,
+                                     metrics=None,
+                                     cacheDir=None,
                                      verbose=VERBOSE):
     """
     Runs makeLinkTrackletsInput_byNight.py.
@@ -557,6 +824,32 @@ def runMakeLinkTrackletsInputByNight(diasourcesDir, trackletsDir, outDir,
         Number of nights in a window in which to combine nightly diasources
         and tracklets into. [Default = `analyzemops.parameters.windowSize`]
 
+    nightMin : int, optional
+        Windows with fewer nights than this are skipped. Only used by the
+        native backend. [Default = `analyzemops.parameters.nightMin`]
+
+    backend : {"script", "native"}, optional
+        Run makeLinkTrackletsInput_byNight.py as a MOPS script ("script") or
+        in-process with `analyzemops.linkages` ("native"). The native backend reads
+        every night once and writes windows in parallel. [Default = "script"]
+
+    enableMultiprocessing : bool, optional
+        Write windows in parallel? Only used by the native backend. [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then write this many windows at once.
+        [Default = 8]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given and the windows have already been made from the same diasources and
+        tracklets with the same parameters, they are hard-linked from this directory
+        instead of being made again, and new windows are added to it. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -570,24 +863,78 @@ def runMakeLinkTrackletsInputByNight(diasourcesDir, trackletsDir, outDir,
     """
     function = "makeLinkTrackletsInput_byNight.py"
 
-    outfile, errfile = _log(function, outDir)
-
     if verbose:
         _status(function, True)
 
-    script = str(os.getenv("MOPS_DIR")) + "/bin/makeLinkTrackletsInput_byNight.py"
-    call = ["python", script,
-            "--windowSize", str(windowSize),
-            "--diasSuffix", diasSuffix,
-            "--trackletSuffix", trackletSuffix,
-            diasourcesDir,
-            trackletsDir,
-            outDir]
-    subprocess.call(call, stdout=outfile, stderr=errfile)
+    diasources = sorted(glob.glob(os.path.join(diasourcesDir, "*" + diasSuffix)))
+    tracklets = [os.path.join(trackletsDir, os.path.basename(diasource).split(".")[0] + trackletSuffix)
+                 for diasource in diasources]
+
+    if backend not in ["script", "native"]:
+        raise ValueError("backend should be one of 'script' or 'native'.")
+
+    # The window files are only known once they have been made, so they are cached
+    # under their names. Windows depend on the contents of the diasources and
+    # tracklets and on the parameters, not on where those files are
+    key = None
+    cached = None
+    if cacheDir is not None:
+        key = cache.callKey([function, backend, str(windowSize), str(nightMin), diasSuffix, trackletSuffix]
+                            + diasources + tracklets, None)
+        cached = cache.fetchFiles(cacheDir, key, outDir)
+        if cached is None:
+            # Remove previous windows so that files hard-linked from the cache
+            # are never written through
+            for windowFile in _windowFiles(outDir):
+                os.remove(windowFile)
+
+    if cached is not None:
+        if verbose:
+            print("Linked %s window files from %s." % (len(cached), cacheDir))
+        returncode = 0
+        usage = {"cached": True,
+                 "wallTime": 0.0,
+                 "userTime": 0.0,
+                 "systemTime": 0.0,
+                 "maxRSS": None}
+
+    elif backend == "native":
+        if enableMultiprocessing is False:
+            processes = 1
+        call = (makeLinkTrackletsInputByNight, (diasources, tracklets, outDir,
+                                                windowSize, nightMin, processes, verbose))
+        returncode, usage = _runWithUsage(call)
+        usage["cached"] = False
+
+    else:
+        outfile, errfile = _log(function, outDir)
+
+        script = str(os.getenv("MOPS_DIR")) + "/bin/makeLinkTrackletsInput_byNight.py"
+        call = ["python", script,
+                "--windowSize", str(windowSize),
+                "--diasSuffix", diasSuffix,
+                "--trackletSuffix", trackletSuffix,
+                diasourcesDir,
+                trackletsDir,
+                outDir]
+        returncode, usage = _runWithUsage(call, outfile, errfile)
+        usage["cached"] = False
+        outfile.close()
+        errfile.close()
+
+    if key is not None and cached is None and returncode == 0:
+        cache.storeFiles(cacheDir, key, _windowFiles(outDir))
 
     ids = glob.glob(outDir + "*.ids")
     dets = glob.glob(outDir + "*.dets")
 
+    if metrics is not None:
+        usage.update({"name": function,
+                      "returncode": returncode,
+                      "inputSize": _fileSize(diasources + tracklets),
+                      "outputSize": _fileSize(dets + ids)})
+        metrics.append(usage)
+
     if verbose:
         _status(function, False)
 
@@ -614,6 +961,11 @@ def runLinkTracklets(dets, ids, outDir,
                      skyCenterDec=defaults.skyCenterDec,
                      obsLat=defaults.obsLat,
                      obsLon=defaults.obsLon,
+                     memoryBudget=None,
+                     metrics=None,
+                     cacheDir=None,
+                     status=None,
+                     onComplete=None,
                      verbose=VERBOSE):
     """
     Runs linkTracklets.
@@ -704,6 +1056,32 @@ def runLinkTracklets(dets, ids, outDir,
         Observatory East longitude in degrees.
         [Default = `analyzemops.parameters.obsLon`]
 
+    memoryBudget : float, optional
+        If ``enableMultiprocessing = True`` then only start a window when the sum
+        of the predicted peak memory of the running windows fits in this many bytes.
+        Peak memory is predicted from the number of detections and tracklets in a
+        window, calibrated on previous runs. If None, the cgroup or host memory limit
+        is used. [Default = None]
+
+    metrics : list, optional
+        If given, the resource usage of every call (wall time, user and system CPU time,
+        peak memory and input and output file sizes) is appended to this list.
+        [Default = None]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
+    status : dict, optional
+        Completion records of previous calls keyed on output file name. Calls whose
+        output matches its record (same size and checksum) are not run again, and
+        a record is added for every call that completes. [Default = None]
+
+    onComplete : function, optional
+        If given, called with the resource usage of every call as it completes,
+        for example to save progress. [Default = None]
+
     verbose : bool, optional
         Print progress statements? [Default = True]
     
@@ -716,96 +1094,127 @@ def runLinkTracklets(dets, ids, outDir,
     tracks = []
     outfiles = []
     errfiles = []
+    calls = []
 
     if verbose:
         _status(function, True)
 
-    if enableMultiprocessing:
-        print("Multiprocessing Enabled!")
-        print("Using %s CPUs in parallel." % (processes))
-
-        calls = []
-
-        for detIn, idIn in zip(dets, ids):
-            trackOut = _out(outDir, detIn, TRACK_SUFFIX)
-            outfileName = trackOut + ".out"
-            errfileName = trackOut + ".err"
-
-            call = ["linkTracklets",
-                    "-e", str(detErrThresh),
-                    "-D", str(decAccelMax),
-                    "-R", str(raAccelMax),
-                    "-u", str(nightMin),
-                    "-s", str(detectMin),
-                    "-b", str(bufferSize),
-                    "-r", str(trackRMSmax),
-                    "-T", str(trackAdditionThresh),
-                    "-a", str(defaultAstromErr),
-                    "-q", str(trackChiSqMin),
-                    "-x", str(skyCenterRA),
-                    "-y", str(skyCenterDec),
-                    "-z", str(obsLat),
-                    "-w", str(obsLon),
-                    "-d", detIn,
-                    "-t", idIn,
-                    "-o", trackOut]
-
-            if latestFirstEnd is not None:
-                call.extend(["-F", str(latestFirstEnd)])
-            if earliestLastEnd is not None:
-                call.extend(["-L", str(earliestLastEnd)])
-            if leafNodeSizeMax is not None:
-                call.extend(["-n", str(leafNodeSizeMax)])
-
-            tracks.append(trackOut)
-            outfiles.append(outfileName)
-            errfiles.append(errfileName)
-
-            calls.append(call)
-
-        p = multiprocessing.Pool(processes=processes)
-        p.map(_runWindow, calls)
+    for detIn, idIn in zip(dets, ids):
+        trackOut = _out(outDir, detIn, TRACK_SUFFIX)
+
+        call = ["linkTracklets",
+                "-e", str(detErrThresh),
+                "-D", str(decAccelMax),
+                "-R", str(raAccelMax),
+                "-u", str(nightMin),
+                "-s", str(detectMin),
+                "-b", str(bufferSize),
+                "-r", str(trackRMSmax),
+                "-T", str(trackAdditionThresh),
+                "-a", str(defaultAstromErr),
+                "-q", str(trackChiSqMin),
+                "-x", str(skyCenterRA),
+                "-y", str(skyCenterDec),
+                "-z", str(obsLat),
+                "-w", str(obsLon),
+                "-d", detIn,
+                "-t", idIn,
+                "-o", trackOut]
+
+        if latestFirstEnd is not None:
+            call.extend(["-F", str(latestFirstEnd)])
+        if earliestLastEnd is not None:
+            call.extend(["-L", str(earliestLastEnd)])
+        if leafNodeSizeMax is not None:
+            call.extend(["-n", str(leafNodeSizeMax)])
+
+        tracks.append(trackOut)
+        outfiles.append(trackOut + ".out")
+        errfiles.append(trackOut + ".err")
+        calls.append(call)
+
+    # Start the most expensive windows first so that a dense window does not
+    # end up running alone at the end of the run
+    historyFile = os.path.join(outDir, WINDOW_HISTORY_FILE)
+    history = _readWindowHistory(historyFile)
+    costs = _estimateWindowCosts(dets, ids, history)
+    counts = [(_countLines(detIn), _countLines(idIn)) for detIn, idIn in zip(dets, ids)]
+    memory = _estimateWindowMemory(counts, history)
+    order = sorted(range(len(calls)), key=lambda i: costs[i], reverse=True)
+    windows = dict((trackOut, i) for i, trackOut in enumerate(tracks))
+
+    # Windows completed by a previous run do not need to be repeated
+    if status is not None:
+        order = [i for i in order if not _validOutput(tracks[i], status.get(os.path.basename(tracks[i])))]
+        if verbose:
+            print("%s of %s windows have already completed." % (len(calls) - len(order), len(calls)))
+    numWindows = len(order)
+
+    if enableMultiprocessing and numWindows > 0:
+        if memoryBudget is None:
+            memoryBudget = _memoryLimit()
 
+        if verbose:
+            print("Multiprocessing Enabled!")
+            print("Using %s CPUs in parallel." % (processes))
+            print("Using a memory budget of %.2f GB." % (memoryBudget / 1024.**3))
+
+        p = multiprocessing.Pool(processes=min(processes, numWindows))
+        finished = queue.Queue()
+        running = {}
+
+        def results():
+            while len(order) > 0 or len(running) > 0:
+                # Admit windows in order of cost while their predicted memory fits in
+                # the budget, a window that does not fit on its own is run by itself
+                for i in list(order):
+                    if len(running) >= processes:
+                        break
+                    if len(running) > 0 and sum(running.values()) + memory[i] > memoryBudget:
+                        continue
+                    if len(running) == 0 and memory[i] > memoryBudget and verbose:
+                        print("%s is predicted to need %.2f GB, more than the memory budget. Running it alone." % (tracks[i],
+                                                                                                                   memory[i] / 1024.**3))
+                    order.remove(i)
+                    running[i] = memory[i]
+                    p.apply_async(_runWindow, (tracks[i], calls[i], cacheDir), callback=finished.put)
+
+                result = finished.get()
+                del running[windows[result[0]]]
+                yield result
     else:
+        def results():
+            for i in order:
+                yield _runWindow(tracks[i], calls[i], cacheDir)
+
+    for i, (trackOut, returncode, usage) in enumerate(results()):
+        window = os.path.basename(trackOut).split(TRACK_SUFFIX)[0]
+        runtime = usage["wallTime"]
+        maxRSS = usage["maxRSS"]
+        if metrics is not None:
+            metrics.append(usage)
+        if returncode == 0:
+            if status is not None:
+                status[os.path.basename(trackOut)] = _outputRecord(usage)
+            if onComplete is not None:
+                onComplete(usage)
+            numDetections, numTracklets = counts[windows[trackOut]]
+            history[window] = {"runtime": runtime,
+                               "maxRSS": maxRSS,
+                               "numDetections": numDetections,
+                               "numTracklets": numTracklets}
+        if verbose:
+            print("Completed %s (%s/%s) in %.2f seconds using %.2f GB with return code %s." % (window, i + 1,
+                                                                                                numWindows,
+                                                                                                runtime,
+                                                                                                maxRSS / 1024.**3,
+                                                                                                returncode))
+
+    if enableMultiprocessing and numWindows > 0:
+        p.close()
+        p.join()
 
-        for detIn, idIn in zip(dets, ids):
-            trackOut = _out(outDir, detIn, TRACK_SUFFIX)
-            outfileName = trackOut + ".out"
-            errfileName = trackOut + ".err"
-            outfile = open(outfileName, "w")
-            errfile = open(errfileName, "w")
-
-            call = ["linkTracklets",
-                    "-e", str(detErrThresh),
-                    "-D", str(decAccelMax),
-                    "-R", str(raAccelMax),
-                    "-u", str(nightMin),
-                    "-s", str(detectMin),
-                    "-b", str(bufferSize),
-                    "-r", str(trackRMSmax),
-                    "-T", str(trackAdditionThresh),
-                    "-a", str(defaultAstromErr),
-                    "-q", str(trackChiSqMin),
-                    "-x", str(skyCenterRA),
-                    "-y", str(skyCenterDec),
-                    "-z", str(obsLat),
-                    "-w", str(obsLon),
-                    "-d", detIn,
-                    "-t", idIn,
-                    "-o", trackOut]
-
-            if latestFirstEnd is not None:
-                call.extend(["-F", str(latestFirstEnd)])
-            if earliestLastEnd is not None:
-                call.extend(["-L", str(earliestLastEnd)])
-            if leafNodeSizeMax is not None:
-                call.extend(["-n", str(leafNodeSizeMax)])
-
-            subprocess.call(call, stdout=outfile, stderr=errfile)
-
-            tracks.append(trackOut)
-            outfiles.append(outfileName)
-            errfiles.append(errfileName)
+    _writeWindowHistory(historyFile, history)
 
     if verbose:
         _status(function, False)
@@ -813,6 +1222,226 @@ def runLinkTracklets(dets, ids, outDir,
     return sorted(tracks), sorted(outfiles), sorted(errfiles)
 
 
+def runTrackletsByNight(parameters, tracker,
+                        findTracklets=True,
+                        collapseTracklets=True,
+                        purifyTracklets=True,
+                        removeSubsetTracklets=True,
+                        backend="script",
+                        enableMultiprocessing=True,
+                        processes=8,
+                        cacheDir=None,
+                        verbose=VERBOSE):
+    """
+    Runs the nightly tracklet stages as a per-night dependency graph.
+
+    Each night moves through findTracklets, idsToIndices.py, collapseTracklets,
+    purifyTracklets, removeSubsets and the accompanying indicesToIds.py calls as soon
+    as its own previous stage has finished, rather than waiting for every other night to
+    finish that stage. At most processes calls run at any one time.
+
+    The completion of each stage for each night is recorded in the tracker's
+    nightlyStatus and the tracker is saved after every completion, so an interrupted
+    run only repeats unfinished work.
+
+    Parameters
+    ----------
+    parameters : `analyzemops.parameters`
+        User or default defined MOPS parameter object.
+
+    tracker : `analyzemops.tracker`
+        Tracker object keeps track of output files and directories.
+
+    findTracklets : bool, optional
+        Run findTracklets? [Default = True]
+
+    collapseTracklets : bool, optional
+        Run idsToIndices.py and collapseTracklets? [Default = True]
+
+    purifyTracklets: bool, optional
+        Run purifyTracklets? [Default = True]
+
+    removeSubsetTracklets : bool, optional
+        Run removeSubsets on tracklets? [Default = True]
+
+    backend : {"script", "native"}, optional
+        Run idsToIndices.py and indicesToIds.py as MOPS scripts ("script") or
+        in-process with `analyzemops.linkages` ("native"). [Default = "script"]
+
+    enableMultiprocessing : bool, optional
+        Use multiple processors? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors.
+        [Default = 8]
+
+    cacheDir : str, optional
+        If given, calls that have already been run on the same inputs with the same
+        parameters have their outputs hard-linked from this directory instead of
+        being run again, and new outputs are added to it. [Default = None]
+
+    verbose : bool, optional
+        Print progress statements? [Default = True]
+
+    Returns
+    -------
+    `analyzemops.tracker`
+        The updated tracker object.
+    """
+    function = "nightly tracklet stages"
+    runDir = tracker.runDir
+    if tracker.nightlyStatus is None:
+        tracker.nightlyStatus = {}
+    if tracker.metrics is None:
+        tracker.metrics = {}
+
+    tasks = {}
+    completed = []
+    outputs = {}
+
+    for i, diasource in enumerate(tracker.diasources):
+        night = os.path.basename(diasource).split(".")[0]
+        nightTasks = {}
+
+        if findTracklets:
+            call, tracklet = _findTrackletsCall(diasource, tracker.trackletsDir,
+                                                vmax=parameters.vMax,
+                                                vmin=parameters.vMin)
+            nightTasks["findTracklets"] = (call, tracklet, [])
+        else:
+            tracklet = tracker.tracklets[i]
+
+        if collapseTracklets:
+            call, byIndex = _idsToIndicesCall(tracklet, diasource, tracker.trackletsDir,
+                                              backend=backend)
+            nightTasks["idsToIndices"] = (call, byIndex, ["findTracklets"])
+
+            call, collapsed = _collapseTrackletsCall(byIndex, diasource, tracker.collapsedTrackletsDir,
+                                                     raTol=parameters.raTol,
+                                                     decTol=parameters.decTol,
+                                                     angTol=parameters.angTol,
+                                                     vTol=parameters.vTol,
+                                                     method=parameters.method,
+                                                     useRMSfilt=parameters.useRMSfilt,
+                                                     trackletRMSmax=parameters.trackletRMSmax)
+            nightTasks["collapseTracklets"] = (call, collapsed, ["idsToIndices"])
+
+            call, collapsedById = _indicesToIdsCall(collapsed, diasource, tracker.collapsedTrackletsDir,
+                                                    COLLAPSED_TRACKLET_SUFFIX,
+                                                    backend=backend)
+            nightTasks["collapsedIndicesToIds"] = (call, collapsedById, ["collapseTracklets"])
+        else:
+            collapsed = tracker.collapsedTracklets[i]
+
+        if purifyTracklets:
+            call, purified = _purifyTrackletsCall(collapsed, diasource, tracker.purifiedTrackletsDir,
+                                                  trackletRMSmax=parameters.trackletRMSmax)
+            nightTasks["purifyTracklets"] = (call, purified, ["collapseTracklets"])
+
+            call, purifiedById = _indicesToIdsCall(purified, diasource, tracker.purifiedTrackletsDir,
+                                                   PURIFIED_TRACKLET_SUFFIX,
+                                                   backend=backend)
+            nightTasks["purifiedIndicesToIds"] = (call, purifiedById, ["purifyTracklets"])
+        else:
+            purified = tracker.purifiedTracklets[i]
+
+        if removeSubsetTracklets:
+            call, final = _removeSubsetsCall(purified, tracker.finalTrackletsDir,
+                                             rmSubsets=parameters.rmSubsetTracklets,
+                                             keepOnlyLongest=parameters.keepOnlyLongestTracklets)
+            nightTasks["removeSubsets"] = (call, final, ["purifyTracklets"])
+
+            call, finalById = _indicesToIdsCall(final, diasource, tracker.finalTrackletsDir,
+                                                FINAL_TRACKLET_SUFFIX,
+                                                backend=backend)
+            nightTasks["indicesToIds"] = (call, finalById, ["removeSubsets"])
+
+        status = tracker.nightlyStatus.setdefault(night, {})
+        nightCompleted = set()
+        for stage, (call, outFile, dependencies) in nightTasks.items():
+            # Stages that are not being run have their outputs from a previous run
+            dependencies = [dependency for dependency in dependencies if dependency in nightTasks]
+            tasks[(night, stage)] = (call, outFile, [(night, dependency) for dependency in dependencies])
+            outputs.setdefault(stage, []).append(outFile)
+
+            # Stages completed by a previous run (either night by night or
+            # for every night at once) do not need to be repeated as long as
+            # their output is intact
+            record = status.get(stage)
+            if record is None and getattr(tracker, NIGHTLY_STAGES[stage]) is True:
+                record = True
+            if _validOutput(outFile, record):
+                status[stage] = record
+                nightCompleted.add(stage)
+            else:
+                status.pop(stage, None)
+
+        # A stage that runs again changes the input of every stage after it,
+        # so their outputs are out of date even if they are intact
+        stale = True
+        while stale:
+            stale = False
+            for stage in sorted(nightCompleted):
+                if any(dependency not in nightCompleted for n, dependency in tasks[(night, stage)][2]):
+                    nightCompleted.remove(stage)
+                    status.pop(stage, None)
+                    stale = True
+        completed.extend([(night, stage) for stage in nightCompleted])
+
+    # Stages that have to run again for any night have not run
+    for night, stage in tasks:
+        if (night, stage) not in completed:
+            setattr(tracker, NIGHTLY_STAGES[stage], False)
+
+    # Populate tracker with the nightly output files
+    for stage, attribute in NIGHTLY_STAGE_OUTPUTS.items():
+        if stage in outputs:
+            setattr(tracker, attribute, sorted(outputs[stage]))
+    tracker.toYaml(outDir=runDir)
+
+    if verbose:
+        _status(function, True)
+        print("%s of %s nightly calls have already completed." % (len(completed), len(tasks)))
+
+    lastSaved = [time.time()]
+
+    def _recordCompletion(name, usage):
+        night, stage = name
+        tracker.nightlyStatus[night][stage] = _outputRecord(usage)
+        tracker.metrics.setdefault(stage, []).append(usage)
+        if verbose:
+            print("Completed %s for night %s." % (stage, night))
+        # Saving the tracker takes longer as it grows, so only save it
+        # every so often
+        if time.time() - lastSaved[0] > TRACKER_SAVE_INTERVAL:
+            tracker.toYaml(outDir=runDir)
+            lastSaved[0] = time.time()
+
+    failed = _runGraph(tasks,
+                       completed=completed,
+                       onComplete=_recordCompletion,
+                       enableMultiprocessing=enableMultiprocessing,
+                       processes=processes,
+                       cacheDir=cacheDir,
+                       verbose=verbose)
+
+    # A stage has run once it (and any stage sharing its tracker attribute)
+    # has completed for every night
+    for attribute in set([NIGHTLY_STAGES[stage] for stage in outputs]):
+        if all(tracker.nightlyStatus[night].get(stage, False) for night, stage in tasks
+               if NIGHTLY_STAGES[stage] == attribute):
+            setattr(tracker, attribute, True)
+    tracker.toYaml(outDir=runDir)
+
+    if len(failed) > 0:
+        raise RuntimeError("%s nightly calls failed or could not run, see the .err files in %s." % (len(failed), runDir))
+
+    if verbose:
+        _status(function, False)
+
+    return tracker
+
+
 def runMops(parameters, tracker,
             findTracklets=True,
             collapseTracklets=True,
@@ -820,8 +1449,12 @@ def runMops(parameters, tracker,
             removeSubsetTracklets=True,
             linkTracklets=True,
             removeSubsetTracks=True,
+            backend="script",
             enableMultiprocessing=True,
             processes=8,
+            memoryBudget=None,
+            cacheDir=None,
+            cacheSize=cache.CACHE_SIZE_MAX,
             overwrite=False,
             verbose=VERBOSE):
     """
@@ -853,6 +1486,12 @@ def runMops(parameters, tracker,
     removeSubsetTracks : bool, optional
         Run removeSubsets on tracks? [Default = True]
 
+    backend : {"script", "native"}, optional
+        Run idsToIndices.py, indicesToIds.py and makeLinkTrackletsInput_byNight.py as
+        MOPS scripts ("script") or in-process with `analyzemops.linkages` ("native").
+        The native backend first converts the diasource files into detection stores
+        in the run directory (see `analyzemops.detections`). [Default = "script"]
+
     enableMultiprocessing : bool, optional
         Use multiple processors? [Default = True]
 
@@ -860,6 +1499,23 @@ def runMops(parameters, tracker,
         If ``enableMultiprocessing = True`` then use this many processors. 
         [Default = 8]
 
+    memoryBudget : float, optional
+        If ``enableMultiprocessing = True`` then only start a linkTracklets window
+        when the predicted peak memory of all running windows fits in this many bytes.
+        If None, the cgroup or host memory limit is used. [Default = None]
+
+    cacheDir : str, optional
+        Directory of stage outputs shared between runs. Every call is keyed on a
+        hash of its input files and the parameters it consumes. Calls found in the
+        cache have their outputs hard-linked into this run instead of being run again,
+        so changing (for example) a linkTracklets parameter does not rerun the tracklet
+        stages. [Default = None]
+
+    cacheSize : int, optional
+        Maximum size of the cache in bytes, least recently used outputs are removed
+        at the end of the run once it is exceeded. If None, the cache is not trimmed.
+        [Default = `analyzemops.cache.CACHE_SIZE_MAX`]
+
     overwrite : bool, optional
         If directory structure exists, overwrite the files? [Default = False]
 
@@ -940,117 +1596,57 @@ def runMops(parameters, tracker,
     parameters.toYaml(outDir=runDir)
     print("")
 
-    # Run findTracklets
-    if findTracklets:
-        if tracker.ranFindTracklets is False:
-            tracker.tracklets = runFindTracklets(tracker.diasources,
-                                                 tracker.trackletsDir,
-                                                 vmax=parameters.vMax,
-                                                 vmin=parameters.vMin,
-                                                 verbose=verbose)
-            tracker.ranFindTracklets = True
-            inputTrackletsDir = dirs["trackletsDir"]
-            inputTrackletSuffix = TRACKLET_SUFFIX
-            tracker.toYaml(outDir=runDir)
-        else:
-            print("findTracklets has already completed, moving on...")
-
-        print("")
-
-    if collapseTracklets:
-        if tracker.ranIdsToIndices is False:
-            # Run idsToIndices
-            tracker.trackletsByIndex = runIdsToIndices(tracker.tracklets, 
-                                                       tracker.diasources,
-                                                       tracker.trackletsDir,
-                                                       verbose=verbose)
-            tracker.ranIdsToIndices = True
-            tracker.toYaml(outDir=runDir)
-        else:
-            print("idsToIndices has already completed, moving on...")
-
-        print("")
-
-        # Run collapseTracklets
-        if tracker.ranCollapseTracklets is False:
-            tracker.collapsedTracklets = runCollapseTracklets(tracker.trackletsByIndex,
-                                                              tracker.diasources,
-                                                              tracker.collapsedTrackletsDir,
-                                                              raTol=parameters.raTol,
-                                                              decTol=parameters.decTol,
-                                                              angTol=parameters.angTol,
-                                                              vTol=parameters.vTol,
-                                                              method=parameters.method,
-                                                              useRMSfilt=parameters.useRMSfilt,
-                                                              trackletRMSmax=parameters.trackletRMSmax,
-                                                              verbose=verbose)
-            tracker.collapsedTrackletsById = runIndicesToIds(tracker.collapsedTracklets,
-                                                             tracker.diasources,
-                                                             tracker.collapsedTrackletsDir,
-                                                             COLLAPSED_TRACKLET_SUFFIX,
-                                                             verbose=verbose)
-            tracker.ranCollapseTracklets = True
-            inputTrackletsDir = tracker.collapsedTrackletsDir
-            inputTrackletSuffix = COLLAPSED_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
-            tracker.toYaml(outDir=runDir)
-        else:
-            print("collapseTracklets has already completed, moving on...")
+    # Native stages look detections up in binary stores rather than parsing
+    # the diasource files again at every stage. The stores are kept in the run
+    # directory since the diasources directory may be shared or read-only
+    if backend == "native":
+        storeDir = os.path.join(runDir, DIASOURCE_STORES_DIR)
+        writeDiaSourceStores(tracker.diasources, storeDir,
+                             enableMultiprocessing=enableMultiprocessing,
+                             processes=processes,
+                             verbose=verbose)
+        Config.diasource_store_dir = storeDir
+    else:
+        Config.diasource_store_dir = None
+
+    # Run the nightly tracklet stages, each night moves through the stages
+    # independently of the others
+    tracker = runTrackletsByNight(parameters, tracker,
+                                  findTracklets=findTracklets,
+                                  collapseTracklets=collapseTracklets,
+                                  purifyTracklets=purifyTracklets,
+                                  removeSubsetTracklets=removeSubsetTracklets,
+                                  backend=backend,
+                                  enableMultiprocessing=enableMultiprocessing,
+                                  processes=processes,
+                                  cacheDir=cacheDir,
+                                  verbose=verbose)
+    print("")
 
-        print("")
+    if tracker.windowStatus is None:
+        tracker.windowStatus = {}
+    lastSaved = [time.time()]
 
-    if purifyTracklets:
-        # Run purifyTracklets
-        if tracker.ranPurifyTracklets is False:
-            tracker.purifiedTracklets = runPurifyTracklets(tracker.collapsedTracklets,
-                                                           tracker.diasources,
-                                                           tracker.purifiedTrackletsDir,
-                                                           trackletRMSmax=parameters.trackletRMSmax,
-                                                           verbose=verbose)
-            tracker.purifiedTrackletsById = runIndicesToIds(tracker.purifiedTracklets,
-                                                            tracker.diasources,
-                                                            tracker.purifiedTrackletsDir,
-                                                            PURIFIED_TRACKLET_SUFFIX,
-                                                            verbose=verbose)
-            tracker.ranPurifyTracklets = True
-            inputTrackletsDir = tracker.purifiedTrackletsDir
-            inputTrackletSuffix = PURIFIED_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
+    def _saveProgress(usage):
+        # Save progress every so often so that a crash only loses the
+        # windows that were running
+        if time.time() - lastSaved[0] > TRACKER_SAVE_INTERVAL:
             tracker.toYaml(outDir=runDir)
-        else:
-            print("purifyTracklets has already completed, moving on...")
-
-        print("")
+            lastSaved[0] = time.time()
 
+    # The latest tracklets (by diaId) are the input to makeLinkTrackletsInput_byNight
     if removeSubsetTracklets:
-        # Run removeSubsets
-        if tracker.ranRemoveSubsetTracklets is False:
-            tracker.finalTracklets = runRemoveSubsets(tracker.purifiedTracklets,
-                                                      tracker.diasources,
-                                                      tracker.finalTrackletsDir,
-                                                      rmSubsets=parameters.rmSubsetTracklets,
-                                                      keepOnlyLongest=parameters.keepOnlyLongestTracklets,
-                                                      verbose=verbose)
-            tracker.ranRemoveSubsetTracklets = True
-            tracker.toYaml(outDir=runDir)
-        else:
-            print("removeSubsets (tracklets) has already completed, moving on...")
-
-        print("")
-
-        # Run indicesToIds
-        if tracker.ranIndicesToIds is False:
-            tracker.finalTrackletsById = runIndicesToIds(tracker.finalTracklets,
-                                                         tracker.diasources,
-                                                         tracker.finalTrackletsDir,
-                                                         FINAL_TRACKLET_SUFFIX,
-                                                         verbose=verbose)
-            tracker.ranIndicesToIds = True
-            inputTrackletsDir = tracker.finalTrackletsDir
-            inputTrackletSuffix = FINAL_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
-            tracker.toYaml(outDir=runDir)
-        else:
-            print("indicesToIds has already completed, moving on...")
-        
-        print("")
+        inputTrackletsDir = tracker.finalTrackletsDir
+        inputTrackletSuffix = FINAL_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
+    elif purifyTracklets:
+        inputTrackletsDir = tracker.purifiedTrackletsDir
+        inputTrackletSuffix = PURIFIED_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
+    elif collapseTracklets:
+        inputTrackletsDir = tracker.collapsedTrackletsDir
+        inputTrackletSuffix = COLLAPSED_TRACKLET_SUFFIX + TRACKLET_BY_ID_SUFFIX
+    else:
+        inputTrackletsDir = tracker.trackletsDir
+        inputTrackletSuffix = TRACKLET_SUFFIX
 
     if linkTracklets:
         # Run makeLinkTrackletsInputByNight
@@ -1060,6 +1656,12 @@ def runMops(parameters, tracker,
                                                                          tracker.trackletsByNightDir,
                                                                          trackletSuffix=inputTrackletSuffix,
                                                                          windowSize=parameters.windowSize,
+                                                                         nightMin=parameters.nightMin,
+                                                                         backend=backend,
+                                                                         enableMultiprocessing=enableMultiprocessing,
+                                                                         processes=processes,
+                                                                         metrics=tracker.metrics.setdefault("makeLinkTrackletsInputByNight", []),
+                                                                         cacheDir=cacheDir,
                                                                          verbose=verbose)
             tracker.ranMakeLinkTrackletsInputByNight = True
             tracker.toYaml(outDir=runDir)
@@ -1068,7 +1670,15 @@ def runMops(parameters, tracker,
 
         print("")
 
-        # Run linkTracklets
+        # Run linkTracklets, resuming any windows that are missing or incomplete
+        windowStatus = tracker.windowStatus.setdefault("linkTracklets", {})
+        if tracker.ranLinkTracklets is True and len(windowStatus) == 0:
+            # Trackers from older runs only record that every window completed
+            windowStatus.update((os.path.basename(track), True) for track in tracker.tracks)
+        if tracker.ranLinkTracklets is True and not _checkWindowStatus(tracker.tracks, windowStatus):
+            print("Some linkTracklets outputs are missing or incomplete, resuming...")
+            tracker.ranLinkTracklets = False
+
         if tracker.ranLinkTracklets is False:
             tracker.tracks, tracker.trackOuts, tracker.trackErrs = runLinkTracklets(tracker.dets,
                                                                                     tracker.ids,
@@ -1092,8 +1702,13 @@ def runMops(parameters, tracker,
                                                                                     skyCenterDec=parameters.skyCenterDec,
                                                                                     obsLat=parameters.obsLat,
                                                                                     obsLon=parameters.obsLon,
+                                                                                    memoryBudget=memoryBudget,
+                                                                                    metrics=tracker.metrics.setdefault("linkTracklets", []),
+                                                                                    cacheDir=cacheDir,
+                                                                                    status=windowStatus,
+                                                                                    onComplete=_saveProgress,
                                                                                     verbose=verbose)
-            tracker.ranLinkTracklets = True
+            tracker.ranLinkTracklets = _checkWindowStatus(tracker.tracks, windowStatus, validate=False)
             tracker.toYaml(outDir=runDir)
         else:
             print("linkTracklets has already completed, moving on...")
@@ -1101,7 +1716,15 @@ def runMops(parameters, tracker,
         print("")
 
     if removeSubsetTracks:
-        # Run removeSubsets (tracks)
+        # Run removeSubsets (tracks), resuming any windows that are missing or incomplete
+        windowStatus = tracker.windowStatus.setdefault("removeSubsetTracks", {})
+        if tracker.ranRemoveSubsetTracks is True and len(windowStatus) == 0:
+            # Trackers from older runs only record that every window completed
+            windowStatus.update((os.path.basename(track), True) for track in tracker.finalTracks)
+        if tracker.ranRemoveSubsetTracks is True and not _checkWindowStatus(tracker.finalTracks, windowStatus):
+            print("Some removeSubsets (tracks) outputs are missing or incomplete, resuming...")
+            tracker.ranRemoveSubsetTracks = False
+
         if tracker.ranRemoveSubsetTracks is False:
             tracker.finalTracks = runRemoveSubsets(tracker.tracks,
                                                    tracker.diasources,
@@ -1109,8 +1732,14 @@ def runMops(parameters, tracker,
                                                    rmSubsets=parameters.rmSubsetTracks,
                                                    keepOnlyLongest=parameters.keepOnlyLongestTracks,
                                                    suffix=FINAL_TRACK_SUFFIX,
+                                                   enableMultiprocessing=enableMultiprocessing,
+                                                   processes=processes,
+                                                   metrics=tracker.metrics.setdefault("removeSubsetTracks", []),
+                                                   cacheDir=cacheDir,
+                                                   status=windowStatus,
+                                                   onComplete=_saveProgress,
                                                    verbose=verbose)
-            tracker.ranRemoveSubsetTracks = True
+            tracker.ranRemoveSubsetTracks = _checkWindowStatus(tracker.finalTracks, windowStatus, validate=False)
             tracker.toYaml(outDir=runDir)
         else:
             print("removeSubsets (tracks) has already completed, moving on...")
@@ -1121,9 +1750,267 @@ def runMops(parameters, tracker,
     print(tracker)
     tracker.toYaml(outDir=runDir)
 
+    # Save and summarize resource usage
+    _writeMetrics(os.path.join(runDir, METRICS_FILE), tracker.metrics)
+    _printMetrics(tracker.metrics)
+
+    if cacheDir is not None and cacheSize is not None:
+        cache.evict(cacheDir, sizeMax=cacheSize, verbose=verbose)
+
     return parameters, tracker
 
 
+def parameterGrid(grid, base=None):
+    """
+    Builds every combination of a grid of parameter values.
+
+    Parameters
+    ----------
+    grid : dict
+        Dictionary keyed on `analyzemops.parameters.Parameters` attribute
+        (for example "raAccelMax") with lists of values to try as values.
+
+    base : `analyzemops.parameters.Parameters`, optional
+        Parameters to take values not in the grid from. If None, the default
+        parameters are used. [Default = None]
+
+    Returns
+    -------
+    list
+        List of `analyzemops.parameters.Parameters`, one per combination.
+    """
+    if base is None:
+        base = Parameters()
+
+    names = sorted(grid.keys())
+    for name in names:
+        if not hasattr(base, name):
+            raise ValueError("%s is not a parameter." % (name))
+
+    parametersList = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        parameters = copy.deepcopy(base)
+        for name, value in zip(names, values):
+            setattr(parameters, name, value)
+        parametersList.append(parameters)
+    return parametersList
+
+
+def runSweep(parametersList, diasourcesDir, sweepDir,
+             backend="script",
+             enableMultiprocessing=True,
+             processes=8,
+             memoryBudget=None,
+             cacheDir=None,
+             cacheSize=cache.CACHE_SIZE_MAX,
+             verbose=VERBOSE):
+    """
+    Runs the Moving Object Pipeline for many sets of parameters, running the stages
+    variants have in common only once.
+
+    Stages are grouped (see `SWEEP_STAGES`) into the tracklet stages, the track stages
+    and the removal of subset tracks. Two variants that agree on every parameter consumed
+    by the first n groups share the outputs of those groups. The sweep runs in phases:
+    first one variant per distinct set of tracklet stage parameters, then one variant per
+    distinct set of tracklet and track stage parameters not yet run, and so on. Variants
+    pick up the outputs of earlier phases (including the linkTracklets windows) from the
+    stage output cache, so every shared stage prefix is computed exactly once and only
+    the stages that differ are run for each variant. The variants of a phase run at
+    once, each in its own process with an equal share of the processors and of the
+    memory budget.
+
+    The cache is trimmed to cacheSize once all variants have run, so that outputs
+    shared between phases are not removed part way through the sweep.
+
+    Every variant is run in its own run directory (variant_000, variant_001, ...)
+    in sweepDir, and a description of the variants is saved to sweep.yaml.
+
+    Parameters
+    ----------
+    parametersList : list
+        List of `analyzemops.parameters.Parameters`, see `parameterGrid`.
+
+    diasourcesDir : str
+        Directory containing nightly diasources (.dias).
+
+    sweepDir : str
+        Directory in which to create a run directory for every variant.
+
+    backend : {"script", "native"}, optional
+        Run idsToIndices.py, indicesToIds.py and makeLinkTrackletsInput_byNight.py as
+        MOPS scripts ("script") or in-process with `analyzemops.linkages` ("native").
+        [Default = "script"]
+
+    enableMultiprocessing : bool, optional
+        Use multiple processors? [Default = True]
+
+    processes : int, optional
+        If ``enableMultiprocessing = True`` then use this many processors in total,
+        shared between the variants running at once. [Default = 8]
+
+    memoryBudget : float, optional
+        Memory budget in bytes for linkTracklets shared between the variants running
+        at once. If None, the cgroup or host memory limit is used. [Default = None]
+
+    cacheDir : str, optional
+        Directory of stage outputs shared between variants. If None, a cache
+        directory is created in sweepDir. [Default = None]
+
+    cacheSize : int, optional
+        Maximum size of the cache in bytes. [Default = `analyzemops.cache.CACHE_SIZE_MAX`]
+
+    verbose : bool, optional
+        Print progress statements? [Default = True]
+
+    Returns
+    -------
+    list
+        List of (`analyzemops.parameters.Parameters`, `analyzemops.tracker.Tracker`)
+        tuples, one per variant in the order of parametersList.
+    """
+    sweepDir = os.path.join(os.path.abspath(sweepDir), "")
+    if cacheDir is None:
+        cacheDir = os.path.join(sweepDir, "cache", "")
+    if not os.path.isdir(sweepDir):
+        os.makedirs(sweepDir)
+
+    variants = ["variant_%03d" % i for i in range(len(parametersList))]
+    trackers = []
+    for variant in variants:
+        tracker = Tracker(os.path.join(sweepDir, variant, ""))
+        tracker.getDetections(diasourcesDir)
+        trackers.append(tracker)
+
+    # Record the parameters that vary between variants
+    names = [name for stage, stageNames in SWEEP_STAGES for name in stageNames]
+    varying = [name for name in names
+               if len(set([repr(getattr(parameters, name)) for parameters in parametersList])) > 1]
+    description = dict((variant, dict((name, getattr(parameters, name)) for name in varying))
+                       for variant, parameters in zip(variants, parametersList))
+    stream = open(os.path.join(sweepDir, SWEEP_FILE), "w")
+    yaml.safe_dump(description, stream, default_flow_style=False)
+    stream.close()
+
+    def prefix(parameters, level):
+        return tuple(repr(getattr(parameters, name))
+                     for stage, stageNames in SWEEP_STAGES[:level + 1] for name in stageNames)
+
+    results = [None for parameters in parametersList]
+    remaining = list(range(len(parametersList)))
+    computed = set()
+    for level in range(len(SWEEP_STAGES) + 1):
+        # The final phase runs any variants left over (those with
+        # the same parameters as a variant that has already run)
+        batch = []
+        for i in remaining:
+            if level < len(SWEEP_STAGES):
+                key = (level, prefix(parametersList[i], level))
+                if key in computed:
+                    continue
+                computed.add(key)
+            batch.append(i)
+        if len(batch) == 0:
+            continue
+
+        if level < len(SWEEP_STAGES):
+            phase = "distinct %s prefixes" % (SWEEP_STAGES[level][0])
+        else:
+            phase = "remaining variants"
+        if verbose:
+            print("------- Run Sweep -------")
+            print("Running %s variants for %s: %s" % (len(batch), phase, ", ".join([variants[i] for i in batch])))
+            print("")
+
+        # Split processors and memory between the variants running at once. The
+        # cache is trimmed at the end of the sweep instead of after every variant
+        parallel = min(len(batch), processes) if enableMultiprocessing else 1
+        variantArgs = {"backend": backend,
+                       "enableMultiprocessing": enableMultiprocessing,
+                       "processes": max(1, processes // parallel),
+                       "memoryBudget": memoryBudget,
+                       "cacheDir": cacheDir,
+                       "cacheSize": None,
+                       "verbose": verbose}
+        if parallel == 1:
+            for i in batch:
+                results[i] = runMops(parametersList[i], trackers[i], **variantArgs)
+        else:
+            if memoryBudget is None:
+                memoryBudget = _memoryLimit()
+            variantArgs["memoryBudget"] = memoryBudget / parallel
+            for i, result in _runVariants(batch, parametersList, trackers, variantArgs, parallel):
+                results[i] = result
+
+        # Variants run in this phase have computed all of their prefixes
+        for i in batch:
+            for l in range(len(SWEEP_STAGES)):
+                computed.add((l, prefix(parametersList[i], l)))
+            remaining.remove(i)
+
+    cache.evict(cacheDir, sizeMax=cacheSize, verbose=verbose)
+
+    return results
+
+
+def _runVariants(batch, parametersList, trackers, variantArgs, parallel):
+    """
+    Runs the variants of a sweep in batch at once, at most parallel at a time,
+    each in its own process: multiprocessing pools can not safely be forked from
+    threads, and every variant runs its own pools. Yields the index and result of
+    every variant as it finishes. Raises a RuntimeError once every variant has
+    finished if any of them failed.
+
+    """
+    finished = multiprocessing.Queue()
+    pending = list(batch)
+    running = {}
+    failed = []
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < parallel:
+            i = pending.pop(0)
+            process = multiprocessing.Process(target=_runVariant,
+                                              args=(finished, i, parametersList[i], trackers[i], variantArgs))
+            process.start()
+            running[i] = process
+
+        try:
+            i, result, error = finished.get(timeout=1)
+        except queue.Empty:
+            # A variant that was killed can not report back
+            for i, process in list(running.items()):
+                if not process.is_alive() and process.exitcode != 0:
+                    running.pop(i).join()
+                    failed.append((i, "Exited with code %s." % (process.exitcode)))
+            continue
+
+        running.pop(i).join()
+        if error is not None:
+            failed.append((i, error))
+        else:
+            yield i, result
+
+    if len(failed) > 0:
+        for i, error in failed:
+            print("Variant %s failed:" % (i))
+            print(error)
+        raise RuntimeError("%s variants of the sweep failed." % (len(failed)))
+
+
+def _runVariant(finished, i, parameters, tracker, variantArgs):
+    """
+    Runs a single variant of a sweep, putting its index and result (or the
+    traceback of the error that stopped it) on the finished queue.
+
+    """
+    try:
+        result = runMops(parameters, tracker, **variantArgs)
+    except Exception:
+        finished.put((i, None, traceback.format_exc()))
+    else:
+        finished.put((i, result, None))
+    return
+
+
 def _status(function, current):
     """
     Simple function that prints the current MOPS function running.
@@ -1153,6 +2040,18 @@ def _log(function, outDir):
     return outfile, errfile
 
 
+def _windowFiles(outDir):
+    """
+    Returns the files makeLinkTrackletsInput_byNight.py has written to outDir:
+    the dets, ids and start time of every window.
+
+    """
+    windowFiles = []
+    for suffix in [".dets", ".ids", ".date.start_t_range"]:
+        windowFiles.extend(glob.glob(os.path.join(outDir, "*" + suffix)))
+    return sorted(windowFiles)
+
+
 def _out(outDir, filename, suffix):
     """
     Makes an outfile based off of the name of the input files for different 
@@ -1168,21 +2067,606 @@ def _out(outDir, filename, suffix):
     return outFile
 
 
-def _runWindow(call):
+def _findTrackletsCall(diasource, outDir,
+                       vmax=defaults.vMax,
+                       vmin=defaults.vMin):
+    """
+    Builds the findTracklets call for a single night. Returns the call and
+    the path to its output file.
+
+    """
+    trackletsOut = _out(outDir, diasource, TRACKLET_SUFFIX)
+
+    call = ["findTracklets", "-i", diasource, "-o",
+            trackletsOut, "-v", str(vmax), "-m", str(vmin)]
+    return call, trackletsOut
+
+
+def _idsToIndicesCall(tracklet, diasource, outDir, backend="script"):
+    """
+    Builds the idsToIndices.py call for a single night. Returns the call and
+    the path to its output file.
+
+    """
+    byIndexOut = _out(outDir, diasource, TRACKLET_BY_INDEX_SUFFIX)
+
+    if backend == "native":
+        call = (idsToIndices, (tracklet, diasource, byIndexOut))
+    elif backend == "script":
+        script = str(os.getenv("MOPS_DIR")) + "/bin/idsToIndices.py"
+        call = ["python", script, tracklet, diasource, byIndexOut]
+    else:
+        raise ValueError("backend should be one of 'script' or 'native'.")
+    return call, byIndexOut
+
+
+def _collapseTrackletsCall(tracklet, diasource, outDir,
+                           raTol=defaults.raTol,
+                           decTol=defaults.decTol,
+                           angTol=defaults.angTol,
+                           vTol=defaults.vTol,
+                           method=defaults.method,
+                           useRMSfilt=defaults.useRMSfilt,
+                           trackletRMSmax=defaults.trackletRMSmax):
+    """
+    Builds the collapseTracklets call for a single night. Returns the call and
+    the path to its output file.
+
+    """
+    collapsedTracklet = _out(outDir, diasource, COLLAPSED_TRACKLET_SUFFIX)
+
+    call = ["collapseTracklets", diasource, tracklet, str(raTol),
+            str(decTol), str(angTol), str(vTol), collapsedTracklet,
+            "--method", method,
+            "--useRMSFilt", str(useRMSfilt),
+            "--maxRMS", str(trackletRMSmax)]
+    return call, collapsedTracklet
+
+
+def _purifyTrackletsCall(tracklet, diasource, outDir,
+                         trackletRMSmax=defaults.trackletRMSmax):
+    """
+    Builds the purifyTracklets call for a single night. Returns the call and
+    the path to its output file.
+
+    """
+    purifiedTracklet = _out(outDir, diasource, PURIFIED_TRACKLET_SUFFIX)
+
+    call = ["purifyTracklets",
+            "--detsFile", diasource,
+            "--pairsFile", tracklet,
+            "--maxRMS", str(trackletRMSmax),
+            "--outFile", purifiedTracklet]
+    return call, purifiedTracklet
+
+
+def _removeSubsetsCall(tracklet, outDir,
+                       rmSubsets=defaults.rmSubsetTracklets,
+                       keepOnlyLongest=defaults.keepOnlyLongestTracklets,
+                       suffix=FINAL_TRACKLET_SUFFIX):
+    """
+    Builds the removeSubsets call for a single night or window. Returns the
+    call and the path to its output file.
+
+    """
+    finalTracklet = _out(outDir, tracklet, suffix)
+
+    call = ["removeSubsets",
+            "--inFile", tracklet,
+            "--outFile", finalTracklet,
+            "--removeSubsets", str(rmSubsets),
+            "--keepOnlyLongest", str(keepOnlyLongest)]
+    return call, finalTracklet
+
+
+def _indicesToIdsCall(tracklet, diasource, outDir, suffix, backend="script"):
+    """
+    Builds the indicesToIds.py call for a single night. Returns the call and
+    the path to its output file.
+
+    """
+    byIdOut = _out(outDir, diasource, suffix + TRACKLET_BY_ID_SUFFIX)
+
+    if backend == "native":
+        call = (indicesToIds, (tracklet, diasource, byIdOut))
+    elif backend == "script":
+        script = str(os.getenv("MOPS_DIR")) + "/bin/indicesToIds.py"
+        call = ["python", script, tracklet, diasource, byIdOut]
+    else:
+        raise ValueError("backend should be one of 'script' or 'native'.")
+    return call, byIdOut
+
+
+def _runWindow(trackOut, call, cacheDir=None):
     """
     Simple hacky function that will create the same log files as _log but for the case
     where we are running multiprocessing on linkTracklets and are running windows.
+    Returns the track file, the return code and the resource usage of the window.
+    Never raises, a window that could not be run is returned with a return code of -1
+    so that the memory reserved for it is released.
+
+    """
+    return _runTask((trackOut, call, trackOut, cacheDir))
+
+
+def _countLines(fileName):
+    """
+    Count the number of lines in a file.
+
+    """
+    numLines = 0
+    stream = open(fileName, "rb")
+    for chunk in iter(lambda: stream.read(2**20), b""):
+        numLines += chunk.count(b"\n")
+    stream.close()
+    return numLines
+
+
+def _estimateWindowCosts(dets, ids, history):
+    """
+    Estimate the relative cost of running linkTracklets on each window. The number of
+    endpoint pairs linkTracklets searches grows with the product of detections and tracklets,
+    so the product of the .dets and .ids file sizes is used. Windows with a recorded runtime
+    use it instead, and the remaining estimates are scaled by the median seconds per unit
+    cost of the windows with known runtimes so that both are comparable.
 
     """
-    # Unfortunately pool.map() can"t map a function call of multiple arguments
-    # so we have to extract the trackOut name from the function call.
-    # When python 3.3 is accepted as standard, pool.starmap() will be used instead.
-    trackOut = call[-1]
-    outfile = open(trackOut + ".out", "w")
-    errfile = open(trackOut + ".err", "w")
-    subprocess.call(call, stdout=outfile, stderr=errfile)
+    sizes = []
+    windows = []
+    for detIn, idIn in zip(dets, ids):
+        sizes.append(float(os.path.getsize(detIn)) * float(os.path.getsize(idIn)))
+        windows.append(os.path.basename(detIn).split(".")[0])
+
+    rates = sorted([history[window]["runtime"] / size for window, size in zip(windows, sizes)
+                    if window in history and size > 0])
+    if len(rates) > 0:
+        rate = rates[len(rates) // 2]
+    else:
+        rate = 1.0
+
+    return [history[window]["runtime"] if window in history else size * rate
+            for window, size in zip(windows, sizes)]
+
+
+def _estimateWindowMemory(counts, history):
+    """
+    Predict the peak memory (in bytes) linkTracklets will use for each window from its
+    number of detections and tracklets. Once three or more windows have been run, the
+    linear model is fit to their measured peak memory, otherwise the default model
+    is used.
+
+    """
+    samples = [(window["numDetections"], window["numTracklets"], window["maxRSS"])
+               for window in history.values() if window.get("maxRSS") is not None and window["maxRSS"] > 0]
+
+    coefficients = np.array([LINKTRACKLETS_MEMORY_BASE,
+                             LINKTRACKLETS_MEMORY_PER_DETECTION,
+                             LINKTRACKLETS_MEMORY_PER_TRACKLET], dtype=float)
+    if len(samples) >= 3:
+        samples = np.array(samples, dtype=float)
+        design = np.column_stack([np.ones(len(samples)), samples[:, 0], samples[:, 1]])
+        fit = np.linalg.lstsq(design, samples[:, 2], rcond=None)[0]
+        coefficients = np.clip(fit, 0, None)
+
+    counts = np.array(counts, dtype=float).reshape(-1, 2)
+    predicted = coefficients[0] + counts[:, 0] * coefficients[1] + counts[:, 1] * coefficients[2]
+    # Never predict less than a measured window with no more detections and tracklets
+    for numDetections, numTracklets, maxRSS in samples:
+        larger = (counts[:, 0] >= numDetections) & (counts[:, 1] >= numTracklets)
+        predicted[larger] = np.maximum(predicted[larger], maxRSS)
+    return list(predicted * LINKTRACKLETS_MEMORY_HEADROOM)
+
+
+def _memoryLimit():
+    """
+    Returns the memory (in bytes) available to this process: the smaller of the
+    cgroup memory limit (if any) and the physical memory of the host.
+
+    """
+    limits = [os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")]
+    for cgroupFile in ["/sys/fs/cgroup/memory.max",
+                       "/sys/fs/cgroup/memory/memory.limit_in_bytes"]:
+        if os.path.isfile(cgroupFile):
+            limit = open(cgroupFile, "r").read().strip()
+            if limit.isdigit():
+                limits.append(int(limit))
+    return float(min(limits))
+
+
+def _readWindowHistory(historyFile):
+    """
+    Read the wall time, peak memory and size of previous linkTracklets runs per window.
+
+    """
+    if not os.path.isfile(historyFile):
+        return {}
+    history = yaml.safe_load(open(historyFile, "r"))
+    if history is None:
+        return {}
+    return history
+
+
+def _writeWindowHistory(historyFile, history):
+    """
+    Save the wall time, peak memory and size of linkTracklets runs per window.
+
+    """
+    stream = open(historyFile, "w")
+    yaml.safe_dump(history, stream, default_flow_style=False)
+    stream.close()
+    return
+
+
+def _writeMetrics(metricsFile, metrics):
+    """
+    Save the resource usage of every call made by runMops, keyed on stage.
+
+    """
+    stream = open(metricsFile, "w")
+    yaml.safe_dump(metrics, stream, default_flow_style=False)
+    stream.close()
+    return
+
+
+def _printMetrics(metrics):
+    """
+    Print a table summarizing the resource usage of every stage. Wall and CPU times
+    are summed over all calls in a stage, peak memory is that of the largest call
+    ("-" if no call in the stage had its peak memory measured).
+
+    """
+    header = "%-30s %7s %7s %12s %12s %12s %14s %12s %12s" % ("Stage", "Calls", "Cached", "Wall [s]", "User [s]", "Sys [s]",
+                                                              "Peak RSS [MB]", "Input [MB]", "Output [MB]")
+    print("------- Resource Usage -------")
+    print(header)
+    print("-" * len(header))
+    for stage, usages in sorted(metrics.items()):
+        if len(usages) == 0:
+            continue
+        peaks = [u["maxRSS"] for u in usages if u["maxRSS"] is not None]
+        if len(peaks) > 0:
+            peak = "%.1f" % (max(peaks) / 1024.**2)
+        else:
+            peak = "-"
+        print("%-30s %7d %7d %12.2f %12.2f %12.2f %14s %12.1f %12.1f" % (stage,
+                                                                    len(usages),
+                                                                    len([u for u in usages if u.get("cached", False)]),
+                                                                    sum([u["wallTime"] for u in usages]),
+                                                                    sum([u["userTime"] for u in usages]),
+                                                                    sum([u["systemTime"] for u in usages]),
+                                                                    peak,
+                                                                    sum([u["inputSize"] for u in usages]) / 1024.**2,
+                                                                    sum([u["outputSize"] for u in usages]) / 1024.**2))
+    print("")
+    return
+
+
+def _runWithUsage(call, outfile=None, errfile=None):
+    """
+    Runs a single MOPS call and measures its resource usage: wall time, user and
+    system CPU time and peak memory (in bytes). Command-line calls are measured from
+    the resource usage of the child process. Calls run in-process are measured from
+    the CPU time used by this process while they ran. Their peak memory is None: the
+    peak of this process covers every call it has run, not just this one.
+
+    Exceptions raised by in-process calls are written to errfile (with a return code
+    of 1) if it is given, otherwise they are raised.
+
+    """
+    start = time.time()
+    if isinstance(call, tuple):
+        function, functionArgs = call
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            function(*functionArgs)
+            returncode = 0
+        except Exception:
+            if errfile is None:
+                raise
+            traceback.print_exc(file=errfile)
+            returncode = 1
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        userTime = after.ru_utime - before.ru_utime
+        systemTime = after.ru_stime - before.ru_stime
+        maxRSS = None
+    else:
+        process = subprocess.Popen(call, stdout=outfile, stderr=errfile)
+        # Wait on this process specifically to get its own resource usage
+        pid, status, rusage = os.wait4(process.pid, 0)
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        userTime = rusage.ru_utime
+        systemTime = rusage.ru_stime
+        maxRSS = rusage.ru_maxrss
+        # ru_maxrss is in kilobytes on Linux and in bytes on OS X
+        if sys.platform != "darwin":
+            maxRSS *= 1024
+
+    usage = {"wallTime": time.time() - start,
+             "userTime": userTime,
+             "systemTime": systemTime,
+             "maxRSS": maxRSS}
+    return returncode, usage
+
+
+def _runCall(args):
+    """
+    Runs a single MOPS call, capturing its stdout and stderr to its own pair of
+    log files so that concurrent calls do not interleave their output. Returns the
+    exit status and resource usage of the call, including the size of its input
+    and output files.
+
+    A call is either a list of command-line arguments or a (function, arguments)
+    tuple to be run in-process. If a cache directory is given, the outputs of a call
+    that has been run before on the same inputs are linked from the cache instead
+    of running the call, and the outputs of new calls are added to it.
+
+    """
+    # pool.map() only passes a single argument, so the call, the base name
+    # of its log files and optionally the cache directory are packed into a tuple.
+    call, logName = args[:2]
+    cacheDir = args[2] if len(args) > 2 else None
+    if isinstance(call, tuple):
+        inputs = call[1]
+    else:
+        inputs = call[1:]
+    inputSize = _fileSize([arg for arg in inputs if isinstance(arg, str) and arg != logName])
+    outputs = [logName, logName + ".out", logName + ".err"]
+
+    # Remove previous outputs so that files hard-linked from the cache are
+    # never written through
+    for output in outputs:
+        if os.path.lexists(output):
+            os.remove(output)
+
+    key = None
+    if cacheDir is not None:
+        key = cache.callKey(call, logName)
+        if cache.fetch(cacheDir, key, outputs):
+            usage = {"name": os.path.basename(logName),
+                     "returncode": 0,
+                     "cached": True,
+                     "wallTime": 0.0,
+                     "userTime": 0.0,
+                     "systemTime": 0.0,
+                     "maxRSS": 0,
+                     "inputSize": inputSize,
+                     "outputSize": _fileSize([logName]),
+                     "checksum": _checksum(logName)}
+            return 0, usage
+
+    outfile = open(logName + ".out", "w")
+    errfile = open(logName + ".err", "w")
+    try:
+        returncode, usage = _runWithUsage(call, outfile, errfile)
+    finally:
+        outfile.close()
+        errfile.close()
+
+    if key is not None and returncode == 0:
+        cache.store(cacheDir, key, outputs)
+
+    usage.update({"name": os.path.basename(logName),
+                  "returncode": returncode,
+                  "cached": False,
+                  "inputSize": inputSize,
+                  "outputSize": _fileSize([logName]),
+                  "checksum": _checksum(logName) if returncode == 0 else None})
+    return returncode, usage
+
+
+def _runCalls(calls, enableMultiprocessing=True, processes=8, cacheDir=None, onComplete=None, verbose=VERBOSE):
+    """
+    Runs a list of (call, logName) tuples either serially or through a pool of
+    at most processes workers. If given, onComplete is called with the resource
+    usage of every call as it finishes. Returns the resource usage of every call.
+
+    """
+    calls = [(call, logName, cacheDir) for call, logName in calls]
+    if enableMultiprocessing and len(calls) > 1:
+        if verbose:
+            print("Multiprocessing Enabled!")
+            print("Using %s CPUs in parallel." % (min(processes, len(calls))))
+
+        p = multiprocessing.Pool(processes=min(processes, len(calls)))
+        results = p.imap_unordered(_runCall, calls, chunksize=1)
+
+    else:
+        results = (_runCall(call) for call in calls)
+
+    usages = []
+    for returncode, usage in results:
+        usages.append(usage)
+        if onComplete is not None:
+            onComplete(usage)
+
+    if enableMultiprocessing and len(calls) > 1:
+        p.close()
+        p.join()
+
+    return usages
+
+
+def _runTask(args):
+    """
+    Runs a single named task of a dependency graph. Returns the task name,
+    the exit status of its call and its resource usage.
+
+    """
+    name, call, logName = args[:3]
+    cacheDir = args[3] if len(args) > 3 else None
+    try:
+        returncode, usage = _runCall((call, logName, cacheDir))
+    except Exception as e:
+        # Usually the MOPS executable could not be found, keep a record of
+        # why in the task's error log. Any failure has to be returned rather
+        # than raised, since the scheduler waits on the result of every task
+        _logFailure(call, logName, e)
+        returncode = -1
+        usage = {"name": os.path.basename(logName),
+                 "returncode": returncode,
+                 "cached": False,
+                 "wallTime": 0.0,
+                 "userTime": 0.0,
+                 "systemTime": 0.0,
+                 "maxRSS": 0,
+                 "inputSize": 0,
+                 "outputSize": 0,
+                 "checksum": None}
+    return name, returncode, usage
+
+
+def _logFailure(call, logName, error):
+    """
+    Appends the reason a call could not be run to its error log, if the log
+    can be opened.
+
+    """
+    if isinstance(call, tuple):
+        description = call[0].__name__
+    else:
+        description = " ".join([str(arg) for arg in call])
+    try:
+        errfile = open(logName + ".err", "a")
+        errfile.write("Could not run %s: %s\n" % (description, error))
+        errfile.close()
+    except (IOError, OSError):
+        pass
     return
 
+
+def _fileSize(files):
+    """
+    Returns the total size (in bytes) of those files that exist.
+
+    """
+    return sum([os.path.getsize(f) for f in files if os.path.isfile(f)])
+
+
+def _checkWindowStatus(outFiles, status, validate=True):
+    """
+    Checks whether every output file has a completion record and, if validate is
+    True, whether every output still matches its record.
+
+    """
+    if outFiles is None or len(outFiles) == 0:
+        return False
+    for outFile in outFiles:
+        record = status.get(os.path.basename(outFile))
+        if record is None:
+            return False
+        if validate and not _validOutput(outFile, record):
+            return False
+    return True
+
+
+def _checksum(outFile):
+    """
+    Returns the checksum of an output file, or None if it does not exist.
+
+    """
+    if not os.path.isfile(outFile):
+        return None
+    return cache.hashFile(outFile)
+
+
+def _outputRecord(usage):
+    """
+    Returns the completion record of a call: the size and checksum of its output.
+
+    """
+    return {"outputSize": usage["outputSize"],
+            "checksum": usage["checksum"]}
+
+
+def _validOutput(outFile, record):
+    """
+    Checks whether an output file is the complete output of a previous call: it
+    must exist and match the size and checksum in its completion record. Records
+    from older trackers are True rather than a dictionary, in which case only the
+    existence of the output is checked.
+
+    """
+    if record is None or record is False or not os.path.isfile(outFile):
+        return False
+    if record is True:
+        return True
+    if os.path.getsize(outFile) != record["outputSize"]:
+        return False
+    return cache.hashFile(outFile) == record["checksum"]
+
+
+def _runGraph(tasks, completed=None, onComplete=None, enableMultiprocessing=True, processes=8, cacheDir=None, verbose=VERBOSE):
+    """
+    Runs a dependency graph of MOPS calls. Tasks should be a dictionary keyed on task
+    name with (call, logName, dependencies) tuples as values. A task is launched as
+    soon as all of its dependencies have completed with at most processes tasks running
+    at once. Every dependency has to be a task in the graph.
+
+    If given, onComplete is called with the name and resource usage of every task
+    that completes successfully.
+
+    Returns the set of task names that failed or could not run because one of
+    their dependencies failed. Raises a ValueError if a dependency is not a task
+    in the graph.
+
+    """
+    for name, (call, logName, dependencies) in tasks.items():
+        unknown = [dependency for dependency in dependencies if dependency not in tasks]
+        if len(unknown) > 0:
+            raise ValueError("%s depends on %s, which are not tasks." % (str(name), ", ".join([str(u) for u in unknown])))
+
+    done = set(completed) if completed is not None else set()
+    waiting = dict((name, task) for name, task in tasks.items() if name not in done)
+    failed = set()
+    finished = queue.Queue()
+    running = 0
+
+    pool = None
+    if enableMultiprocessing and len(waiting) > 1:
+        if verbose:
+            print("Multiprocessing Enabled!")
+            print("Using %s CPUs in parallel." % (processes))
+        pool = multiprocessing.Pool(processes=processes)
+
+    while True:
+        ready = [name for name, (call, logName, dependencies) in waiting.items()
+                 if all(dependency in done for dependency in dependencies)]
+
+        for name in sorted(ready):
+            call, logName, dependencies = waiting.pop(name)
+            if pool is not None:
+                pool.apply_async(_runTask, ((name, call, logName, cacheDir),), callback=finished.put)
+            else:
+                finished.put(_runTask((name, call, logName, cacheDir)))
+            running += 1
+
+        if running == 0:
+            break
+
+        name, returncode, usage = finished.get()
+        running -= 1
+
+        if returncode == 0:
+            done.add(name)
+            if onComplete is not None:
+                onComplete(name, usage)
+        else:
+            failed.add(name)
+            if verbose:
+                print("%s failed with exit status %s." % (str(name), returncode))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # Anything still waiting depends on a task that failed
+    failed.update(waiting.keys())
+    return failed
+
+
 def _runArgs():
     """
     Helper function that runs commandline arguments.
@@ -1207,6 +2691,12 @@ def _runArgs():
     parser.add_argument("-v","--verbose", action="store_false",
         help="Enables/disables print output")
 
+    # Parameter sweep, run every combination of parameter values if given
+    parser.add_argument("--sweep", default=None,
+        help="""If given, will read a grid of parameter values from file (Parameters attribute: list of values) and run
+        every combination of them, each in its own run directory in the output directory. Stages variants have in common
+        are only run once. Parameters not in the grid are taken from the other arguments or config file.""")
+
     # findTracklets
     parser.add_argument("-vM", "--velocity_max", default=default.vMax, 
         help="Maximum velocity (used in findTracklets)")
@@ -1344,6 +2834,11 @@ if __name__ == "__main__":
         cfg = yaml.load(open(args.config_file, "r"))
         parameters = Parameters(**cfg)
 
+    if args.sweep is not None:
+        grid = yaml.safe_load(open(args.sweep, "r"))
+        runSweep(parameterGrid(grid, base=parameters), diasourcesDir, runDir, verbose=verbose)
+        sys.exit(0)
+
     # Initialize tracker
     tracker = Tracker(runDir)
     tracker.getDetections(diasourcesDir)